@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Deterministic corpus of synthetic company websites, served from local HTTP servers.
+
+Every site runs on its own port of 127.0.0.1, so the crawler sees each one as a separate host.
+One more server plays the external ATS host, the search engine and the IND register.
+"""
+from __future__ import annotations
+
+import gzip
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from website_resolver import normalize_company_name
+
+WORDS = ['over-ons', 'diensten', 'producten', 'projecten', 'team', 'duurzaamheid', 'locaties', 'klanten',
+         'innovatie', 'service', 'partners', 'geschiedenis', 'missie', 'markten', 'oplossingen', 'referenties']
+SECTORS = ['Bouw', 'ICT', 'Logistiek', 'Techniek', 'Zorg', 'Financiën']
+LEGAL_FORMS = ['B.V.', 'N.V.', 'Holding B.V.', '']
+
+
+class SiteSpec:
+    """Layout and behaviour of one synthetic company website."""
+
+    def __init__(self, index: int, rng: random.Random, depth: int, branching: int):
+        self.index = index
+        self.kvk = f'{90000000 + index:08d}'
+        self.name = f"{rng.choice(WORDS).replace('-', ' ').title()} {rng.choice(SECTORS)} {index} {rng.choice(LEGAL_FORMS)}".strip()
+        self.depth = depth
+        self.branching = branching
+        self.port = 0
+        # Page path -> child page paths
+        self.tree: Dict[str, List[str]] = dict()
+        self._build_tree('/', 0, rng)
+        pages = [path for path in self.tree if path != '/']
+        # Careers page: on an external ATS host for some sites, hidden deep in the tree for others
+        self.external_careers = rng.random() < 0.25
+        self.careers_parent = rng.choice(pages) if pages else '/'
+        self.careers_path = '/werken-bij'
+        self.has_careers = rng.random() < 0.9
+        self.slow = rng.random() < 0.1
+        self.throttling = rng.random() < 0.1
+        self.email = f'info@site{index}.test'
+        # Half the sites list their pages in a sitemap, half of those through a gzipped sitemap index.
+        # Derived from the index rather than rng, so the layout matches corpora from before sitemaps existed
+        self.has_sitemap = index % 2 == 0
+        self.sitemap_index = index % 4 == 0
+        self.requests = 0
+
+    def _build_tree(self, path: str, level: int, rng: random.Random):
+        children = []
+        if level < self.depth:
+            for _ in range(rng.randint(1, self.branching)):
+                child = f"{path.rstrip('/')}/{rng.choice(WORDS)}-{rng.randint(1, 999)}"
+                if child not in self.tree and child not in children:
+                    children.append(child)
+        self.tree[path] = children
+        for child in children:
+            self._build_tree(child, level + 1, rng)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}/'
+
+
+class Corpus:
+    """
+    The synthetic corpus plus the servers that serve it.
+
+    Use as a context manager; servers run on daemon threads until the corpus is closed.
+    """
+
+    def __init__(self, sites: int = 50, depth: int = 4, branching: int = 4, seed: int = 42,
+                 slow_delay: float = 0.2, binary_size: int = 2 * 1024 * 1024):
+        """
+        :param sites: Number of company websites.
+        :param depth: Maximum depth of each site's link tree.
+        :param branching: Maximum number of child pages per page.
+        :param seed: Seed for the layout, so every run serves the same corpus.
+        :param slow_delay: Seconds slow hosts wait before answering.
+        :param binary_size: Size in bytes of the binary downloads without a file extension.
+        """
+        rng = random.Random(seed)
+        self.sites = [SiteSpec(i, rng, depth, branching) for i in range(sites)]
+        self.slow_delay = slow_delay
+        self.binary = bytes(rng.getrandbits(8) for _ in range(1024)) * max(1, binary_size // 1024)
+        self.hub_port = 0
+        self._servers: List[ThreadingHTTPServer] = []
+
+    # Ground truth
+
+    def expected_careers_page(self, site: SiteSpec) -> Optional[str]:
+        if not site.has_careers:
+            return None
+        if site.external_careers:
+            return f'http://127.0.0.1:{self.hub_port}/ats/{site.kvk}/jobs'
+        return f'http://127.0.0.1:{site.port}{site.careers_path}'
+
+    @property
+    def register_url(self) -> str:
+        return f'http://127.0.0.1:{self.hub_port}/register'
+
+    @property
+    def search_url(self) -> str:
+        return f'http://127.0.0.1:{self.hub_port}'
+
+    # Pages
+
+    def site_page(self, site: SiteSpec, path: str) -> Optional[str]:
+        if path == site.careers_path and site.has_careers and not site.external_careers:
+            return '<html><body><h1>Vacatures</h1><a href="/werken-bij/engineer">Engineer</a></body></html>'
+        if path not in site.tree:
+            return None
+        links = [f'<a href="{child}">{child.rsplit("/", 1)[-1].replace("-", " ")}</a>' for child in site.tree[path]]
+        links.append('<a href="/">Home</a>')
+        links.append(f'<a href="mailto:{site.email}">Mail ons</a>')
+        links.append('<a href="/downloads/brochure.pdf">Brochure</a>')
+        links.append(f'<a href="/download?id={site.index}">Jaarverslag</a>')
+        links.append('<a href="https://www.linkedin.com/company/example">LinkedIn</a>')
+        links.append('<a href="/nieuws/latest">Nieuws</a>')
+        if path == site.careers_parent and site.has_careers:
+            if site.external_careers:
+                links.append(f'<a href="{self.expected_careers_page(site)}">Vacatures</a>')
+            else:
+                links.append(f'<a href="{site.careers_path}">Werken bij</a>')
+        filler = '<p>' + ' '.join(WORDS) * 20 + '</p>'
+        return f'<html><head><title>{site.name}</title></head><body><nav>{"".join(links)}</nav>{filler}</body></html>'
+
+    def robots_txt(self, site: SiteSpec) -> Optional[str]:
+        if not site.has_sitemap:
+            return None
+        sitemap = 'sitemap_index.xml' if site.sitemap_index else 'sitemap.xml'
+        return f'User-agent: *\nDisallow: /private/\nSitemap: {site.url}{sitemap}\n'
+
+    def sitemap(self, site: SiteSpec) -> str:
+        paths = list(site.tree)
+        if site.has_careers and not site.external_careers:
+            paths.append(site.careers_path)
+        urls = ''.join(f'<url><loc>http://127.0.0.1:{site.port}{path}</loc></url>' for path in paths)
+        return f'<?xml version="1.0" encoding="UTF-8"?>' \
+               f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'
+
+    def sitemap_index(self, site: SiteSpec) -> str:
+        return f'<?xml version="1.0" encoding="UTF-8"?>' \
+               f'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">' \
+               f'<sitemap><loc>{site.url}sitemap-pages.xml.gz</loc></sitemap></sitemapindex>'
+
+    def register_page(self) -> str:
+        rows = ''.join(f'<tr><td>{site.name}</td><td>{site.kvk}</td></tr>' for site in self.sites)
+        return f'<html><body><table><tbody><tr><th>Organisation</th><th>KvK</th></tr>{rows}</tbody></table></body></html>'
+
+    def search_page(self, query: str) -> str:
+        key = normalize_company_name(query)
+        for site in self.sites:
+            if normalize_company_name(site.name) == key:
+                return f'<html><body><a href="{site.url}">{site.name}</a></body></html>'
+        return '<html><body><a href="https://www.example.com/">No match</a></body></html>'
+
+    # Servers
+
+    def _site_handler(self, site: SiteSpec):
+        corpus = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                site.requests += 1
+                if site.slow:
+                    time.sleep(corpus.slow_delay)
+                # Throttling hosts answer every third request with a 429
+                if site.throttling and site.requests % 3 == 0:
+                    self.send_response(429)
+                    self.send_header('Retry-After', '1')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                parsed = urlparse(self.path)
+                if parsed.path == '/download' or parsed.path.endswith('.pdf'):
+                    self._send(corpus.binary, 'application/pdf')
+                    return
+                if parsed.path == '/robots.txt' and site.has_sitemap:
+                    self._send(corpus.robots_txt(site).encode('utf-8'), 'text/plain')
+                    return
+                if parsed.path == '/sitemap.xml' and site.has_sitemap and not site.sitemap_index:
+                    self._send(corpus.sitemap(site).encode('utf-8'), 'application/xml')
+                    return
+                if parsed.path == '/sitemap_index.xml' and site.sitemap_index:
+                    self._send(corpus.sitemap_index(site).encode('utf-8'), 'application/xml')
+                    return
+                if parsed.path == '/sitemap-pages.xml.gz' and site.sitemap_index:
+                    self._send(gzip.compress(corpus.sitemap(site).encode('utf-8')), 'application/gzip')
+                    return
+                page = corpus.site_page(site, parsed.path.rstrip('/') or '/')
+                if page is None:
+                    self.send_error(404)
+                    return
+                self._send(page.encode('utf-8'), 'text/html; charset=utf-8')
+
+            def _send(self, body: bytes, content_type: str):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The crawler hangs up on bodies it does not want, e.g. a PDF
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _hub_handler(self):
+        corpus = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                if parsed.path == '/register':
+                    body = corpus.register_page()
+                elif parsed.path == '/search':
+                    body = corpus.search_page(parse_qs(parsed.query).get('q', [''])[0])
+                elif parsed.path.startswith('/ats/'):
+                    body = '<html><body><h1>Open positions</h1></body></html>'
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _serve(self, handler) -> int:
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self._servers.append(server)
+        return server.server_address[1]
+
+    def start(self) -> 'Corpus':
+        self.hub_port = self._serve(self._hub_handler())
+        for site in self.sites:
+            site.port = self._serve(self._site_handler(site))
+        return self
+
+    def close(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+    def __enter__(self) -> 'Corpus':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
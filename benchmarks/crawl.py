@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the pipeline against the synthetic corpus in benchmarks/corpus.py.
+
+Drives scrape_companies.parse_table, find_company_website.get_website and JobCrawler (through CrawlEngine)
+against local servers and reports pages/sec, p50/p99 fetch latency, peak RSS and careers-page recall.
+
+Run from the repository root:
+    python -m benchmarks.crawl [--sites 50] [--json result.json] [--baseline previous.json]
+"""
+from __future__ import annotations
+
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+import find_company_website
+import scrape_companies
+from benchmarks.corpus import Corpus
+from company import Company
+from crawl_engine import CrawlEngine
+from fetcher import Fetcher
+from url_utils import canonicalize_url
+from website_resolver import LocalHTTPBackend, WebsiteResolver
+
+# Relative drop in a higher-is-better metric (or rise in a lower-is-better one) counted as a regression
+TOLERANCE = 0.2
+HIGHER_IS_BETTER = ('pages_per_second', 'careers_recall', 'register_rows_per_second')
+LOWER_IS_BETTER = ('fetch_p50_ms', 'fetch_p99_ms', 'lookup_p99_ms')
+# Latency changes smaller than this are noise on a local server
+MIN_LATENCY_DELTA_MS = 5.0
+
+
+class TimedFetcher(Fetcher):
+    """Fetcher that records the latency of every request."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.latencies: List[float] = []
+        self._latency_lock = threading.Lock()
+
+    def get(self, url: str, revalidate: bool = True, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().get(url, revalidate=revalidate, **kwargs)
+        finally:
+            with self._latency_lock:
+                self.latencies.append(time.perf_counter() - started)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def bench_register(corpus: Corpus) -> Dict[str, float]:
+    started = time.perf_counter()
+    soup = scrape_companies.fetch_webpage(corpus.register_url)
+    rows = scrape_companies.parse_table(soup)
+    elapsed = time.perf_counter() - started
+    assert len(rows) == len(corpus.sites), f"parse_table returned {len(rows)} of {len(corpus.sites)} rows"
+    return {'register_rows': len(rows), 'register_rows_per_second': len(rows) / elapsed}
+
+
+def bench_lookup(corpus: Corpus, directory: str) -> tuple:
+    find_company_website.resolver = WebsiteResolver(LocalHTTPBackend(corpus.search_url))
+    companies = []
+    latencies = []
+    for site in corpus.sites:
+        company = Company(name=site.name, kvk=site.kvk, file_path=os.path.join(directory, f'{site.kvk}.json'))
+        started = time.perf_counter()
+        find_company_website.get_website(company)
+        latencies.append(time.perf_counter() - started)
+        companies.append(company)
+    correct = sum(company.website == site.url for company, site in zip(companies, corpus.sites))
+    return companies, {'lookup_accuracy': correct / len(companies),
+                       'lookup_p50_ms': 1000 * percentile(latencies, 0.5),
+                       'lookup_p99_ms': 1000 * percentile(latencies, 0.99)}
+
+
+def bench_crawl(corpus: Corpus, companies: List[Company], concurrency: int, max_pages: int) -> Dict[str, float]:
+    fetcher = TimedFetcher(cache_path=None)
+    engine = CrawlEngine(concurrency=concurrency, per_host=1, force=True, report_interval=0,
+                         budget=dict(max_pages=max_pages, fetcher=fetcher))
+    started = time.perf_counter()
+    engine.run(companies)
+    elapsed = time.perf_counter() - started
+
+    expected = {site.kvk: corpus.expected_careers_page(site) for site in corpus.sites}
+    with_careers = [kvk for kvk, url in expected.items() if url]
+    found = sum(1 for company in companies if expected[company.kvk] and company.careers_page
+                and canonicalize_url(expected[company.kvk]) in company.careers_page)
+    return {
+        'pages': engine.pages,
+        'crawl_seconds': elapsed,
+        'pages_per_second': engine.pages / elapsed if elapsed else 0.0,
+        'fetch_p50_ms': 1000 * percentile(fetcher.latencies, 0.5),
+        'fetch_p99_ms': 1000 * percentile(fetcher.latencies, 0.99),
+        'careers_recall': found / len(with_careers) if with_careers else 1.0,
+    }
+
+
+def compare(result: dict, baseline: dict) -> List[str]:
+    """:return: Descriptions of the metrics that regressed against the baseline."""
+    regressions = []
+    for key in HIGHER_IS_BETTER:
+        if key in baseline and result[key] < baseline[key] * (1 - TOLERANCE):
+            regressions.append(f"{key}: {result[key]:.3f} < {baseline[key]:.3f}")
+    for key in LOWER_IS_BETTER:
+        if key in baseline and result[key] > baseline[key] * (1 + TOLERANCE) \
+                and result[key] - baseline[key] > MIN_LATENCY_DELTA_MS:
+            regressions.append(f"{key}: {result[key]:.3f} > {baseline[key]:.3f}")
+    return regressions
+
+
+def run(sites: int = 50, depth: int = 4, branching: int = 4, seed: int = 42, concurrency: int = 16,
+        max_pages: int = 200) -> dict:
+    result: Dict[str, float] = {'sites': sites}
+    with Corpus(sites=sites, depth=depth, branching=branching, seed=seed) as corpus, \
+            tempfile.TemporaryDirectory() as directory:
+        result.update(bench_register(corpus))
+        companies, lookup = bench_lookup(corpus, directory)
+        result.update(lookup)
+        result.update(bench_crawl(corpus, companies, concurrency, max_pages))
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+    import contextlib
+    import io
+
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--sites", type=int, default=50)
+    argparser.add_argument("--depth", type=int, default=4)
+    argparser.add_argument("--branching", type=int, default=4)
+    argparser.add_argument("--seed", type=int, default=42)
+    argparser.add_argument("--concurrency", type=int, default=16)
+    argparser.add_argument("--max-pages", type=int, default=200)
+    argparser.add_argument("--json", help="Write the results to this JSON file.")
+    argparser.add_argument("--baseline", help="Compare against a previous --json result and fail on regressions.")
+    argparser.add_argument("--verbose", action='store_true', help="Show the crawler's own output.")
+    args = argparser.parse_args()
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        result = run(args.sites, args.depth, args.branching, args.seed, args.concurrency, args.max_pages)
+
+    for key, value in result.items():
+        print(f"{key:<26} {value:,.3f}" if isinstance(value, float) else f"{key:<26} {value}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=4)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(result, json.load(f))
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
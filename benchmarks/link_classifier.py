@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the crawler's per-link classification: the original endswith chain versus LinkClassifier.
+
+Run from the repository root:
+    python -m benchmarks.link_classifier [--links 100000]
+"""
+from __future__ import annotations
+
+import random
+import time
+from typing import List, Tuple
+from urllib.parse import urljoin, urlparse
+
+from link_classifier import LinkClassifier
+from url_utils import canonical_host
+
+PAGE_URL = 'https://www.example.nl/over-ons/'
+
+
+def sample_links(count: int, seed: int = 0) -> List[Tuple[str, str]]:
+    """A deterministic mix of (href, text) pairs resembling a corporate site."""
+    rng = random.Random(seed)
+    hrefs = ['/', '/over-ons', '/werken-bij', '/vacatures/engineer', '/contact', '/nieuws/2024', '/blog/post',
+             '/downloads/jaarverslag.pdf', '/img/logo.svg', 'mailto:info@example.nl', '#top', 'javascript:void(0)',
+             'https://www.linkedin.com/company/example', 'https://example.wd3.myworkdayjobs.com/External',
+             '/producten/{}', '/diensten/{}?page=2', 'https://www.example.nl/projecten/{}/']
+    texts = ['Home', 'Over ons', 'Werken bij', 'Vacatures', 'Contact', 'Lees meer', 'Download', '', 'Careers']
+    return [(rng.choice(hrefs).format(rng.randint(1, 500)), rng.choice(texts)) for _ in range(count)]
+
+
+def normalize_url(url):
+    parsed_url = urlparse(url)
+    domain = parsed_url.netloc.replace('www.', '')
+    domain = domain.rstrip('/')
+    return f"{parsed_url.scheme}://{domain}"
+
+
+def legacy_classify(href: str, text: str, url: str, base_url: str):
+    """The per-link logic JobCrawler.crawl used before LinkClassifier."""
+    if href.endswith('.pdf') or href.endswith('.jpg') or href.endswith('.png') or href.endswith('.jpeg') \
+        or href.endswith('.gif') or href.endswith('.svg') or href.endswith('.webp') or href.endswith('.bmp') \
+        or href.endswith('.tiff') or href.endswith('.ico') or href.endswith('.mp4') or href.endswith('.avi') \
+        or href.endswith('.mov') or href.endswith('.mp3') or href.endswith('.wav') or href.endswith('.flac') \
+        or href.endswith('.ogg') or href.endswith('.doc') or href.endswith('.docx') or href.endswith('.xls') \
+        or href.endswith('.xlsx') or href.endswith('.ppt') or href.endswith('.pptx') or href.endswith('.odt') \
+        or href.endswith('.ods') or href.endswith('.odp') or href.endswith('.zip') or href.endswith('.rar') \
+        or href.endswith('.tar') or href.endswith('.gz') or href.endswith('.bz2') or href.endswith('.7z') \
+        or href.endswith('.dmg') or href.endswith('.exe') or href.endswith('.msi') or href.endswith('.apk') \
+        or href.endswith('.iso') or href.endswith('.img') or href.endswith('.csv') or href.endswith('.json') \
+        or href.endswith('.xml') or href.endswith('.sql') or href.endswith('.db') or href.endswith('.dbf'):
+        return None
+    if href.startswith('javascript:') or href.startswith('#'):
+        return None
+    if href.startswith('mailto:'):
+        return href.replace('mailto:', '')
+    if 'news' in href or 'blog' in href:
+        return None
+    keywords = ['career', 'werken bij',
+                'vacature', 'contact',
+                'contact us', 'contact form',
+                'sollicitatie', 'solliciteren',
+                'job',
+                'jobs', 'baan']
+    normalized_base_url = normalize_url(base_url)  # recomputed per page; per link is the worst case
+    full_url = urljoin(url, href)
+    career = any(keyword in text.lower() for keyword in keywords) or \
+        any(keyword in href.lower() for keyword in keywords)
+    return full_url, career, normalized_base_url != normalize_url(full_url)
+
+
+def bench(label: str, function, links: List[Tuple[str, str]], *args) -> float:
+    started = time.perf_counter()
+    for href, text in links:
+        function(href, text, *args)
+    elapsed = time.perf_counter() - started
+    rate = len(links) / elapsed
+    print(f"{label:<16} {len(links)} links in {elapsed:.3f}s  {rate:,.0f} links/s")
+    return rate
+
+
+if __name__ == "__main__":
+    import argparse
+
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--links", type=int, default=100000)
+    args = argparser.parse_args()
+
+    links = sample_links(args.links)
+    before = bench('endswith chain', legacy_classify, links, PAGE_URL, PAGE_URL)
+    classifier = LinkClassifier()
+    after = bench('LinkClassifier', classifier.classify, links, PAGE_URL, canonical_host(PAGE_URL))
+    print(f"Speed-up: {after / before:.2f}x")
@@ -5,12 +5,21 @@ from __future__ import annotations
 import json
 import os
 from typing import List, Optional, Union
+from url_utils import VisitedSet
+
+# Persisted fields, in the order they are written to JSON
+FIELDS = ('name', 'kvk', 'website', 'careers_page', 'address', 'sector', 'delisted', 'crawled_at',
+          'external_links', 'emails', 'visited')
+# Potentially large list fields, only loaded when asked for by a projection.
+# save_to_json must keep writing these last, see utils.parse_projected.
+LIST_FIELDS = ('external_links', 'emails', 'visited')
 
 class Company:
     def __init__(self, name: str, kvk: str, website: Optional[str] = None,
                  careers_page: Optional[str] = None, address: Optional[str] = None,
                  sector: Optional[str] = None, file_path: Optional[str] = None, external_links: Optional[List[str]] = None,
-                 emails: Optional[List[str]] = None, visited: Optional[List[str]] = None):
+                 emails: Optional[List[str]] = None, visited: Union[None, str, List[str], VisitedSet] = None,
+                 delisted: Optional[str] = None, crawled_at: Optional[str] = None):
         self.name = name
         self.kvk = kvk
         self.website = website
@@ -18,9 +27,24 @@ class Company:
         self.address = address
         self.sector = sector
         self.file_path = file_path
-        self.external_links = set()
-        self.emails = set()
-        self.visited = set()
+        # ISO date on which the company disappeared from the IND register, None while listed
+        self.delisted = delisted
+        # ISO timestamp of the last completed crawl, also when it found no careers page
+        self.crawled_at = crawled_at
+        self.external_links = set(external_links or [])
+        self.emails = set(emails or [])
+        # Fingerprints of the canonical URLs crawled, see url_utils.VisitedSet
+        self.visited = VisitedSet.from_value(visited)
+        # CompanyStore this record was loaded from, if any; save() writes back to it
+        self.store = None
+        # Fields left out by a projected load; saving keeps their stored values
+        self.unloaded = set()
+
+    def __setattr__(self, name, value):
+        # Assigning a field that a projected load left out makes it part of the record again
+        if name in FIELDS and self.__dict__.get('unloaded'):
+            self.unloaded.discard(name)
+        super().__setattr__(name, value)
 
     def __repr__(self):
         return f"Company(name={self.name}, kvk={self.kvk}, website={self.website}, " \
@@ -61,27 +85,47 @@ class Company:
             external_links=data.get('external_links'),
             emails=data.get('emails'),
             visited=data.get('visited'),
+            delisted=data.get('delisted'),
+            crawled_at=data.get('crawled_at'),
             file_path=path
         )
     
+    def save(self):
+        """Save the company to the store it was loaded from, or to its JSON file."""
+        if self.store is not None:
+            self.store.upsert(self)
+        else:
+            self.save_to_json()
+
     def save_to_json(self, filepath: Optional[str] = None):
         """Save a Company instance to a JSON file."""
         if filepath is None:
             if self.file_path is None:
                 raise ValueError("File path must be provided.")
             filepath = self.file_path
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump({
-                'name': self.name,
-                'kvk': self.kvk,
-                'website': self.website,
-                'careers_page': self.careers_page,
-                'address': self.address,
-                'sector': self.sector,
-                'external_links': list(self.external_links),
-                'emails': list(self.emails),
-                'visited': list(self.visited)
-            }, f, indent=4)
+        data = {
+            'name': self.name,
+            'kvk': self.kvk,
+            'website': self.website,
+            'careers_page': self.careers_page,
+            'address': self.address,
+            'sector': self.sector,
+            'delisted': self.delisted,
+            'crawled_at': self.crawled_at,
+            'external_links': list(self.external_links),
+            'emails': list(self.emails),
+            'visited': self.visited.to_string()
+        }
+        if self.unloaded and os.path.isfile(filepath):
+            with open(filepath, 'r', encoding='utf-8') as f:
+                existing = json.load(f)
+            for field in self.unloaded:
+                data[field] = existing.get(field)
+        # Write to a temporary file first so an interrupted save never leaves a truncated record
+        tmp_path = f"{filepath}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, filepath)
 
 # # Example usage
 # if __name__ == "__main__":
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+from company import Company
+from url_utils import VisitedSet
+
+DEFAULT_STORE_PATH = 'companies.sqlite'
+
+# Columns holding lists, stored as JSON text
+LIST_COLUMNS = ('careers_page', 'external_links', 'emails', 'visited')
+COLUMNS = ('kvk', 'name', 'website', 'careers_page', 'address', 'sector', 'delisted', 'crawled_at', 'external_links',
+           'emails', 'visited')
+
+
+class CompanyStore:
+    """
+    Single-file SQLite store for company records, replacing the directory of <kvk>.json files.
+
+    The database runs in WAL mode so readers are not blocked by a writer, and has indexes on kvk,
+    on whether a company has a website or a careers page, and on when a company was last written.
+    """
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self.closed = False
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS companies (
+                kvk TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                website TEXT,
+                careers_page TEXT,
+                address TEXT,
+                sector TEXT,
+                delisted TEXT,
+                crawled_at TEXT,
+                external_links TEXT,
+                emails TEXT,
+                visited TEXT,
+                has_website INTEGER NOT NULL DEFAULT 0,
+                has_careers_page INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_companies_has_website ON companies (has_website);
+            CREATE INDEX IF NOT EXISTS idx_companies_has_careers_page ON companies (has_careers_page);
+        ''')
+        # Stores created before a column was added
+        existing = {row[1] for row in self.db.execute('PRAGMA table_info(companies)')}
+        for column in COLUMNS:
+            if column not in existing:
+                self.db.execute(f'ALTER TABLE companies ADD COLUMN {column} TEXT')
+        if 'updated_at' not in existing:
+            self.db.execute('ALTER TABLE companies ADD COLUMN updated_at REAL')
+            self.db.execute('UPDATE companies SET updated_at = ?', (time.time(),))
+        self.db.execute('CREATE INDEX IF NOT EXISTS idx_companies_updated_at ON companies (updated_at)')
+        self.db.commit()
+
+    def __getstate__(self) -> dict:
+        # Connections cannot be pickled; worker processes reopen the same file
+        return {'path': self.path}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state['path'])
+
+    def __enter__(self) -> 'CompanyStore':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+            self.closed = True
+
+    def _columns(self, fields: Optional[Iterable[str]]) -> Sequence[str]:
+        return COLUMNS if fields is None else ('kvk', 'name') + tuple(f for f in COLUMNS[2:] if f in set(fields))
+
+    def _row(self, company: Company) -> tuple:
+        def as_json(value):
+            if value is None:
+                return None
+            if isinstance(value, VisitedSet):
+                value = value.to_string()
+            elif isinstance(value, (set, frozenset, tuple)):
+                value = list(value)
+            return json.dumps(value)
+
+        if company.unloaded:
+            # Keep the stored values of fields a projected load left out
+            unloaded = tuple(company.unloaded)
+            with self._lock:
+                stored = self.db.execute(f'SELECT {", ".join(unloaded)} FROM companies WHERE kvk = ?',
+                                         (company.kvk,)).fetchone()
+            if stored:
+                company = copy.copy(company)
+                # Its own set: each setattr below discards from it, the caller's must stay as it is
+                company.unloaded = set(company.unloaded)
+                for field, value in zip(unloaded, stored):
+                    setattr(company, field, json.loads(value) if value and field in LIST_COLUMNS else value)
+                company.unloaded = set()
+
+        return (company.kvk, company.name, company.website, as_json(company.careers_page), company.address,
+                company.sector, company.delisted, company.crawled_at, as_json(company.external_links),
+                as_json(company.emails), as_json(company.visited), int(bool(company.website)),
+                int(bool(company.careers_page)))
+
+    def _company(self, row: sqlite3.Row, columns: Sequence[str] = COLUMNS) -> Company:
+        data = dict(zip(columns, row))
+        for column in LIST_COLUMNS:
+            if data.get(column) is not None:
+                data[column] = json.loads(data[column])
+        company = Company.from_json(data)
+        company.store = self
+        company.unloaded = set(COLUMNS) - set(columns)
+        return company
+
+    def upsert(self, company: Company):
+        """Insert or replace a single company."""
+        self.upsert_many([company])
+
+    def upsert_many(self, companies: Iterable[Company]) -> int:
+        """
+        Insert or replace companies in a single transaction.
+        :return: Number of companies written.
+        """
+        if self.closed:
+            # Companies loaded through a store that was closed since, e.g. by the end of utils.iter_companies
+            with CompanyStore(self.path) as store:
+                return store.upsert_many(companies)
+        now = time.time()
+        rows = [self._row(company) + (now,) for company in companies]
+        with self._lock, self.db:
+            self.db.executemany(f'INSERT OR REPLACE INTO companies ({", ".join(COLUMNS)}, has_website, '
+                                f'has_careers_page, updated_at) VALUES ({", ".join("?" * (len(COLUMNS) + 3))})',
+                                rows)
+        return len(rows)
+
+    def set_websites(self, websites: Iterable[tuple]) -> int:
+        """
+        Set the website of companies in a single transaction, leaving their other columns alone.
+        :param websites: (kvk, website) pairs.
+        :return: Number of companies updated.
+        """
+        now = time.time()
+        rows = [(website, int(bool(website)), now, kvk) for kvk, website in websites]
+        with self._lock, self.db:
+            return self.db.executemany('UPDATE companies SET website = ?, has_website = ?, updated_at = ? '
+                                       'WHERE kvk = ?', rows).rowcount
+
+    def get(self, kvk: str, fields: Optional[Iterable[str]] = None) -> Optional[Company]:
+        """:param fields: Fields to load besides name and kvk, None for all of them."""
+        columns = self._columns(fields)
+        with self._lock:
+            row = self.db.execute(f'SELECT {", ".join(columns)} FROM companies WHERE kvk = ?', (kvk,)).fetchone()
+        return self._company(row, columns) if row else None
+
+    def kvks(self) -> set:
+        """All kvk numbers in the store."""
+        with self._lock:
+            return {row[0] for row in self.db.execute('SELECT kvk FROM companies')}
+
+    def register_entries(self) -> dict:
+        """All kvk numbers in the store, mapped to (name, delisted), in one query."""
+        with self._lock:
+            return {kvk: (name, delisted) for kvk, name, delisted in
+                    self.db.execute('SELECT kvk, name, delisted FROM companies')}
+
+    def _where(self, has_website: Optional[bool], has_careers_page: Optional[bool],
+               changed_since: Optional[float] = None) -> tuple:
+        clauses, params = [], []
+        if changed_since is not None:
+            clauses.append('updated_at >= ?')
+            params.append(changed_since)
+        if has_website is not None:
+            clauses.append('has_website = ?')
+            params.append(int(has_website))
+        if has_careers_page is not None:
+            clauses.append('has_careers_page = ?')
+            params.append(int(has_careers_page))
+        return (f' WHERE {" AND ".join(clauses)}' if clauses else ''), params
+
+    def count(self, has_website: Optional[bool] = None, has_careers_page: Optional[bool] = None) -> int:
+        where, params = self._where(has_website, has_careers_page)
+        with self._lock:
+            return self.db.execute(f'SELECT COUNT(*) FROM companies{where}', params).fetchone()[0]
+
+    def load(self, has_website: Optional[bool] = None, has_careers_page: Optional[bool] = None) -> List[Company]:
+        """
+        Load companies, optionally only those with or without a website or careers page.
+        e.g. store.load(has_website=False) returns the companies that still need a website lookup.
+        """
+        where, params = self._where(has_website, has_careers_page)
+        with self._lock:
+            rows = self.db.execute(f'SELECT {", ".join(COLUMNS)} FROM companies{where} ORDER BY kvk',
+                                   params).fetchall()
+        return [self._company(row) for row in rows]
+
+    def iter(self, has_website: Optional[bool] = None, has_careers_page: Optional[bool] = None,
+             fields: Optional[Iterable[str]] = None, changed_since: Optional[float] = None,
+             batch_size: int = 500) -> Iterator[Company]:
+        """
+        Stream companies matching the filters, reading only the projected columns.
+        :param fields: Fields to load besides name and kvk, None for all of them.
+        :param changed_since: Only companies written at or after this time.time(), None for all of them.
+        :param batch_size: Number of rows fetched from SQLite at a time.
+        """
+        columns = self._columns(fields)
+        where, params = self._where(has_website, has_careers_page, changed_since)
+        # A separate cursor on its own connection so callers can save while iterating
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            cursor = db.execute(f'SELECT {", ".join(columns)} FROM companies{where} ORDER BY kvk', params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield self._company(row, columns)
+        finally:
+            db.close()
+
+    def import_json_dir(self, directory: str = './companies', batch_size: int = 1000) -> int:
+        """
+        Import every <kvk>.json file from a directory, in batched transactions.
+        :return: Number of companies imported.
+        """
+        imported = 0
+        batch: List[Company] = []
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                batch.append(Company.from_json(os.path.join(directory, filename)))
+            except ValueError as e:
+                print(f"Skipping {filename}: {e}")
+                continue
+            if len(batch) >= batch_size:
+                imported += self.upsert_many(batch)
+                batch = []
+        imported += self.upsert_many(batch)
+        return imported
+
+    def export_json_dir(self, directory: str = './companies') -> int:
+        """
+        Write every company back out as <kvk>.json.
+        :return: Number of companies exported.
+        """
+        os.makedirs(directory, exist_ok=True)
+        companies = self.load()
+        for company in companies:
+            company.save_to_json(os.path.join(directory, f'{company.kvk}.json'))
+        return len(companies)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    argparser = argparse.ArgumentParser(description="Import or export the company store.")
+    argparser.add_argument("action", choices=['import', 'export'],
+                           help="import: JSON directory -> store, export: store -> JSON directory.")
+    argparser.add_argument("--directory", default='./companies', help="Directory of <kvk>.json files.")
+    argparser.add_argument("--store", default=DEFAULT_STORE_PATH, help="Path of the SQLite store.")
+    args = argparser.parse_args()
+
+    with CompanyStore(args.store) as store:
+        if args.action == 'import':
+            print(f"Imported {store.import_json_dir(args.directory)} companies into {args.store}")
+        else:
+            print(f"Exported {store.export_json_dir(args.directory)} companies to {args.directory}")
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set
+
+from company import Company
+from crawl_journal import DONE, FAILED, STARTED, CrawlJournal
+from link_classifier import ats_vendor_for_host
+from metrics import get_metrics
+from scrape_website_links import JobCrawler, prepare_crawler, store_crawl_results
+from url_utils import canonical_host, canonicalize_url
+
+# Hosts with pages of many unrelated companies, which a website lookup sometimes returns instead of the
+# company's own site. Companies on these are never grouped, even with the same start URL.
+SHARED_HOSTS = frozenset([
+    'linkedin.com', 'facebook.com', 'instagram.com', 'twitter.com', 'x.com', 'youtube.com', 'google.com',
+    'kvk.nl', 'drimble.nl', 'oozo.nl', 'bedrijvenpagina.nl', 'telefoonboek.nl', 'openingstijden.nl',
+    'indeed.com', 'nl.indeed.com', 'glassdoor.com', 'glassdoor.nl', 'werkzoeken.nl', 'wikipedia.org',
+    'nl.wikipedia.org', 'en.wikipedia.org',
+])
+
+
+class CrawlEngine:
+    """
+    Run many JobCrawler crawls at once.
+
+    Crawls are scheduled on an asyncio event loop and executed on a thread pool,
+    limited by a global concurrency limit and a per-host limit. Results are
+    written through company.save(), to the SQLite store or JSON file the company was loaded from.
+
+    With a CrawlJournal, progress is journaled per company and crawls are checkpointed,
+    so a run that is interrupted (e.g. with Ctrl-C) continues where it stopped when restarted.
+
+    Companies sharing a website (subsidiaries, holdings) are crawled once per run; the results
+    are copied to every company with the same start URL, see group_by_site.
+    """
+
+    def __init__(self, concurrency: int = 16, per_host: int = 1, force: bool = False,
+                 report_interval: float = 5.0, budget: Optional[dict] = None,
+                 journal: Optional[CrawlJournal] = None, dedup: bool = True):
+        """
+        :param concurrency: Maximum number of crawls running at the same time.
+        :param per_host: Maximum number of crawls running against the same host.
+        :param force: Ignore previously stored crawl results.
+        :param report_interval: Seconds between pages/second reports, 0 to disable.
+        :param budget: Per-site crawl budget passed to each JobCrawler (max_pages, max_depth, time_budget, stop_on_career).
+        :param journal: Run journal and checkpoint store, None to disable resuming.
+        :param dedup: Crawl each site once, however many companies share it.
+        """
+        self.concurrency = max(1, concurrency)
+        self.per_host = max(1, per_host)
+        self.force = force
+        self.report_interval = report_interval
+        self.budget = budget or dict()
+        self.journal = journal
+        self.dedup = dedup
+        # Companies that got the results of another company's crawl, and the fetches that saved
+        self.shared = 0
+        self.fetches_saved = 0
+        self.run_id: Optional[int] = None
+        self.resumed = 0
+        self.pages_done = 0
+        self.parsed_done = 0
+        self.parse_seconds_done = 0.0
+        self.companies_done = 0
+        # Fetches cut short by finished crawls, by reason, see JobCrawler.aborted
+        self.aborted_done: Dict[str, int] = dict()
+        self.active: Set[JobCrawler] = set()
+        self.career_links: Dict[str, Set[str]] = dict()
+        # kvk numbers of the companies whose crawl finished and was stored
+        self.completed: Set[str] = set()
+        self._host_limits: Dict[str, asyncio.Semaphore] = dict()
+        self._started = 0.0
+
+    @property
+    def pages(self) -> int:
+        """Pages fetched so far in this run, including crawls still in progress."""
+        return self.pages_done + sum(crawler.pages_fetched - crawler.resumed_pages for crawler in list(self.active))
+
+    def parse_ms_per_page(self) -> float:
+        crawlers = list(self.active)
+        parsed = self.parsed_done + sum(crawler.extractor.pages for crawler in crawlers)
+        seconds = self.parse_seconds_done + sum(crawler.extractor.seconds for crawler in crawlers)
+        return 1000 * seconds / parsed if parsed else 0.0
+
+    def aborted(self) -> int:
+        """Fetches cut short so far, including crawls still in progress."""
+        return sum(self.aborted_done.values()) + sum(sum(crawler.aborted.values()) for crawler in list(self.active))
+
+    def pages_per_second(self) -> float:
+        elapsed = time.monotonic() - self._started
+        return self.pages / elapsed if elapsed > 0 else 0.0
+
+    def report(self, total: int):
+        print(f"[{self.companies_done}/{total} companies] {self.pages} pages, "
+              f"{self.pages_per_second():.1f} pages/s, {self.parse_ms_per_page():.1f} ms parse/page, "
+              f"{self.aborted()} aborted fetches, "
+              f"{len(self.active)} active crawls")
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        try:
+            host = canonical_host(url)
+        except ValueError:
+            # Invalid port; the crawl itself fails on it
+            host = url
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host)
+        return self._host_limits[host]
+
+    async def _crawl_company(self, company: Company, global_limit: asyncio.Semaphore,
+                             executor: ThreadPoolExecutor, seed: bool = True):
+        """:param seed: Seed the crawler with the company's stored results, see prepare_crawler."""
+        loop = asyncio.get_running_loop()
+        metrics = get_metrics()
+        # Take the host slot first so a crawl waiting on a busy host does not hold a global slot
+        async with self._host_limit(company.website), global_limit:
+            print(f"Crawling for company: {company.name}")
+            crawler = prepare_crawler(company, self.force or not seed, **self.budget)
+            if self.journal:
+                self._attach_journal(company, crawler)
+            self.active.add(crawler)
+            try:
+                with metrics.gauge('crawls_in_flight', 'Company crawls currently running').track(), \
+                        metrics.histogram('crawl_seconds', 'Wall-clock seconds per company crawl',
+                                          buckets=(1, 5, 10, 30, 60, 120, 300, 600)).time():
+                    await loop.run_in_executor(executor, crawler.crawl, company.website)
+            except asyncio.CancelledError:
+                # Interrupted: the crawl checkpoints and returns after its current page,
+                # the executor waits for that before shutting down
+                crawler.stop()
+                raise
+            finally:
+                self.active.discard(crawler)
+                # Pages fetched before a resume were counted by the run that fetched them
+                self.pages_done += crawler.pages_fetched - crawler.resumed_pages
+                self.parsed_done += crawler.extractor.pages
+                self.parse_seconds_done += crawler.extractor.seconds
+                for reason, count in crawler.aborted.items():
+                    self.aborted_done[reason] = self.aborted_done.get(reason, 0) + count
+                self.companies_done += 1
+                metrics.counter('companies_done_total', 'Companies crawled').inc()
+        self._finish(company, crawler)
+        return crawler
+
+    async def _crawl_site(self, companies: List[Company], global_limit: asyncio.Semaphore,
+                          executor: ThreadPoolExecutor):
+        """Crawl the site of the first company and share the results with the others on the same site."""
+        # A shared crawl starts empty, the first company's stored emails and links are not the others'
+        crawler = await self._crawl_company(companies[0], global_limit, executor, seed=len(companies) == 1)
+        for company in companies[1:]:
+            print(f"Sharing crawl of {companies[0].name} with {company.name}")
+            self.companies_done += 1
+            self.shared += 1
+            # As in pages_done, pages fetched before a resume belong to the run that fetched them
+            fetched = crawler.pages_fetched - crawler.resumed_pages
+            self.fetches_saved += fetched
+            get_metrics().counter('fetches_saved_total', 'Fetches saved by sharing a crawl between companies').inc(
+                fetched)
+            self._finish(company, crawler)
+
+    def _finish(self, company: Company, crawler: JobCrawler):
+        if store_crawl_results(company, crawler):
+            self.career_links[company.name] = crawler.career_links
+        self.completed.add(company.kvk)
+        if self.journal:
+            self.journal.record(self.run_id, company.kvk, DONE, crawler.pages_fetched)
+            self.journal.clear_checkpoint(company.kvk)
+
+    def group_by_site(self, companies: List[Company]) -> List[List[Company]]:
+        """
+        Group companies by the canonical URL of their website, lowest kvk first so the same company
+        leads (and owns the checkpoint of) a group across restarts. Websites on SHARED_HOSTS or an
+        applicant tracking system belong to one company each and are not grouped.
+        """
+        if not self.dedup:
+            return [[company] for company in companies]
+        groups: Dict[str, List[Company]] = dict()
+        for company in sorted(companies, key=lambda company: company.kvk):
+            try:
+                site = canonicalize_url(company.website)
+                host = canonical_host(company.website).split(':', 1)[0]
+            except ValueError:
+                site = host = company.website
+            if host in SHARED_HOSTS or ats_vendor_for_host(host):
+                site = f"{site}\0{company.kvk}"
+            groups.setdefault(site, []).append(company)
+        return list(groups.values())
+
+    def _attach_journal(self, company: Company, crawler: JobCrawler):
+        state = self.journal.load_checkpoint(company.kvk)
+        if state and crawler.restore(state):
+            print(f"Resuming {company.name} from checkpoint after {crawler.pages_fetched} pages")
+            self.resumed += 1
+        self.journal.record(self.run_id, company.kvk, STARTED, crawler.pages_fetched)
+        crawler.on_checkpoint = lambda crawler, started: self.journal.save_checkpoint(
+            self.run_id, company.kvk, crawler.state(started))
+
+    async def _reporter(self, total: int):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.report(total)
+
+    async def crawl_all(self, companies: Iterable[Company]) -> Dict[str, Set[str]]:
+        """Crawl all companies and return the career links found, keyed by company name."""
+        companies: List[Company] = [company for company in companies if company.website]
+        if self.journal:
+            self.run_id, resumed = self.journal.start_run()
+            if resumed:
+                completed = self.journal.completed(self.run_id)
+                print(f"Resuming run {self.run_id}, {len(completed)} companies already done")
+                companies = [company for company in companies if company.kvk not in completed]
+        self._started = time.monotonic()
+        global_limit = asyncio.Semaphore(self.concurrency)
+        reporter: Optional[asyncio.Task] = None
+        if self.report_interval > 0:
+            reporter = asyncio.create_task(self._reporter(len(companies)))
+
+        groups = self.group_by_site(companies)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = await asyncio.gather(
+                *(self._crawl_site(group, global_limit, executor) for group in groups),
+                return_exceptions=True)
+        for group, result in zip(groups, results):
+            if isinstance(result, Exception):
+                print(f"Crawl failed for {group[0].name}: {result}")
+                if self.journal:
+                    for company in group:
+                        self.journal.record(self.run_id, company.kvk, FAILED)
+
+        if reporter:
+            reporter.cancel()
+        self.report(len(companies))
+        if self.aborted_done:
+            print("Aborted fetches: " + ', '.join(f"{count} {reason}" for reason, count in
+                                                  sorted(self.aborted_done.items())))
+        if self.shared:
+            print(f"Crawled {len(groups)} sites for {len(companies)} companies: {self.shared} companies shared "
+                  f"another company's crawl, saving {self.fetches_saved} fetches")
+        if self.journal:
+            self.journal.finish_run(self.run_id)
+            print(self.journal.summary(self.run_id))
+        return self.career_links
+
+    def run(self, companies: Iterable[Company]) -> Dict[str, Set[str]]:
+        return asyncio.run(self.crawl_all(companies))
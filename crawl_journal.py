@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Optional, Set
+
+DEFAULT_JOURNAL_PATH = 'crawl_journal.sqlite'
+
+# Journal statuses of a company within a run
+STARTED = 'started'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class CrawlJournal:
+    """
+    Run journal and per-company crawl checkpoints, so an interrupted crawl run can be resumed.
+
+    A run stays open until it finishes; starting a new run while one is open resumes it, skipping the
+    companies it already completed. Crawls in progress are checkpointed (frontier, visited set and
+    results so far) and continue from their checkpoint instead of starting over.
+    """
+
+    def __init__(self, path: str = DEFAULT_JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at REAL NOT NULL,
+                finished_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS journal (
+                run_id INTEGER NOT NULL,
+                kvk TEXT NOT NULL,
+                status TEXT NOT NULL,
+                pages INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (run_id, kvk)
+            );
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                kvk TEXT PRIMARY KEY,
+                run_id INTEGER NOT NULL,
+                state BLOB NOT NULL,
+                updated_at REAL NOT NULL
+            );
+        ''')
+        self.db.commit()
+
+    def __enter__(self) -> 'CrawlJournal':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    def start_run(self) -> tuple:
+        """
+        Open a new run, or resume the last one if it never finished.
+        :return: (run_id, resumed)
+        """
+        with self._lock, self.db:
+            row = self.db.execute('SELECT run_id, finished_at FROM runs ORDER BY run_id DESC LIMIT 1').fetchone()
+            if row and row[1] is None:
+                return row[0], True
+            cursor = self.db.execute('INSERT INTO runs (started_at) VALUES (?)', (time.time(),))
+            return cursor.lastrowid, False
+
+    def finish_run(self, run_id: int):
+        with self._lock, self.db:
+            self.db.execute('UPDATE runs SET finished_at = ? WHERE run_id = ?', (time.time(), run_id))
+
+    def record(self, run_id: int, kvk: str, status: str, pages: int = 0):
+        with self._lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO journal VALUES (?, ?, ?, ?, ?)',
+                            (run_id, kvk, status, pages, time.time()))
+
+    def completed(self, run_id: int) -> Set[str]:
+        """kvk numbers of the companies the run already finished."""
+        with self._lock:
+            return {row[0] for row in self.db.execute('SELECT kvk FROM journal WHERE run_id = ? AND status = ?',
+                                                      (run_id, DONE))}
+
+    def counts(self, run_id: int) -> Dict[str, int]:
+        """Number of companies per status in a run."""
+        with self._lock:
+            return dict(self.db.execute('SELECT status, COUNT(*) FROM journal WHERE run_id = ? GROUP BY status',
+                                        (run_id,)).fetchall())
+
+    def save_checkpoint(self, run_id: int, kvk: str, state: dict):
+        with self._lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)',
+                            (kvk, run_id, zlib.compress(json.dumps(state).encode('utf-8')), time.time()))
+
+    def load_checkpoint(self, kvk: str) -> Optional[dict]:
+        with self._lock:
+            row = self.db.execute('SELECT state FROM checkpoints WHERE kvk = ?', (kvk,)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def clear_checkpoint(self, kvk: str):
+        with self._lock, self.db:
+            self.db.execute('DELETE FROM checkpoints WHERE kvk = ?', (kvk,))
+
+    def summary(self, run_id: int) -> str:
+        counts = self.counts(run_id)
+        with self._lock:
+            checkpoints = self.db.execute('SELECT COUNT(*) FROM checkpoints').fetchone()[0]
+        return f"Run {run_id}: {counts.get(DONE, 0)} done, {counts.get(FAILED, 0)} failed, " \
+               f"{counts.get(STARTED, 0)} unfinished, {checkpoints} checkpoints pending"
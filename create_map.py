@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 from __future__ import annotations
+import hashlib
+import html
+import json
 import os
+import time
 import geopy
 import folium
 import webbrowser
-import json
-
-# Create a geocoder object
-geolocator = geopy.Nominatim(user_agent="Job_scraper_2024")
+from folium.plugins import FastMarkerCluster
+from typing import Dict, List, Optional
+from geocoding import BatchGeocoder, GeocodeCache, OfflineGeocoder
+from metrics import get_metrics
+from utils import iter_companies
 
 # # Ask the user to input multiple locations separated by commas
 # locations = input("Enter multiple locations separated by commas: ").split(',')
@@ -30,49 +35,175 @@ home_locations = [
 # }
 # empty parts are = null
 # generate a map of companies if they have an address that isn't null and add them to the map
-# {code}
-map = folium.Map(zoom_start=13)
-# List to store the coordinates (latitude, longitude) for bounding box
-bounds = []
-
-# Loop through all the locations and add them to the map
-i=0
-for location in home_locations:
-    location = location.strip()  # Remove extra spaces
-    h = geolocator.geocode(location)
-    if h:
-        # Store the latitude and longitude for each location
-        coords = [h.latitude, h.longitude]
-        bounds.append(coords)
-        
-        # Add marker to the map
-        folium.Marker(coords, tooltip='Vadim' if i==0 else 'Farrukh', popup=location, icon=folium.Icon(icon='home')).add_to(map)
-        i+=1
+def has_address(company) -> bool:
+    return bool(company.address)
+
+
+# Client-side marker for the clustered layer; each row is [latitude, longitude, popup]
+MARKER_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindPopup(row[2]);
+    return marker;
+};
+"""
+
+
+def feature_digest(company) -> str:
+    """Digest of everything a company's map feature is built from."""
+    key = json.dumps([company.name, company.website, company.address, company.sector, bool(company.careers_page)])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def load_layer(path: str) -> Dict[str, dict]:
+    """Load a previously built layer, as features keyed by kvk."""
+    if not os.path.isfile(path):
+        return dict()
+    with open(path, 'r', encoding='utf-8') as f:
+        return {feature['id']: feature for feature in json.load(f)['features']}
+
+
+def build_layer(geocoder: BatchGeocoder, path: str = 'companies.geojson') -> List[dict]:
+    """
+    Build or update the precomputed GeoJSON layer of all companies with an address.
+    Only companies whose map-relevant fields changed since the last build are geocoded and re-emitted.
+    A company whose geocode failed keeps its previous feature, if any, and is retried on the next build.
+    One whose address was not found is retried once the geocode cache's negative entry for it expired.
+    :return: The features of the layer.
+    """
+    previous = load_layer(path)
+    features: Dict[str, dict] = dict()
+    changed = []
+    now = time.time()
+    for company in iter_companies(where=has_address, fields=('address', 'website', 'sector', 'careers_page')):
+        digest = feature_digest(company)
+        feature = previous.get(company.kvk)
+        # Not found before: retry_at is None if it is never retried, missing from layers written before it was kept
+        retry_at = feature['properties'].get('retry_at', 0) if feature and feature['geometry'] is None else None
+        if feature and feature['properties']['digest'] == digest and (retry_at is None or retry_at > now):
+            features[company.kvk] = feature
+        else:
+            changed.append((company, digest))
+
+    coordinates = geocoder.geocode_all([company.address for company, _ in changed])
+    retry_times = geocoder.retry_times([address for address, coords in coordinates.items() if coords is None])
+    unchanged, failed = len(features), 0
+    for company, digest in changed:
+        if company.address not in coordinates:
+            # The geocode failed, not cached: its digest is not stored so it is retried next build
+            failed += 1
+            if company.kvk in previous:
+                features[company.kvk] = previous[company.kvk]
+            continue
+        coords = coordinates[company.address]
+        features[company.kvk] = {
+            'type': 'Feature',
+            'id': company.kvk,
+            # Kept without geometry when the address is not found, so it is only retried after retry_at
+            'geometry': {'type': 'Point', 'coordinates': [coords[1], coords[0]]} if coords else None,
+            'properties': {
+                'name': company.name,
+                'website': company.website,
+                'sector': company.sector,
+                'careers_page': bool(company.careers_page),
+                'digest': digest,
+            },
+        }
+        if coords is None:
+            # None if the geocode cache never retries a miss
+            features[company.kvk]['properties']['retry_at'] = retry_times.get(company.address)
+
+    removed = len(set(previous) - set(features))
+    print(f"Map layer: {len(changed) - failed} companies re-emitted, {unchanged} unchanged, "
+          f"{removed} removed, {failed} failed to geocode")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'type': 'FeatureCollection', 'features': list(features.values())}, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    return list(features.values())
+
+
+def create_map(geocoder: BatchGeocoder, path: str = './location_map.html', layer_path: str = 'companies.geojson',
+               sector: Optional[str] = None, careers_only: bool = False) -> str:
+    """
+    Render the map with all companies from the precomputed layer in a client-side marker cluster.
+    :param sector: Only show companies in this sector.
+    :param careers_only: Only show companies with a known careers page.
+    """
+    map = folium.Map(zoom_start=13)
+    # List to store the coordinates (latitude, longitude) for bounding box
+    bounds = []
+
+    with get_metrics().stage('map_layer'):
+        features = build_layer(geocoder, layer_path)
+    home_coordinates = geocoder.geocode_all([location.strip() for location in home_locations])
+
+    # Loop through all the locations and add them to the map
+    i=0
+    for location in home_locations:
+        location = location.strip()  # Remove extra spaces
+        coords = home_coordinates.get(location)
+        if coords:
+            # Store the latitude and longitude for each location
+            coords = list(coords)
+            bounds.append(coords)
+
+            # Add marker to the map
+            folium.Marker(coords, tooltip='Vadim' if i==0 else 'Farrukh', popup=location, icon=folium.Icon(icon='home')).add_to(map)
+            i+=1
+        else:
+            print(f"Location '{location}' not found!")
+
+    # Compact [latitude, longitude, popup] rows instead of one folium.Marker per company
+    rows = []
+    for feature in features:
+        properties = feature['properties']
+        if feature['geometry'] is None:
+            continue
+        if sector and properties['sector'] != sector:
+            continue
+        if careers_only and not properties['careers_page']:
+            continue
+        longitude, latitude = feature['geometry']['coordinates']
+        rows.append([latitude, longitude, html.escape(f"{properties['name']} - {properties['website'] or 'No website'}")])
+        bounds.append([latitude, longitude])
+    FastMarkerCluster(rows, callback=MARKER_CALLBACK, name='Companies').add_to(map)
+
+    # Fit the map to the bounds of all locations
+    if bounds:
+        map.fit_bounds(bounds)
+
+    map.save(path)
+    return path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--offline", action='store_true', help="Use the local stand-in geocoder instead of Nominatim.")
+    argparser.add_argument("--locations", help="JSON file of address -> [latitude, longitude] for the offline geocoder.")
+    argparser.add_argument("--cache", help="Path of the persistent geocode cache.")
+    argparser.add_argument("--layer", default='companies.geojson', help="Path of the precomputed GeoJSON layer.")
+    argparser.add_argument("--sector", help="Only show companies in this sector.")
+    argparser.add_argument("--with-careers", action='store_true', help="Only show companies with a careers page.")
+    argparser.add_argument("--no-browser", action='store_true', help="Do not open the map in a browser.")
+    argparser.add_argument("--metrics", help="Write metrics to this file (.prom/.txt for Prometheus text, else JSON).")
+    args = argparser.parse_args()
+
+    if args.offline:
+        # Separate cache by default so stand-in results never end up on the real map
+        cache = GeocodeCache(args.cache or 'geocode_cache_offline.sqlite')
+        geocoder = BatchGeocoder(OfflineGeocoder(args.locations), cache, min_delay_seconds=0)
     else:
-        print(f"Location '{location}' not found!")
-
-
-# Load companies from JSON files in the 'companies' directory
-companies_directory = 'companies'
-for filename in os.listdir(companies_directory):
-    if filename.endswith('.json'):
-        with open(os.path.join(companies_directory, filename)) as f:
-            company_data = json.load(f)
-            address = company_data.get('address')
-            if address:
-                h = geolocator.geocode(address)
-                if h:
-                    coords = [h.latitude, h.longitude]
-                    bounds.append(coords)
-                    
-                    # Add marker to the map for the company
-                    folium.Marker(coords, popup=f"{company_data['name']} - {company_data.get('website', 'No website')}").add_to(map)
-
-# Fit the map to the bounds of all locations
-if bounds:
-    map.fit_bounds(bounds)
-
-# Save and display the map
-path = './location_map.html'
-map.save(path)
-webbrowser.open(f'file://{os.path.realpath(path)}')
\ No newline at end of file
+        # Create a geocoder object
+        cache = GeocodeCache(args.cache or 'geocode_cache.sqlite')
+        geocoder = BatchGeocoder(geopy.Nominatim(user_agent="Job_scraper_2024"), cache)
+
+    # Save and display the map
+    path = create_map(geocoder, layer_path=args.layer, sector=args.sector, careers_only=args.with_careers)
+    print(f"Geocode cache: {geocoder.hits} hits, {geocoder.misses} resolved")
+    if args.metrics:
+        get_metrics().write(args.metrics)
+    if not args.no_browser:
+        webbrowser.open(f'file://{os.path.realpath(path)}')
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import heapq
+import itertools
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional, Sequence
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+
+from metrics import get_metrics
+
+if TYPE_CHECKING:
+    from page_archive import PageArchive
+
+DEFAULT_CACHE_PATH = 'http_cache.sqlite'
+DEFAULT_HEADERS = {'User-Agent': 'Mozilla/5.0'}  # Use a common user agent
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+CHUNK_SIZE = 64 * 1024
+# Hosts with an open session; a crawl touches few hosts, a run thousands
+MAX_SESSIONS = 256
+
+
+class FetchAborted(requests.RequestException):
+    """A streamed fetch was given up on before the body was read, see Fetcher.get."""
+
+    def __init__(self, url: str, reason: str, detail: str = ''):
+        super().__init__(f"{reason}: {detail or url}")
+        self.url = url
+        # 'content_type' or 'deadline'; bodies cut off at max_bytes are counted under 'max_bytes' but not raised
+        self.reason = reason
+
+
+def _response_socket(response: requests.Response) -> Optional[socket.socket]:
+    """
+    The socket a streamed response is read from, None once the body is complete: http.client drops its
+    reader then, before urllib3 hands the connection to another request.
+    """
+    # urllib3 response -> http.client response -> buffered reader -> SocketIO -> socket
+    fp = getattr(getattr(response.raw, '_fp', None), 'fp', None)
+    if fp is None:
+        return None
+    sock = getattr(getattr(fp, 'raw', None), '_sock', None)
+    if sock is None:
+        # Not the layout of the urllib3 1.26 / http.client this was written against
+        get_metrics().counter('fetch_interrupt_failed_total',
+                              'Streamed reads past their deadline that could not be cut off').inc()
+    return sock
+
+
+class _Watchdog:
+    """
+    A single thread that cuts off the streamed reads still running at their deadline. Shutting the socket
+    down ends a read that keeps receiving a byte now and then, which the read timeout never catches.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        # Heap of [deadline, sequence, response or None once cancelled, expired event, socket shut down]
+        self._heap = []
+        self._sequence = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, deadline: float, response: requests.Response) -> list:
+        """
+        :return: The entry, for cancel(). Its event (entry[3]) is set at the deadline, entry[4] is True
+                 if the socket was shut down during the read.
+        """
+        entry = [deadline, next(self._sequence), response, threading.Event(), False]
+        with self._cond:
+            heapq.heappush(self._heap, entry)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='fetch-watchdog', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return entry
+
+    def cancel(self, entry: list):
+        # Under the lock, so the socket is never shut down after this returns
+        with self._cond:
+            entry[2] = None
+
+    def _run(self):
+        with self._cond:
+            while True:
+                while self._heap and self._heap[0][2] is None:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                wait = self._heap[0][0] - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                entry = heapq.heappop(self._heap)
+                entry[3].set()
+                sock = _response_socket(entry[2])
+                if sock is not None:
+                    try:
+                        sock.shutdown(socket.SHUT_RDWR)
+                        entry[4] = True
+                    except OSError:
+                        pass
+
+
+_watchdog = _Watchdog()
+
+
+class ValidatorStore:
+    """
+    Persistent on-disk store of ETag/Last-Modified validators and the page body they belong to,
+    so a re-crawl can send conditional GETs and reuse the stored body on a 304. For a page that is
+    kept in a PageArchive only the URL it is archived under is stored, not the body a second time.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # Opened lazily so forked worker processes each get their own connection
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS validators ('
+                             'url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, '
+                             'encoding TEXT, body BLOB, stored_at REAL, archive_url TEXT)')
+            # Stores created before pages could be referenced in the archive
+            if 'archive_url' not in {row[1] for row in self._db.execute('PRAGMA table_info(validators)')}:
+                self._db.execute('ALTER TABLE validators ADD COLUMN archive_url TEXT')
+            self._db.commit()
+        return self._db
+
+    def get(self, url: str) -> Optional[tuple]:
+        """
+        :return: (etag, last_modified, encoding, body, archive_url) or None if the URL has no validators.
+                 body is None for a page kept in the archive under archive_url.
+        """
+        with self._lock:
+            row = self.db.execute('SELECT etag, last_modified, encoding, body, archive_url FROM validators '
+                                  'WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, encoding, body, archive_url = row
+        return etag, last_modified, encoding, zlib.decompress(body) if body is not None else None, archive_url
+
+    def put(self, url: str, etag: Optional[str], last_modified: Optional[str], encoding: Optional[str],
+            body: Optional[bytes], archive_url: Optional[str] = None):
+        """:param archive_url: URL the body is archived under instead, body is then None."""
+        with self._lock:
+            self.db.execute('INSERT OR REPLACE INTO validators (url, etag, last_modified, encoding, body, '
+                            'stored_at, archive_url) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (url, etag, last_modified, encoding, zlib.compress(body) if body is not None else None,
+                             time.time(), archive_url))
+            self.db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class Fetcher:
+    """
+    Shared fetch layer: one pooled keep-alive session per host plus conditional revalidation.
+    Only the sessions of the max_sessions most recently used hosts are kept, the others are closed.
+
+    Responses served from the validator store after a 304 have status 200 and from_cache set to True.
+    """
+
+    def __init__(self, cache_path: Optional[str] = DEFAULT_CACHE_PATH, pool_size: int = 4,
+                 max_sessions: int = MAX_SESSIONS):
+        """
+        :param cache_path: Path of the validator store, None to disable conditional requests.
+        :param pool_size: Maximum number of kept-alive connections per host.
+        :param max_sessions: Maximum number of hosts with an open session.
+        """
+        self.validators = ValidatorStore(cache_path) if cache_path else None
+        self.pool_size = pool_size
+        self.max_sessions = max(1, max_sessions)
+        # Least recently used first
+        self._sessions: OrderedDict[str, requests.Session] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_downloaded = 0
+
+    def session(self, url: str) -> requests.Session:
+        """The pooled session for the host of url."""
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is not None:
+                self._sessions.move_to_end(host)
+                return session
+            session = requests.Session()
+            session.headers.update(DEFAULT_HEADERS)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._sessions[host] = session
+            while len(self._sessions) > self.max_sessions:
+                # Closes its idle connections; one still in use is closed when it is released
+                self._sessions.popitem(last=False)[1].close()
+        return session
+
+    def get(self, url: str, revalidate: bool = True, max_bytes: Optional[int] = None,
+            content_types: Optional[Sequence[str]] = None, deadline: Optional[float] = None,
+            archive: Optional[PageArchive] = None, site: Optional[str] = None, **kwargs) -> requests.Response:
+        """
+        GET a URL through the pooled session for its host.
+
+        With max_bytes, content_types or deadline the body is streamed: the Content-Type is checked before
+        anything is read, reading stops at max_bytes (response.truncated is then True) and at the deadline.
+        Truncated bodies are not stored in the validator store.
+        :param url: The URL to fetch.
+        :param revalidate: Send a conditional GET if validators are stored and store new ones.
+        :param max_bytes: Keep at most this many bytes of the (decoded) body.
+        :param content_types: Content-Type prefixes accepted for a 200, e.g. HTML_CONTENT_TYPES.
+        :param deadline: time.monotonic() by which the body must be read.
+        :param archive: Archive to put a 200 response in, filed under site. The validator store then keeps
+                        a reference to the archived body instead of a copy of it.
+        :param kwargs: Passed on to requests.Session.get, e.g. timeout=(connect, read).
+        :return: The response, rebuilt from the stored body on a 304.
+        :raises FetchAborted: On a rejected Content-Type or a passed deadline.
+        :raises requests.ReadTimeout: Also when the server stalls halfway through a streamed body.
+        """
+        cached = self.validators.get(url) if revalidate and self.validators else None
+        if cached and cached[3] is None:
+            page = archive.get(cached[4]) if archive is not None and cached[4] else None
+            # Without the body a 304 could not be answered, so the page is fetched in full
+            cached = cached[:3] + (page.body, cached[4]) if page is not None and page.status == 200 else None
+        headers = dict(kwargs.pop('headers', None) or {})
+        if cached:
+            etag, last_modified = cached[:2]
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        metrics = get_metrics()
+        host = urlparse(url).netloc.lower()
+        stream = max_bytes is not None or content_types is not None or deadline is not None
+        with metrics.gauge('fetch_in_flight', 'Requests currently in flight').track(), \
+                metrics.histogram('fetch_seconds', 'Fetch latency per host').time(host=host):
+            response = self.session(url).get(url, headers=headers, stream=stream, **kwargs)
+            response.truncated = False
+            if stream:
+                aborted = metrics.counter('fetch_aborted_total', 'Streamed fetches cut short, by reason')
+                try:
+                    self._read_body(response, max_bytes, content_types, deadline)
+                except FetchAborted as e:
+                    aborted.inc(reason=e.reason)
+                    raise
+                if response.truncated:
+                    aborted.inc(reason='max_bytes')
+        metrics.counter('fetch_requests_total', 'Requests by status code').inc(status=response.status_code)
+        response.from_cache = False
+
+        if response.status_code == 304 and cached:
+            _, _, encoding, body, _ = cached
+            response.status_code = 200
+            response._content = body
+            response.encoding = encoding
+            response.from_cache = True
+            with self._lock:
+                self.hits += 1
+                self.bytes_saved += len(body)
+            metrics.counter('http_cache_hits_total', 'Pages served from the validator store after a 304').inc()
+            metrics.counter('http_cache_bytes_saved_total', 'Bytes not downloaded thanks to a 304').inc(len(body))
+            if archive is not None:
+                archive.put(site, response)
+            return response
+
+        with self._lock:
+            self.misses += 1
+            self.bytes_downloaded += len(response.content)
+        metrics.counter('http_cache_misses_total', 'Pages downloaded in full').inc()
+        metrics.counter('bytes_downloaded_total', 'Response bytes downloaded').inc(len(response.content))
+        archived = archive is not None and response.status_code == 200
+        if archived:
+            archive.put(site, response)
+        if revalidate and self.validators and response.status_code == 200 and not response.truncated:
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if etag or last_modified:
+                self.validators.put(url, etag, last_modified, response.encoding,
+                                    None if archived else response.content, response.url if archived else None)
+        return response
+
+    @staticmethod
+    def _read_body(response: requests.Response, max_bytes: Optional[int], content_types: Optional[Sequence[str]],
+                   deadline: Optional[float]):
+        """Read a streamed body into response.content within the limits, closing the connection early."""
+        if content_types is not None and response.status_code == 200:
+            content_type = response.headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+            # A missing Content-Type is let through, the parser copes with whatever it is
+            if content_type and not content_type.startswith(tuple(content_types)):
+                response.close()
+                raise FetchAborted(response.url, 'content_type', content_type)
+        chunks = []
+        size = 0
+        # Reads are only checked between chunks, the watchdog cuts off one that is still running
+        watch = _watchdog.watch(deadline, response) if deadline is not None else None
+        expired = watch[3] if watch else threading.Event()
+        # Set when the body was read to the end or to max_bytes; a deadline passing after that is ignored
+        complete = False
+        try:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                if expired.is_set():
+                    break
+                if max_bytes is not None and size + len(chunk) > max_bytes:
+                    chunks.append(chunk[:max_bytes - size])
+                    response.truncated = True
+                    response.close()
+                    complete = True
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+            else:
+                # A body without a length also ends normally when the watchdog shut its socket down
+                complete = not (watch and watch[4])
+        except requests.RequestException as e:
+            # The interrupted read may surface as a connection error
+            if expired.is_set():
+                pass
+            # requests reports a read timeout in the body as a ConnectionError, not as the Timeout it is
+            elif isinstance(e, requests.ConnectionError) and e.args and isinstance(e.args[0], ReadTimeoutError):
+                response.close()
+                raise requests.ReadTimeout(e.args[0], request=response.request, response=response) from e
+            else:
+                raise
+        finally:
+            if watch is not None:
+                _watchdog.cancel(watch)
+        if not complete:
+            # The rest of the body is not wanted, so the connection cannot be reused
+            response.close()
+            raise FetchAborted(response.url, 'deadline')
+        response._content = b''.join(chunks)
+        response._content_consumed = True
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'bytes_saved': self.bytes_saved,
+            'bytes_downloaded': self.bytes_downloaded,
+        }
+
+    def summary(self) -> str:
+        return f"HTTP cache: {self.hits} hits, {self.misses} misses, " \
+               f"{self.bytes_saved / 1024:.1f} KiB saved, {self.bytes_downloaded / 1024:.1f} KiB downloaded"
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+        if self.validators:
+            self.validators.close()
+
+
+_fetcher: Optional[Fetcher] = None
+
+
+def get_fetcher() -> Fetcher:
+    """The process-wide shared Fetcher."""
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = Fetcher()
+    return _fetcher
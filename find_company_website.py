@@ -1,85 +1,218 @@
 #!/usr/bin/env python3
 from __future__ import annotations
-import multiprocessing
-from multiprocessing.managers import ValueProxy
+import threading
 import time
-from bs4 import BeautifulSoup
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from googlesearch import search
 from company import Company
-from utils import load_companies
-import requests
-from multiprocessing import Pool, Manager, cpu_count
+from metrics import get_metrics
+from rate_limiter import TokenBucket
+from utils import get_companies, iter_companies, save_websites, without_website
+from website_resolver import (GoogleBackend, LocalHTTPBackend, ResolverStats, WebsiteCache, WebsiteResolver,
+                              normalize_company_name)
+from multiprocessing import Pool, cpu_count
+
+# Rate limiter and resolver shared by the pool, set in each worker by init_worker
+limiter: Optional[TokenBucket] = None
+resolver: Optional[WebsiteResolver] = None
+
+
+def init_worker(bucket: TokenBucket, website_resolver: WebsiteResolver):
+    global limiter, resolver
+    limiter = bucket
+    resolver = website_resolver
+    resolver.backend.bucket = bucket
+    # Forked workers start with a copy of the parent's metrics, which the parent already has
+    get_metrics().drain()
+
 
 # Function to get the first Google search result
-def get_first_google_result(query, retries=50, delay=1, lock=None, stop_flag: ValueProxy[int]=None):
-    attempt = 0
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5)\
-            AppleWebKit/537.36 (KHTML, like Gecko) Cafari/537.36'
-    }
-    
-    while attempt < retries:
-        if stop_flag.get() != multiprocessing.current_process().name and stop_flag.get():
-            # Wait if another thread encountered a 429 and set the flag
-            # print(f"Waiting for {stop_flag.get()}")
-            time.sleep(delay)
-            continue
-
-        try:
-            # Make the search request to Google (or any other search engine)
-            response = requests.get(f"https://www.google.com/search?q={query}", headers=headers)
-            
-            # Check if 429 status code is returned
-            if response.status_code == 429:
-                with lock:
-                    stop_flag.set(multiprocessing.current_process().name)  # Set the stop flag to notify all threads
-                    print(f"429 Too Many Requests encountered. Retrying in {delay} seconds...")
-                    
-                time.sleep(delay)
-                attempt += 1
-                if delay >= 512:
-                    delay += 60 # after 8.5 minutes, just add 1 minute
-                else:
-                    delay *= 2  # Exponential backoff
-                continue
-            else:
-                if stop_flag.get() == multiprocessing.current_process().name:
-                    with lock:
-                        stop_flag.set(False)            
-            # Parse the first result from the Google search page (using BeautifulSoup)
-            soup = BeautifulSoup(response.text, 'html.parser')
-            first_result = soup.find('a').get('href')
-            return first_result
-        
-        except requests.exceptions.RequestException as e:
-            print(f"Request error: {e}")
-            return str(e)
-    
-    return "Failed to get result after several attempts."
+def get_first_google_result(query, retries=50, bucket: Optional[TokenBucket] = None) -> Optional[str]:
+    return GoogleBackend(retries=retries, bucket=bucket or limiter).resolve(query)
 
 # The function to fetch the company website and handle 429 status
-def get_website(company: Company, lock, stop_flag: ValueProxy[int]):
-    if not company.website:
-        query = company.name
-        first_result = get_first_google_result(query, lock=lock, stop_flag=stop_flag)
-        print(f"{company.name}: {first_result}")
+def get_website(company: Company) -> Optional[tuple]:
+    """
+    Look up and save the website of a company that has none.
+    :return: (cache hit, backend name, backend latency, found) for the lookup statistics, None if skipped.
+    """
+    if company.website:
+        return None
+    website_resolver = resolver or WebsiteResolver(GoogleBackend(bucket=limiter), WebsiteCache())
+    first_result, hit, latency = website_resolver.resolve(company.name)
+    print(f"{company.name}: {first_result}")
+    if first_result:
         company.website = first_result
-        company.save_to_json()
-
-# Load companies
-companies = load_companies()
-
-# Set up multiprocessing with a Manager for shared state
-cores = cpu_count()
-print(f"Number of cores: {cores}")
-
-with Manager() as manager:
-    # Create shared variables
-    lock = manager.Lock()
-    stop_flag = manager.Value(int, 0)  # Shared flag to stop other threads on 429
-    
-    # Create pool of workers
-    pool = Pool(cores)
-    
-    # Pass lock and stop_flag to all processes
-    pool.starmap(get_website, [(company, lock, stop_flag) for company in companies])
+        company.save()
+    return hit, website_resolver.backend.name, latency, bool(first_result)
+
+
+def lookup(item: Tuple[str, str]) -> tuple:
+    """
+    Look up the website of a company in a pool worker, without saving it: the parent does that.
+    :param item: (kvk, name)
+    :return: (kvk, name, website or None, cache hit, backend name, backend latency, metrics recorded by the
+             lookup) where the metrics, e.g. fetch latency and request counts, are for the parent to merge.
+    """
+    kvk, name = item
+    website_resolver = resolver or WebsiteResolver(GoogleBackend(bucket=limiter), WebsiteCache())
+    website, hit, latency = website_resolver.resolve(name)
+    print(f"{name}: {website}")
+    return kvk, name, website, hit, website_resolver.backend.name, latency, get_metrics().drain()
+
+
+class LookupFeed:
+    """
+    Streams (kvk, name) work items to a pool's imap_unordered, with at most window lookups in flight.
+
+    Pool.imap_unordered drains its input as fast as it can, so the feed blocks until done() frees a slot.
+    A company whose normalized name is already being looked up is held back and gets that lookup's
+    result from done(), so duplicate trade names across KvK numbers resolve once.
+    """
+
+    def __init__(self, items: Iterable[Tuple[str, str]], window: int = 256):
+        """
+        :param items: (kvk, name) of the companies to look up.
+        :param window: Maximum number of items sent to the pool and not yet done.
+        """
+        self.items = items
+        self._slots = threading.BoundedSemaphore(window)
+        self._lock = threading.Lock()
+        # Normalized name in flight -> kvk numbers of the companies waiting on its lookup
+        self._waiting: Dict[str, List[str]] = dict()
+
+    @staticmethod
+    def key(name: str) -> str:
+        return normalize_company_name(name) or name
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        for kvk, name in self.items:
+            key = self.key(name)
+            with self._lock:
+                if key in self._waiting:
+                    self._waiting[key].append(kvk)
+                    continue
+                self._waiting[key] = []
+            self._slots.acquire()
+            yield kvk, name
+
+    def done(self, name: str) -> List[str]:
+        """Free the slot of a finished lookup. :return: The kvk numbers of the duplicates held back for it."""
+        with self._lock:
+            duplicates = self._waiting.pop(self.key(name), [])
+        self._slots.release()
+        return duplicates
+
+
+class WebsiteWriter:
+    """
+    The single writer for the websites found by the pool: collects them and saves them in batches,
+    through one transaction per batch on a SQLite store.
+    """
+
+    def __init__(self, source: Optional[str] = None, batch_size: int = 500, interval: float = 10.0):
+        """
+        :param source: JSON directory or SQLite store, defaults to utils.DEFAULT_SOURCE.
+        :param batch_size: Websites collected before they are saved.
+        :param interval: Maximum seconds a website waits to be saved.
+        """
+        self.source = source
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pending: Dict[str, str] = dict()
+        self.saved = 0
+        self._flushed = time.monotonic()
+
+    def add(self, kvk: str, website: str):
+        self.pending[kvk] = website
+        if len(self.pending) >= self.batch_size or time.monotonic() - self._flushed >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.saved += save_websites(self.pending, self.source)
+            self.pending = dict()
+        self._flushed = time.monotonic()
+
+    def __enter__(self) -> 'WebsiteWriter':
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+def find_websites(pool, companies: Iterable[Company], writer: WebsiteWriter, stats: ResolverStats,
+                  window: int = 256):
+    """
+    Look up the websites of companies over the pool and hand them to the writer as they come back.
+    Only (kvk, name) crosses to the workers, and at most window lookups are queued at a time.
+    """
+    metrics = get_metrics()
+    feed = LookupFeed(((company.kvk, company.name) for company in companies if not company.website), window)
+    for kvk, name, website, hit, backend_name, latency, worker_metrics in pool.imap_unordered(lookup, feed,
+                                                                                              chunksize=1):
+        metrics.merge(worker_metrics)
+        stats.record(hit, backend_name, latency, bool(website))
+        duplicates = feed.done(name)
+        for duplicate in duplicates:
+            # Duplicates count as cache hits
+            stats.record(True, None, 0.0, bool(website))
+        if website:
+            for company_kvk in (kvk, *duplicates):
+                writer.add(company_kvk, website)
+
+
+if __name__ == "__main__":
+    import argparse
+    import contextlib
+    from metrics import ProgressLine
+    from work_queue import WorkQueue, leases
+
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--rate", type=float, default=0.5, help="Initial requests per second across all workers.")
+    argparser.add_argument("--max-rate", type=float, default=5.0, help="Upper bound for the adaptive request rate.")
+    argparser.add_argument("--backend", choices=['google', 'local'], default='google',
+                           help="Where to look up websites; 'local' uses the stand-in from website_resolver.py.")
+    argparser.add_argument("--local-url", default='http://127.0.0.1:8808', help="Base URL of the local stand-in.")
+    argparser.add_argument("--cache", default='website_cache.sqlite', help="Path of the persistent website cache.")
+    argparser.add_argument("--queue", help="Claim companies in batches from this shared work queue "
+                                           "(see work_queue.py) instead of looking up all of them.")
+    argparser.add_argument("--batch-size", type=int, default=200, help="Companies claimed from the queue at a time.")
+    argparser.add_argument("--window", type=int, default=256, help="Maximum number of lookups queued for the pool.")
+    argparser.add_argument("--write-batch", type=int, default=500, help="Websites saved per batch.")
+    argparser.add_argument("--metrics", help="Write metrics to this file (.prom/.txt for Prometheus text, else JSON).")
+    argparser.add_argument("--progress", action='store_true', help="Show a live progress line.")
+    args = argparser.parse_args()
+
+    cores = cpu_count()
+    print(f"Number of cores: {cores}")
+
+    # Token bucket in shared memory, handed to every worker when the pool starts
+    bucket = TokenBucket(rate=args.rate, max_rate=args.max_rate)
+    backend = LocalHTTPBackend(args.local_url) if args.backend == 'local' else GoogleBackend()
+    website_resolver = WebsiteResolver(backend, WebsiteCache(args.cache))
+
+    stats = ResolverStats()
+    metrics = get_metrics()
+    # Create pool of workers; they only look up, this process is the single writer
+    with metrics.stage('website_lookup'), (ProgressLine(metrics) if args.progress else contextlib.nullcontext()), \
+            Pool(cores, initializer=init_worker, initargs=(bucket, website_resolver)) as pool, \
+            WebsiteWriter(batch_size=args.write_batch) as writer:
+        if args.queue:
+            # Other machines may share the queue; each batch is leased until all its lookups returned
+            queue = WorkQueue(args.queue, 'website')
+            for lease in leases(queue, args.batch_size):
+                with lease:
+                    kvks = list(lease.pending)
+                    find_websites(pool, get_companies(kvks, fields=()), writer, stats, args.window)
+                    # Saved before the batch is marked done
+                    writer.flush()
+                    lease.complete(kvks)
+            print(queue.summary())
+        else:
+            # Stream only the companies that still need a website
+            find_websites(pool, iter_companies(where=without_website, fields=()), writer, stats, args.window)
+    print(stats.summary())
+    print(f"Saved {writer.saved} websites")
+    if args.metrics:
+        metrics.write(args.metrics)
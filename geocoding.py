@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from geopy.exc import GeopyError
+from geopy.extra.rate_limiter import RateLimiter
+from geopy.location import Location
+
+from metrics import get_metrics
+
+DEFAULT_CACHE_PATH = 'geocode_cache.sqlite'
+
+Coordinates = Tuple[float, float]
+
+
+def normalize_address(address: str) -> str:
+    """Normalize an address for use as a cache key: lowercase, single spaces, no stray punctuation."""
+    address = address.lower().replace(',', ' ')
+    address = re.sub(r'\s+', ' ', address).strip()
+    # '1102 mx' and '1102mx' are the same postcode
+    return re.sub(r'\b(\d{4}) ([a-z]{2})\b', r'\1\2', address)
+
+
+class GeocodeCache:
+    """
+    Persistent geocode results keyed by normalized address.
+    Misses are cached too, so addresses the provider cannot resolve are not retried on every run.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, negative_ttl: Optional[float] = 30 * 24 * 3600):
+        """
+        :param path: Path of the SQLite cache file.
+        :param negative_ttl: Seconds after which a cached miss is retried, None to never retry.
+        """
+        self.path = path
+        self.negative_ttl = negative_ttl
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS geocodes ('
+                        'address TEXT PRIMARY KEY, latitude REAL, longitude REAL, geocoded_at REAL)')
+        self.db.commit()
+
+    def lookup(self, addresses: Iterable[str]) -> Dict[str, Optional[Coordinates]]:
+        """
+        Look up normalized addresses in bulk.
+        :return: Cached results; None for a cached miss. Addresses not in the cache (or with an expired miss)
+                 are left out.
+        """
+        addresses = list(addresses)
+        results = dict()
+        now = time.time()
+        # Stay below SQLite's limit on the number of query parameters
+        for start in range(0, len(addresses), 500):
+            chunk = addresses[start:start + 500]
+            rows = self.db.execute(f'SELECT address, latitude, longitude, geocoded_at FROM geocodes '
+                                   f'WHERE address IN ({", ".join("?" * len(chunk))})', chunk)
+            for address, latitude, longitude, geocoded_at in rows:
+                if latitude is None:
+                    if self.negative_ttl is not None and now - geocoded_at > self.negative_ttl:
+                        continue
+                    results[address] = None
+                else:
+                    results[address] = (latitude, longitude)
+        return results
+
+    def miss_expiries(self, addresses: Iterable[str]) -> Dict[str, float]:
+        """
+        When the cached misses among normalized addresses expire, as time.time().
+        :return: Addresses with a cached miss, left out if misses are never retried.
+        """
+        if self.negative_ttl is None:
+            return dict()
+        addresses = list(addresses)
+        expiries = dict()
+        for start in range(0, len(addresses), 500):
+            chunk = addresses[start:start + 500]
+            rows = self.db.execute(f'SELECT address, geocoded_at FROM geocodes '
+                                   f'WHERE latitude IS NULL AND address IN ({", ".join("?" * len(chunk))})', chunk)
+            for address, geocoded_at in rows:
+                expiries[address] = geocoded_at + self.negative_ttl
+        return expiries
+
+    def store(self, results: Dict[str, Optional[Coordinates]]):
+        now = time.time()
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?)',
+                                [(address, *(coords or (None, None)), now) for address, coords in results.items()])
+
+    def close(self):
+        self.db.close()
+
+
+class OfflineGeocoder:
+    """
+    Local stand-in for Nominatim for offline runs and tests.
+
+    Known addresses are read from a JSON file mapping address to [latitude, longitude]. Other addresses
+    get a deterministic point inside the Netherlands, or no result if fallback is disabled.
+    """
+
+    # Rough bounding box of the Netherlands
+    SOUTH, NORTH, WEST, EAST = 50.75, 53.55, 3.36, 7.23
+
+    def __init__(self, locations_path: Optional[str] = None, fallback: bool = True):
+        self.fallback = fallback
+        self.locations: Dict[str, Coordinates] = dict()
+        if locations_path:
+            with open(locations_path, 'r', encoding='utf-8') as f:
+                self.locations = {normalize_address(address): tuple(coords) for address, coords in json.load(f).items()}
+
+    def geocode(self, query: str, **kwargs) -> Optional[Location]:
+        key = normalize_address(query)
+        coords = self.locations.get(key)
+        if coords is None and self.fallback:
+            digest = hashlib.sha1(key.encode('utf-8')).digest()
+            coords = (self.SOUTH + (self.NORTH - self.SOUTH) * digest[0] / 255,
+                      self.WEST + (self.EAST - self.WEST) * digest[1] / 255)
+        if coords is None:
+            return None
+        return Location(query, coords, {})
+
+
+class BatchGeocoder:
+    """
+    Geocode many addresses, resolving only the ones the cache has not seen,
+    while keeping to the provider's rate limit.
+    """
+
+    def __init__(self, geocoder, cache: GeocodeCache, min_delay_seconds: float = 1.0, batch_size: int = 50):
+        """
+        :param geocoder: Any geopy geocoder, or an OfflineGeocoder.
+        :param cache: Persistent cache of results.
+        :param min_delay_seconds: Minimum delay between provider requests; Nominatim allows 1 per second.
+        :param batch_size: Number of resolved addresses stored to the cache at a time.
+        """
+        self.cache = cache
+        self.batch_size = batch_size
+        self._geocode = RateLimiter(geocoder.geocode, min_delay_seconds=min_delay_seconds, max_retries=2,
+                                    swallow_exceptions=False) if min_delay_seconds > 0 else geocoder.geocode
+        self.hits = 0
+        self.misses = 0
+
+    def geocode_all(self, addresses: Iterable[str]) -> Dict[str, Optional[Coordinates]]:
+        """
+        :param addresses: Addresses to geocode, duplicates are resolved once.
+        :return: Dictionary mapping each address as given to its coordinates, or None if not found.
+        """
+        by_key: Dict[str, List[str]] = dict()
+        for address in addresses:
+            by_key.setdefault(normalize_address(address), []).append(address)
+
+        metrics = get_metrics()
+        geocodes = metrics.counter('geocodes_total', 'Geocoded addresses by result')
+        resolved = self.cache.lookup(by_key.keys())
+        self.hits += len(resolved)
+        geocodes.inc(len(resolved), result='cached')
+        pending = [key for key in by_key if key not in resolved]
+        if pending:
+            print(f"Geocoding {len(pending)} new addresses ({len(resolved)} cached)...")
+
+        batch: Dict[str, Optional[Coordinates]] = dict()
+        for key in pending:
+            original = by_key[key][0]
+            try:
+                location = self._geocode(original)
+            except GeopyError as e:
+                # Not cached, so it is retried on the next run
+                print(f"Geocoding failed for '{original}': {e}")
+                geocodes.inc(result='error')
+                continue
+            self.misses += 1
+            geocodes.inc(result='found' if location else 'not_found')
+            batch[key] = (location.latitude, location.longitude) if location else None
+            if len(batch) >= self.batch_size:
+                self.cache.store(batch)
+                resolved.update(batch)
+                batch = dict()
+        self.cache.store(batch)
+        resolved.update(batch)
+
+        return {address: resolved[key] for key, originals in by_key.items() if key in resolved
+                for address in originals}
+
+    def retry_times(self, addresses: Iterable[str]) -> Dict[str, float]:
+        """
+        :param addresses: Addresses that were not found.
+        :return: Dictionary mapping each address as given to the time.time() its cached miss expires,
+                 after which geocode_all asks the provider again. Left out if it never expires.
+        """
+        addresses = list(addresses)
+        expiries = self.cache.miss_expiries({normalize_address(address) for address in addresses})
+        return {address: expiries[normalize_address(address)] for address in addresses
+                if normalize_address(address) in expiries}
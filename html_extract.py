@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import json
+import time
+from typing import List, Optional, Tuple
+
+from bs4 import BeautifulSoup, ParserRejectedMarkup, SoupStrainer
+
+from metrics import get_metrics
+
+try:
+    import lxml  # noqa: F401
+    DEFAULT_PARSER = 'lxml'
+except ImportError:
+    DEFAULT_PARSER = 'html.parser'
+# Parsers that can be chosen, e.g. on the command line
+PARSERS = ('lxml', 'html.parser') if DEFAULT_PARSER == 'lxml' else ('html.parser',)
+
+ANCHORS = SoupStrainer('a', href=True)
+TABLE_BODIES = SoupStrainer('tbody')
+JSON_LD = SoupStrainer('script', type='application/ld+json')
+
+
+def parse(html: str, parse_only: Optional[SoupStrainer] = None, parser: Optional[str] = None) -> BeautifulSoup:
+    """
+    Parse only the elements matching parse_only, with lxml when it is installed.
+    Falls back to html.parser, and then to a full html.parser tree, when the markup is rejected.
+    """
+    parser = parser or DEFAULT_PARSER
+    attempts = [(parser, parse_only)]
+    if parser != 'html.parser':
+        attempts.append(('html.parser', parse_only))
+    if parse_only is not None:
+        attempts.append(('html.parser', None))
+    for i, (features, strainer) in enumerate(attempts):
+        try:
+            return BeautifulSoup(html, features, parse_only=strainer)
+        except ParserRejectedMarkup:
+            if i == len(attempts) - 1:
+                raise
+
+
+class LinkExtractor:
+    """Extracts (href, text) pairs of the anchors on a page and keeps track of the time spent parsing."""
+
+    def __init__(self, parser: Optional[str] = None):
+        """
+        :param parser: BeautifulSoup parser to use, defaults to lxml if installed, else html.parser.
+        """
+        self.parser = parser or DEFAULT_PARSER
+        self.pages = 0
+        self.seconds = 0.0
+
+    def links(self, html: str) -> List[Tuple[str, str]]:
+        started = time.perf_counter()
+        try:
+            soup = parse(html, ANCHORS, self.parser)
+            return [(link['href'], link.text) for link in soup.find_all('a', href=True)]
+        finally:
+            self.pages += 1
+            elapsed = time.perf_counter() - started
+            self.seconds += elapsed
+            get_metrics().histogram('parse_seconds', 'Link extraction time per page').observe(elapsed, parser=self.parser)
+
+    @property
+    def ms_per_page(self) -> float:
+        return 1000 * self.seconds / self.pages if self.pages else 0.0
+
+
+def parse_tables(html: str, parser: Optional[str] = None) -> BeautifulSoup:
+    """Parse only the table bodies of a page, e.g. for scrape_companies.parse_table."""
+    return parse(html, TABLE_BODIES, parser)
+
+
+def json_ld(html: str, parser: Optional[str] = None) -> List[object]:
+    """The decoded JSON-LD blocks of a page, skipping blocks that are not valid JSON."""
+    blocks = []
+    for script in parse(html, JSON_LD, parser).find_all('script'):
+        try:
+            blocks.append(json.loads(script.string or script.get_text()))
+        except ValueError:
+            continue
+    return blocks
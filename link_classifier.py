@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import re
+from typing import NamedTuple, Optional
+from urllib.parse import urljoin, urlsplit
+
+from url_utils import canonical_host
+
+# Keywords that mark a link as a careers page. A fetched page reached through one of
+# these confirms the careers page and ends the crawl early.
+CAREER_KEYWORDS = ['career', 'werken bij', 'werkenbij', 'werken-bij',
+                   'vacature', 'vacancies', 'vacancy',
+                   'sollicitatie', 'solliciteren',
+                   'job',
+                   'jobs', 'baan', 'banen',
+                   'karriere', 'stellenangebote', 'carriere', 'carrière', 'emploi', 'recrutement',
+                   'join us', 'join our team', 'work with us', 'working at']
+# Keywords for pages worth recording and visiting early, but which do not confirm a careers page
+CONTACT_KEYWORDS = ['contact', 'contact us', 'contact form', 'kontakt']
+
+# Hosts of applicant tracking systems, by domain suffix. A link to a customer's part of one of these is a
+# careers page, e.g. https://huhtamaki.wd3.myworkdayjobs.com/External, see ats_careers_vendor
+ATS_HOSTS = {
+    'myworkdayjobs.com': 'Workday',
+    'myworkdaysite.com': 'Workday',
+    'recruitee.com': 'Recruitee',
+    'greenhouse.io': 'Greenhouse',
+    'lever.co': 'Lever',
+    'smartrecruiters.com': 'SmartRecruiters',
+    'teamtailor.com': 'Teamtailor',
+    'homerun.co': 'Homerun',
+    'workable.com': 'Workable',
+    'personio.de': 'Personio',
+    'personio.com': 'Personio',
+    'bamboohr.com': 'BambooHR',
+    'jobvite.com': 'Jobvite',
+    'icims.com': 'iCIMS',
+    'successfactors.com': 'SAP SuccessFactors',
+    'successfactors.eu': 'SAP SuccessFactors',
+    'taleo.net': 'Taleo',
+    'breezy.hr': 'Breezy HR',
+    'ashbyhq.com': 'Ashby',
+    'join.com': 'JOIN',
+    'otys.nl': 'OTYS',
+    'easycruit.com': 'Easycruit',
+    'hr-office.nl': 'HR Office',
+}
+# Subdomains of an ATS host that belong to the vendor itself rather than to a customer
+ATS_VENDOR_SUBDOMAINS = frozenset([
+    'help', 'support', 'blog', 'docs', 'status', 'developers', 'developer', 'api', 'app', 'login', 'go', 'info',
+    'community', 'academy', 'partners', 'marketplace', 'resources', 'cdn', 'static', 'assets',
+])
+# Job board subdomains with the customer in the first path segment, e.g. https://boards.greenhouse.io/acme
+ATS_BOARD_SUBDOMAINS = frozenset(['boards', 'job-boards', 'jobs', 'careers', 'apply', 'ats'])
+# Paths with the customer after them on the vendor's own host, e.g. https://join.com/companies/acme
+ATS_TENANT_PATHS = {'join.com': '/companies/', 'myworkdaysite.com': '/recruiting/'}
+# Workday data center labels, e.g. wd3 in huhtamaki.wd3.myworkdayjobs.com
+_WORKDAY_DATA_CENTER = re.compile(r'wd\d+')
+
+# Links to files are never crawled
+SKIP_EXTENSIONS = frozenset([
+    'pdf', 'jpg', 'png', 'jpeg', 'gif', 'svg', 'webp', 'bmp', 'tiff', 'ico', 'mp4', 'avi', 'mov', 'mp3', 'wav',
+    'flac', 'ogg', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'odt', 'ods', 'odp', 'zip', 'rar', 'tar', 'gz',
+    'bz2', '7z', 'dmg', 'exe', 'msi', 'apk', 'iso', 'img', 'csv', 'json', 'xml', 'sql', 'db', 'dbf',
+])
+SKIP_PREFIXES = ('javascript:', '#')
+# Substrings of hrefs that lead to pages never worth crawling
+SKIP_SUBSTRINGS = ['news', 'blog']
+
+# Frontier priorities, lower is fetched first
+PRIORITY_CAREER = 0
+PRIORITY_CONTACT = 1
+PRIORITY_DEFAULT = 2
+
+# Link kinds
+SKIP = 'skip'
+EMAIL = 'email'
+INTERNAL = 'internal'
+EXTERNAL = 'external'
+
+
+class LinkVerdict(NamedTuple):
+    kind: str
+    # Absolute URL for internal/external links, the address for email links
+    url: Optional[str] = None
+    priority: int = PRIORITY_DEFAULT
+
+    @property
+    def is_career(self) -> bool:
+        return self.priority != PRIORITY_DEFAULT
+
+
+_SKIP_VERDICT = LinkVerdict(SKIP)
+# Links with a scheme or a network location, which may point to another host
+_ABSOLUTE = re.compile(r'[a-zA-Z][a-zA-Z0-9+.-]*:|//')
+
+
+def ats_vendor(url: str) -> Optional[str]:
+    """The applicant tracking system a URL belongs to, None if it is not on a known ATS host."""
+    try:
+        return ats_vendor_for_host(canonical_host(url))
+    except ValueError:
+        # Unparseable port or IPv6 literal
+        return None
+
+
+def _ats_domain(host: str) -> Optional[str]:
+    """The ATS_HOSTS domain a host is on, None if none."""
+    host = host.split(':', 1)[0]
+    while host:
+        if host in ATS_HOSTS:
+            return host
+        _, _, host = host.partition('.')
+    return None
+
+
+def ats_vendor_for_host(host: str) -> Optional[str]:
+    """:param host: A canonical_host."""
+    domain = _ats_domain(host)
+    return ATS_HOSTS[domain] if domain else None
+
+
+def ats_careers_vendor(url: str) -> Optional[str]:
+    """
+    The applicant tracking system a URL is a customer's careers page on: one with a customer subdomain
+    (acme.recruitee.com, acme.wd3.myworkdayjobs.com) or a customer path (boards.greenhouse.io/acme).
+    None for other URLs, including the vendor's own site, e.g. a "Powered by Greenhouse" footer link.
+    """
+    try:
+        host = canonical_host(url).split(':', 1)[0]
+        path = urlsplit(url).path
+    except ValueError:
+        # Unparseable port or IPv6 literal
+        return None
+    domain = _ats_domain(host)
+    if domain is None:
+        return None
+    labels = [label for label in host[:-len(domain)].split('.')
+              if label and not _WORKDAY_DATA_CENTER.fullmatch(label)]
+    segments = [segment for segment in path.split('/') if segment]
+    if labels and labels[0] in ATS_BOARD_SUBDOMAINS:
+        customer = bool(segments)
+    elif labels:
+        customer = labels[0] not in ATS_VENDOR_SUBDOMAINS
+    else:
+        prefix = ATS_TENANT_PATHS.get(domain)
+        customer = prefix is not None and path.startswith(prefix) and len(segments) >= 2
+    return ATS_HOSTS[domain] if customer else None
+
+
+def _keyword_pattern(keywords) -> re.Pattern:
+    # Longest first, so the alternation is not cut short by a keyword that is a prefix of another
+    return re.compile('|'.join(re.escape(keyword) for keyword in sorted(keywords, key=len, reverse=True)))
+
+
+class LinkClassifier:
+    """
+    Classifies the links on a crawled page. Build it once per run and share it between crawlers:
+    the keyword lists are compiled into a single regular expression each, and file extensions are
+    looked up in a set instead of being tested one endswith at a time.
+    """
+
+    def __init__(self, career_keywords=CAREER_KEYWORDS, contact_keywords=CONTACT_KEYWORDS,
+                 skip_extensions=SKIP_EXTENSIONS, skip_substrings=SKIP_SUBSTRINGS):
+        self.career_pattern = _keyword_pattern(career_keywords)
+        self.contact_pattern = _keyword_pattern(contact_keywords)
+        self.skip_pattern = _keyword_pattern(skip_substrings)
+        self.skip_extensions = frozenset(skip_extensions)
+
+    def has_skipped_extension(self, href: str) -> bool:
+        dot = href.rfind('.')
+        if dot == -1:
+            return False
+        extension = href[dot + 1:]
+        return '/' not in extension and extension.lower() in self.skip_extensions
+
+    def priority(self, href: str, text: str) -> int:
+        """Frontier priority of a link from the keywords in its href or text."""
+        lower_href = href.lower()
+        lower_text = text.lower()
+        if self.career_pattern.search(lower_href) or self.career_pattern.search(lower_text):
+            return PRIORITY_CAREER
+        if self.contact_pattern.search(lower_href) or self.contact_pattern.search(lower_text):
+            return PRIORITY_CONTACT
+        return PRIORITY_DEFAULT
+
+    def classify(self, href: str, text: str, page_url: str, base_host: str) -> LinkVerdict:
+        """
+        :param href: The href attribute of the link, as found on the page.
+        :param text: The link text.
+        :param page_url: URL of the page the link was found on, to resolve relative links. Must be on the
+                         crawled site.
+        :param base_host: canonical_host of the website being crawled.
+        :return: The verdict for the link.
+        """
+        if href.startswith(SKIP_PREFIXES) or self.has_skipped_extension(href):
+            return _SKIP_VERDICT
+        if href.startswith('mailto:'):
+            return LinkVerdict(EMAIL, href[len('mailto:'):])
+        if self.skip_pattern.search(href):
+            return _SKIP_VERDICT
+        try:
+            full_url = urljoin(page_url, href)  # Create full URL from base and link
+            host = canonical_host(full_url) if _ABSOLUTE.match(href) else base_host
+        except ValueError:
+            # Unparseable port or IPv6 literal
+            return _SKIP_VERDICT
+        if host != base_host:
+            priority = PRIORITY_CAREER if ats_careers_vendor(full_url) else self.priority(href, text)
+            return LinkVerdict(EXTERNAL, full_url, priority)
+        # Relative links stay on the page's host, and only pages of the crawled site are classified
+        return LinkVerdict(INTERNAL, full_url, self.priority(href, text))
+
+
+_classifier: Optional[LinkClassifier] = None
+
+
+def get_classifier() -> LinkClassifier:
+    """The process-wide shared LinkClassifier."""
+    global _classifier
+    if _classifier is None:
+        _classifier = LinkClassifier()
+    return _classifier
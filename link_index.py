@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from company import Company
+from link_classifier import ATS_HOSTS, ats_careers_vendor, ats_vendor
+from url_utils import canonical_host, canonicalize_url
+
+DEFAULT_INDEX_PATH = 'link_index.sqlite'
+# Vendors are stored lowercased so lookups can use the vendor index; this maps them back for display
+VENDOR_NAMES = {vendor.lower(): vendor for vendor in ATS_HOSTS.values()}
+
+
+def links_digest(links: Iterable[str]) -> str:
+    """Digest of a company's external links, to skip unchanged companies on the next build."""
+    digest = hashlib.blake2b(digest_size=16)
+    for link in sorted(set(links)):
+        digest.update(link.encode('utf-8', 'surrogatepass'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def reversed_host(host: str) -> str:
+    """Host with its labels reversed, jobs.lever.co -> co.lever.jobs, so subdomains share a prefix."""
+    return '.'.join(reversed(host.split('.')))
+
+
+def ats_links(links: Iterable[str]) -> List[str]:
+    """The links to a careers page on an applicant tracking system, canonicalized."""
+    return sorted({canonicalize_url(link) for link in links if ats_careers_vendor(link)})
+
+
+class ExternalLinkIndex:
+    """
+    Inverted index from external host to the companies linking to it, across all company records.
+
+    Hosts of known applicant tracking systems (link_classifier.ATS_HOSTS) carry their vendor, so
+    "which companies use Workday" is a single indexed query. build_index() only reads the companies
+    saved since the previous build, and re-indexes those whose external links changed.
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS links (
+                rhost TEXT NOT NULL,
+                host TEXT NOT NULL,
+                kvk TEXT NOT NULL,
+                vendor TEXT,
+                url TEXT NOT NULL,
+                PRIMARY KEY (rhost, kvk, url)
+            );
+            CREATE INDEX IF NOT EXISTS idx_links_kvk ON links (kvk);
+            CREATE INDEX IF NOT EXISTS idx_links_vendor ON links (vendor) WHERE vendor IS NOT NULL;
+            CREATE TABLE IF NOT EXISTS indexed (
+                kvk TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                digest TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS builds (
+                source TEXT PRIMARY KEY,
+                built_at REAL NOT NULL
+            );
+        ''')
+        if self.db.execute('PRAGMA user_version').fetchone()[0] < 1:
+            # Indexes built before vendors were stored lowercased
+            self.db.execute('UPDATE links SET vendor = lower(vendor) WHERE vendor IS NOT NULL')
+            self.db.execute('PRAGMA user_version = 1')
+        self.db.commit()
+        # kvk -> links_digest of the indexed companies, loaded on first use
+        self._digests: Optional[Dict[str, str]] = None
+
+    def __enter__(self) -> 'ExternalLinkIndex':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    def _rows(self, company: Company) -> List[tuple]:
+        rows = set()
+        for link in company.external_links:
+            try:
+                host = canonical_host(link)
+            except ValueError:
+                # Unparseable port or IPv6 literal
+                continue
+            if host:
+                vendor = ats_vendor(link)
+                rows.add((reversed_host(host), host, company.kvk, vendor and vendor.lower(), link))
+        return list(rows)
+
+    def update_many(self, companies: Iterable[Company]) -> int:
+        """
+        Re-index the companies whose external links changed, in one transaction.
+        :return: Number of companies re-indexed.
+        """
+        with self._lock:
+            if self._digests is None:
+                self._digests = dict(self.db.execute('SELECT kvk, digest FROM indexed'))
+        changed = []
+        for company in companies:
+            digest = links_digest(company.external_links)
+            if self._digests.get(company.kvk) != digest:
+                changed.append((company, digest))
+        with self._lock, self.db:
+            for company, digest in changed:
+                self.db.execute('DELETE FROM links WHERE kvk = ?', (company.kvk,))
+                self.db.executemany('INSERT OR IGNORE INTO links VALUES (?, ?, ?, ?, ?)', self._rows(company))
+                self.db.execute('INSERT OR REPLACE INTO indexed VALUES (?, ?, ?)', (company.kvk, company.name, digest))
+                self._digests[company.kvk] = digest
+        return len(changed)
+
+    def built_at(self, source: str) -> Optional[float]:
+        """time.time() at the start of the last completed build from source, None if there was none."""
+        with self._lock:
+            row = self.db.execute('SELECT built_at FROM builds WHERE source = ?', (source,)).fetchone()
+        return row[0] if row else None
+
+    def set_built_at(self, source: str, built_at: float):
+        with self._lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO builds VALUES (?, ?)', (source, built_at))
+
+    def companies_for_host(self, host: str) -> List[Tuple[str, str]]:
+        """(kvk, name) of the companies linking to a host, or to any of its subdomains."""
+        rhost = reversed_host(canonical_host(host if '//' in host else f'//{host}'))
+        # Subdomains sort between 'co.lever.' and 'co.lever/', '/' being the character after '.'
+        with self._lock:
+            return self.db.execute('SELECT DISTINCT l.kvk, i.name FROM links l JOIN indexed i USING (kvk) '
+                                   'WHERE l.rhost = ? OR (l.rhost >= ? AND l.rhost < ?) ORDER BY l.kvk',
+                                   (rhost, f'{rhost}.', f'{rhost}/')).fetchall()
+
+    def companies_for_vendor(self, vendor: str) -> List[Tuple[str, str, str]]:
+        """(kvk, name, url) of the companies linking to an applicant tracking system, e.g. 'Workday'."""
+        with self._lock:
+            return self.db.execute('SELECT l.kvk, i.name, l.url FROM links l JOIN indexed i USING (kvk) '
+                                   'WHERE l.vendor = ? ORDER BY l.kvk', (vendor.lower(),)).fetchall()
+
+    def vendors(self) -> Dict[str, int]:
+        """Number of companies per applicant tracking system."""
+        with self._lock:
+            rows = self.db.execute('SELECT vendor, COUNT(DISTINCT kvk) FROM links WHERE vendor IS NOT NULL '
+                                   'GROUP BY vendor ORDER BY 2 DESC').fetchall()
+        return {VENDOR_NAMES.get(vendor, vendor): count for vendor, count in rows}
+
+    def top_hosts(self, limit: int = 20, ats_only: bool = False) -> List[Tuple[str, Optional[str], int]]:
+        """(host, vendor, number of companies) of the most linked external hosts."""
+        where = ' WHERE vendor IS NOT NULL' if ats_only else ''
+        with self._lock:
+            rows = self.db.execute(f'SELECT host, vendor, COUNT(DISTINCT kvk) FROM links{where} '
+                                   f'GROUP BY host ORDER BY 3 DESC LIMIT ?', (limit,)).fetchall()
+        return [(host, VENDOR_NAMES.get(vendor, vendor), count) for host, vendor, count in rows]
+
+
+def build_index(index: ExternalLinkIndex, source: Optional[str] = None, mark_careers: bool = True,
+                batch_size: int = 1000, full: bool = False) -> tuple:
+    """
+    Bring the index up to date with the company records saved since the previous build from the same source.
+    :param mark_careers: Set the careers page of companies without one that link to an ATS.
+    :param full: Read every company record, e.g. after the ATS hosts changed.
+    :return: (companies re-indexed, careers pages marked)
+    """
+    from utils import DEFAULT_SOURCE, iter_companies
+
+    source = os.path.abspath(source or DEFAULT_SOURCE)
+    # Taken before reading, so companies saved during the build are read again by the next one
+    started = time.time()
+    changed_since = None if full else index.built_at(source)
+    reindexed = marked = 0
+    batch: List[Company] = []
+    for company in iter_companies(source, fields=('external_links', 'careers_page'), changed_since=changed_since):
+        if mark_careers and not company.careers_page:
+            links = ats_links(company.external_links)
+            if links:
+                company.careers_page = links
+                company.save()
+                marked += 1
+        batch.append(company)
+        if len(batch) >= batch_size:
+            reindexed += index.update_many(batch)
+            batch = []
+    reindexed += index.update_many(batch)
+    index.set_built_at(source, started)
+    return reindexed, marked
+
+
+if __name__ == "__main__":
+    import argparse
+
+    argparser = argparse.ArgumentParser(description="Index and query the external links of all companies.")
+    argparser.add_argument("--index", default=DEFAULT_INDEX_PATH, help="Path of the link index.")
+    argparser.add_argument("--no-build", action='store_true', help="Query the index without updating it first.")
+    argparser.add_argument("--full", action='store_true',
+                           help="Read every company record, not only those saved since the last build.")
+    argparser.add_argument("--no-mark", action='store_true',
+                           help="Do not set careers pages from links to applicant tracking systems.")
+    argparser.add_argument("--host", help="List the companies linking to this host.")
+    argparser.add_argument("--ats", help="List the companies using this applicant tracking system, e.g. Workday.")
+    argparser.add_argument("--top", type=int, default=20, help="Number of most linked hosts to show.")
+    args = argparser.parse_args()
+
+    with ExternalLinkIndex(args.index) as index:
+        if not args.no_build:
+            reindexed, marked = build_index(index, mark_careers=not args.no_mark, full=args.full)
+            print(f"Re-indexed {reindexed} companies, marked {marked} careers pages")
+        if args.host:
+            for kvk, name in index.companies_for_host(args.host):
+                print(f"{kvk}  {name}")
+        elif args.ats:
+            for kvk, name, url in index.companies_for_vendor(args.ats):
+                print(f"{kvk}  {name}  {url}")
+        else:
+            for vendor, count in index.vendors().items():
+                print(f"{vendor:<20} {count}")
+            print()
+            for host, vendor, count in index.top_hosts(args.top):
+                print(f"{host:<40} {vendor or '':<20} {count}")
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Histogram buckets in seconds, suitable for fetch and parse latencies
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str = ''):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+
+class Counter(Metric):
+    """Monotonically increasing count, per label set."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str = ''):
+        super().__init__(name, help)
+        self.values: Dict[Labels, float] = dict()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self.values.get(_labels(labels), 0)
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def samples(self) -> Iterator[Tuple[str, Labels, float]]:
+        for labels, value in list(self.values.items()):
+            yield self.name, labels, value
+
+
+class Gauge(Counter):
+    """Value that goes up and down, e.g. requests in flight."""
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self.values[_labels(labels)] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the duration of a block as in flight."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    """Distribution of observed values in fixed buckets, per label set."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str = '', buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts..., +Inf count, sum]
+        self.values: Dict[Labels, List[float]] = dict()
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += 1
+            entry[-1] += value
+
+    def count(self, **labels) -> int:
+        entry = self.values.get(_labels(labels))
+        return int(entry[-2]) if entry else 0
+
+    def sum(self, **labels) -> float:
+        entry = self.values.get(_labels(labels))
+        return entry[-1] if entry else 0.0
+
+    def quantile(self, fraction: float, **labels) -> float:
+        """Upper bound of the bucket holding the given quantile."""
+        entry = self.values.get(_labels(labels))
+        if not entry or not entry[-2]:
+            return 0.0
+        target = fraction * entry[-2]
+        for i, bound in enumerate(self.buckets):
+            if entry[i] >= target:
+                return bound
+        return float('inf')
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[Tuple[str, Labels, float]]:
+        for labels, entry in list(self.values.items()):
+            for bound, count in zip(self.buckets, entry):
+                yield f'{self.name}_bucket', labels + (('le', str(bound)),), count
+            yield f'{self.name}_bucket', labels + (('le', '+Inf'),), entry[-2]
+            yield f'{self.name}_count', labels, entry[-2]
+            yield f'{self.name}_sum', labels, entry[-1]
+
+
+class Metrics:
+    """
+    Registry of the pipeline's counters, gauges and histograms.
+
+    Every stage (register ingest, website lookup, link crawl, map) records into the shared registry
+    from get_metrics(); write() dumps it as JSON or Prometheus text, progress_line() summarizes it.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = dict()
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.stage_seconds = self.histogram('stage_seconds', 'Wall-clock seconds spent per pipeline stage',
+                                            buckets=(1, 10, 60, 300, 1800, 3600, 4 * 3600, 24 * 3600))
+
+    def _get(self, cls, name: str, help: str, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, **kwargs)
+            return metric
+
+    def counter(self, name: str, help: str = '') -> Counter:
+        return self._get(Counter, name, help)
+
+    def gauge(self, name: str, help: str = '') -> Gauge:
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name: str, help: str = '', buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a pipeline stage, e.g. with metrics.stage('crawl'): ..."""
+        with self.stage_seconds.time(stage=name):
+            yield
+
+    def drain(self) -> dict:
+        """
+        Take the counter and histogram values recorded since the last drain, leaving them at zero.
+        A pool worker returns this with its results and the parent merge()s it, as the worker's own
+        registry is never written. Gauges are left out: a level only means something in its own process.
+        :return: name -> (kind, help, buckets or None, values), picklable.
+        """
+        snapshot = dict()
+        for metric in list(self._metrics.values()):
+            if isinstance(metric, Gauge):
+                continue
+            with metric._lock:
+                values, metric.values = metric.values, dict()
+            if values:
+                snapshot[metric.name] = (metric.kind, metric.help, getattr(metric, 'buckets', None), values)
+        return snapshot
+
+    def merge(self, snapshot: dict):
+        """Add the values drain()ed from another registry to this one."""
+        for name, (kind, help, buckets, values) in snapshot.items():
+            if kind == Histogram.kind:
+                metric = self.histogram(name, help, buckets)
+                with metric._lock:
+                    for labels, entry in values.items():
+                        own = metric.values.setdefault(labels, [0] * (len(metric.buckets) + 1) + [0.0])
+                        for i, value in enumerate(entry):
+                            own[i] += value
+            else:
+                metric = self.counter(name, help)
+                with metric._lock:
+                    for labels, value in values.items():
+                        metric.values[labels] = metric.values.get(labels, 0) + value
+
+    def to_dict(self) -> dict:
+        data = {'uptime_seconds': time.time() - self.started}
+        for metric in list(self._metrics.values()):
+            if isinstance(metric, Histogram):
+                data[metric.name] = {_format_labels(labels) or 'all': {'count': entry[-2], 'sum': entry[-1],
+                                                                        'p50': metric.quantile(0.5, **dict(labels)),
+                                                                        'p99': metric.quantile(0.99, **dict(labels))}
+                                     for labels, entry in list(metric.values.items())}
+            else:
+                data[metric.name] = {_format_labels(labels) or 'all': value
+                                     for labels, value in list(metric.values.items())}
+        return data
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            if metric.help:
+                lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        """Write all metrics to path, as Prometheus text for .prom/.txt files and as JSON otherwise."""
+        if path.endswith(('.prom', '.txt')):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=4)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def progress_line(self) -> str:
+        """One-line summary of the busiest numbers, for a live progress display."""
+        elapsed = max(time.time() - self.started, 1e-9)
+        parts = [f"{elapsed:.0f}s"]
+        for name, label in (('pages_fetched_total', 'pages'), ('companies_done_total', 'companies'),
+                            ('websites_resolved_total', 'lookups'), ('register_rows_total', 'rows')):
+            metric = self._metrics.get(name)
+            if metric is not None and metric.total():
+                parts.append(f"{metric.total():.0f} {label} ({metric.total() / elapsed:.1f}/s)")
+        for name, label in (('fetch_in_flight', 'in flight'), ('crawls_in_flight', 'crawls')):
+            metric = self._metrics.get(name)
+            if metric is not None:
+                parts.append(f"{metric.total():.0f} {label}")
+        fetch = self._metrics.get('fetch_seconds')
+        if isinstance(fetch, Histogram) and fetch.values:
+            count = sum(entry[-2] for entry in fetch.values.values())
+            total = sum(entry[-1] for entry in fetch.values.values())
+            parts.append(f"fetch {1000 * total / count:.0f}ms avg")
+        return ' | '.join(parts)
+
+
+class ProgressLine:
+    """Background thread that keeps a compact progress line up to date on the terminal."""
+
+    def __init__(self, metrics: 'Metrics', interval: float = 1.0, stream=None):
+        self.metrics = metrics
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.render()
+
+    def render(self, end: str = ''):
+        width = shutil.get_terminal_size().columns
+        self.stream.write('\r' + self.metrics.progress_line()[:width - 1].ljust(width - 1) + end)
+        self.stream.flush()
+
+    def __enter__(self) -> 'ProgressLine':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.render(end='\n')
+
+
+_metrics: Optional[Metrics] = None
+
+
+def get_metrics() -> Metrics:
+    """The process-wide shared Metrics registry."""
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import base64
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterator, NamedTuple, Optional
+
+import requests
+
+DEFAULT_ARCHIVE_PATH = 'page_archive'
+# Segments are closed and a new one started past this size
+MAX_SEGMENT_BYTES = 1024 * 1024 * 1024
+
+
+class ArchivedPage(NamedTuple):
+    url: str
+    status: int
+    content_type: str
+    encoding: Optional[str]
+    body: bytes
+
+    @property
+    def text(self) -> str:
+        return self.body.decode(self.encoding or 'utf-8', errors='replace')
+
+
+def payload_digest(body: bytes) -> str:
+    """WARC-Payload-Digest of a body: base32 SHA-1, as written by wget and Heritrix."""
+    return 'sha1:' + base64.b32encode(hashlib.sha1(body).digest()).decode('ascii')
+
+
+def warc_record(url: str, status: int, reason: str, content_type: str, body: bytes, digest: str) -> bytes:
+    """A WARC/1.0 response record. The HTTP headers are reduced to those that describe the stored body."""
+    http = (f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n").encode('latin-1') + body
+    headers = (f"WARC/1.0\r\n"
+               f"WARC-Type: response\r\n"
+               f"WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>\r\n"
+               f"WARC-Date: {datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}\r\n"
+               f"WARC-Target-URI: {url}\r\n"
+               f"WARC-Payload-Digest: {digest}\r\n"
+               f"Content-Type: application/http; msgtype=response\r\n"
+               f"Content-Length: {len(http)}\r\n\r\n").encode('utf-8')
+    return headers + http + b'\r\n\r\n'
+
+
+def parse_warc_record(record: bytes) -> ArchivedPage:
+    """Inverse of warc_record."""
+    warc_headers, _, rest = record.partition(b'\r\n\r\n')
+    url = ''
+    length = len(rest)
+    for line in warc_headers.split(b'\r\n')[1:]:
+        name, _, value = line.decode('utf-8').partition(':')
+        if name.lower() == 'warc-target-uri':
+            url = value.strip()
+        elif name.lower() == 'content-length':
+            length = int(value)
+    http_headers, _, body = rest[:length].partition(b'\r\n\r\n')
+    lines = http_headers.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ', 2)[1])
+    content_type = ''
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        if name.lower() == 'content-type':
+            content_type = value.strip()
+    encoding = requests.utils.get_encoding_from_headers({'Content-Type': content_type}) if content_type else None
+    return ArchivedPage(url, status, content_type, encoding, body)
+
+
+class PageArchive:
+    """
+    Append-only archive of crawled pages, so extraction rules can be re-run without fetching anything.
+
+    Pages are written as WARC response records, each its own gzip member, to segment files named after
+    the writing process (so several crawl processes can share the directory). A SQLite index maps every
+    URL to the site it was crawled for and the offset and length of its latest record; a page whose body
+    did not change since it was archived is not written again.
+    """
+
+    def __init__(self, path: str = DEFAULT_ARCHIVE_PATH, max_segment_bytes: int = MAX_SEGMENT_BYTES):
+        """
+        :param path: Directory holding the segments and index.sqlite.
+        :param max_segment_bytes: Size after which a new segment is started.
+        """
+        self.path = path
+        self.max_segment_bytes = max_segment_bytes
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(path, 'index.sqlite'), check_same_thread=False, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                site TEXT NOT NULL,
+                segment TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                stored_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_pages_site ON pages (site);
+        ''')
+        self.db.commit()
+        self._segment = None
+        self._segment_name: Optional[str] = None
+        self.pages_written = 0
+        self.pages_unchanged = 0
+
+    def __getstate__(self) -> dict:
+        return {'path': self.path, 'max_segment_bytes': self.max_segment_bytes}
+
+    def __setstate__(self, state: dict):
+        self.__init__(**state)
+
+    def __enter__(self) -> 'PageArchive':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
+            self.db.close()
+
+    def _open_segment(self):
+        if self._segment is not None and self._segment.tell() < self.max_segment_bytes:
+            return
+        if self._segment is not None:
+            self._segment.close()
+        self._segment_name = f"pages-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:6]}.warc.gz"
+        self._segment = open(os.path.join(self.path, self._segment_name), 'ab')
+
+    def put(self, site: str, response: requests.Response) -> bool:
+        """
+        Archive a fetched page.
+        :param site: canonical_host of the website being crawled, which the page is filed under.
+        :return: False if the page was archived before with the same body.
+        """
+        body = response.content
+        digest = payload_digest(body)
+        record = gzip.compress(warc_record(response.url, response.status_code, response.reason or '',
+                                           response.headers.get('Content-Type', ''), body, digest))
+        with self._lock:
+            row = self.db.execute('SELECT digest FROM pages WHERE url = ?', (response.url,)).fetchone()
+            if row and row[0] == digest:
+                self.db.execute('UPDATE pages SET site = ? WHERE url = ?', (site, response.url))
+                self.db.commit()
+                self.pages_unchanged += 1
+                return False
+            self._open_segment()
+            offset = self._segment.tell()
+            self._segment.write(record)
+            # Flushed before it is indexed, so the index never points past the end of a segment
+            self._segment.flush()
+            self.db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (response.url, site, self._segment_name, offset, len(record), digest, time.time()))
+            self.db.commit()
+            self.pages_written += 1
+        return True
+
+    def read(self, segment: str, offset: int, length: int) -> ArchivedPage:
+        with open(os.path.join(self.path, segment), 'rb') as f:
+            f.seek(offset)
+            return parse_warc_record(gzip.decompress(f.read(length)))
+
+    def get(self, url: str) -> Optional[ArchivedPage]:
+        """The latest archived version of a page."""
+        with self._lock:
+            row = self.db.execute('SELECT segment, offset, length FROM pages WHERE url = ?', (url,)).fetchone()
+        return self.read(*row) if row else None
+
+    def pages(self, site: str) -> Iterator[ArchivedPage]:
+        """The latest archived version of every page crawled for a site, in segment order."""
+        with self._lock:
+            rows = self.db.execute('SELECT segment, offset, length FROM pages WHERE site = ? '
+                                   'ORDER BY segment, offset', (site,)).fetchall()
+        handles = dict()
+        try:
+            for segment, offset, length in rows:
+                if segment not in handles:
+                    handles[segment] = open(os.path.join(self.path, segment), 'rb')
+                f = handles[segment]
+                f.seek(offset)
+                yield parse_warc_record(gzip.decompress(f.read(length)))
+        finally:
+            for f in handles.values():
+                f.close()
+
+    def sites(self) -> Dict[str, int]:
+        """Number of archived pages per site."""
+        with self._lock:
+            return dict(self.db.execute('SELECT site, COUNT(*) FROM pages GROUP BY site'))
+
+    def summary(self) -> str:
+        with self._lock:
+            pages, sites = self.db.execute('SELECT COUNT(*), COUNT(DISTINCT site) FROM pages').fetchone()
+        size = sum(entry.stat().st_size for entry in os.scandir(self.path) if entry.name.endswith('.warc.gz'))
+        return f"Page archive: {pages} pages of {sites} sites, {size / 1024 / 1024:.1f} MiB"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    argparser = argparse.ArgumentParser(description="Inspect the page archive.")
+    argparser.add_argument("--archive", default=DEFAULT_ARCHIVE_PATH, help="Directory of the page archive.")
+    argparser.add_argument("--url", help="Print the archived body of this URL.")
+    argparser.add_argument("--site", help="List the archived pages of this site (a canonical host).")
+    args = argparser.parse_args()
+
+    with PageArchive(args.archive) as archive:
+        if args.url:
+            page = archive.get(args.url)
+            print(page.text if page else f"{args.url} is not archived")
+        elif args.site:
+            for page in archive.pages(args.site):
+                print(f"{page.status}  {len(page.body):>8}  {page.url}")
+        else:
+            print(archive.summary())
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, NamedTuple, Optional
+
+DEFAULT_POSTINGS_PATH = 'postings.sqlite'
+
+# Change kinds
+ADDED = 'added'
+REMOVED = 'removed'
+
+
+class JobPosting(NamedTuple):
+    title: str
+    # Page of the posting itself, or the careers page it is listed on if it has none
+    url: str
+    location: Optional[str] = None
+    employment_type: Optional[str] = None
+    date_posted: Optional[str] = None
+    valid_through: Optional[str] = None
+    organization: Optional[str] = None
+    description: Optional[str] = None
+    # 'jsonld' or 'heuristic'
+    source: str = 'heuristic'
+
+    def key(self, page_url: str) -> str:
+        """Identity of the posting across runs: its own URL, or title and location on a listing page."""
+        if self.url and self.url != page_url:
+            return self.url
+        return f"{page_url}\0{self.title.strip().lower()}\0{(self.location or '').strip().lower()}"
+
+
+class Change(NamedTuple):
+    kind: str
+    kvk: str
+    page_url: str
+    posting: JobPosting
+
+
+def posting_id(kvk: str, page_url: str, key: str) -> str:
+    # Per careers page, so a posting listed on two pages is removed from one without affecting the other
+    return hashlib.blake2b(f"{kvk}\0{page_url}\0{key}".encode('utf-8', 'surrogatepass'), digest_size=12).hexdigest()
+
+
+class PostingStore:
+    """
+    SQLite store of the job postings found on careers pages, with the content hash of every careers page.
+    Pages are tracked per company: companies sharing a website share its careers pages, but each keeps
+    its own hashes and postings.
+
+    Postings are never deleted: a posting that disappears from its page gets removed_at set, so the
+    store answers both "what is open now" and "what changed since".
+    """
+
+    def __init__(self, path: str = DEFAULT_POSTINGS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        # Stores from before pages were keyed by company; only hashes are lost, the pages are parsed once more
+        if {row[1]: row[5] for row in self.db.execute('PRAGMA table_info(pages)')}.get('kvk') == 0:
+            self.db.execute('DROP TABLE pages')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS pages (
+                kvk TEXT NOT NULL,
+                url TEXT NOT NULL,
+                content_hash TEXT,
+                checked_at REAL NOT NULL,
+                changed_at REAL,
+                PRIMARY KEY (kvk, url)
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                id TEXT PRIMARY KEY,
+                kvk TEXT NOT NULL,
+                page_url TEXT NOT NULL,
+                title TEXT NOT NULL,
+                url TEXT NOT NULL,
+                location TEXT,
+                employment_type TEXT,
+                date_posted TEXT,
+                valid_through TEXT,
+                organization TEXT,
+                description TEXT,
+                source TEXT NOT NULL,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL,
+                removed_at REAL
+            );
+            DROP INDEX IF EXISTS idx_postings_page;
+            CREATE INDEX IF NOT EXISTS idx_postings_kvk_page ON postings (kvk, page_url, removed_at);
+            CREATE INDEX IF NOT EXISTS idx_postings_kvk ON postings (kvk);
+            CREATE INDEX IF NOT EXISTS idx_postings_first_seen ON postings (first_seen);
+            CREATE INDEX IF NOT EXISTS idx_postings_removed_at ON postings (removed_at);
+        ''')
+        self.db.commit()
+
+    def __getstate__(self) -> dict:
+        return {'path': self.path}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state['path'])
+
+    def __enter__(self) -> 'PostingStore':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    def content_hash(self, kvk: str, url: str) -> Optional[str]:
+        """Hash of a company's careers page when its postings were last extracted, None if never."""
+        with self._lock:
+            row = self.db.execute('SELECT content_hash FROM pages WHERE kvk = ? AND url = ?', (kvk, url)).fetchone()
+        return row[0] if row else None
+
+    def mark_unchanged(self, kvk: str, url: str):
+        with self._lock, self.db:
+            self.db.execute('UPDATE pages SET checked_at = ? WHERE kvk = ? AND url = ?', (time.time(), kvk, url))
+
+    def update_page(self, kvk: str, page_url: str, content_hash: Optional[str],
+                    postings: Iterable[JobPosting]) -> List[Change]:
+        """
+        Replace the open postings of a careers page with those just extracted from it, in one transaction.
+        :param content_hash: Hash of the page content, None if the page is gone.
+        :return: The postings added and removed.
+        """
+        now = time.time()
+        current = dict()
+        for posting in postings:
+            current.setdefault(posting_id(kvk, page_url, posting.key(page_url)), posting)
+        changes = []
+        with self._lock, self.db:
+            open_rows = {row[0]: row for row in self.db.execute(
+                f'SELECT id, {", ".join(JobPosting._fields)} FROM postings '
+                f'WHERE kvk = ? AND page_url = ? AND removed_at IS NULL', (kvk, page_url))}
+            for pid, row in open_rows.items():
+                if pid not in current:
+                    changes.append(Change(REMOVED, kvk, page_url, JobPosting(*row[1:])))
+            self.db.executemany('UPDATE postings SET removed_at = ? WHERE id = ?',
+                                [(now, pid) for pid in open_rows if pid not in current])
+            for pid, posting in current.items():
+                if pid in open_rows:
+                    self.db.execute('UPDATE postings SET last_seen = ? WHERE id = ?', (now, pid))
+                    continue
+                # New, or back after it was removed
+                changes.append(Change(ADDED, kvk, page_url, posting))
+                self.db.execute(f'INSERT INTO postings (id, kvk, page_url, {", ".join(JobPosting._fields)}, '
+                                f'first_seen, last_seen) VALUES ({", ".join("?" * (len(JobPosting._fields) + 5))}) '
+                                f'ON CONFLICT (id) DO UPDATE SET removed_at = NULL, last_seen = excluded.last_seen, '
+                                f'first_seen = excluded.first_seen',
+                                (pid, kvk, page_url, *posting, now, now))
+            self.db.execute('INSERT INTO pages (kvk, url, content_hash, checked_at, changed_at) VALUES (?, ?, ?, ?, ?) '
+                            'ON CONFLICT (kvk, url) DO UPDATE SET content_hash = excluded.content_hash, '
+                            'checked_at = excluded.checked_at, changed_at = excluded.changed_at',
+                            (kvk, page_url, content_hash, now, now))
+        return changes
+
+    def search(self, text: Optional[str] = None, location: Optional[str] = None, kvk: Optional[str] = None,
+               since: Optional[float] = None, include_removed: bool = False, limit: int = 100) -> List[tuple]:
+        """
+        Query the postings.
+        :param text: Substring of the title or description, case-insensitive.
+        :param location: Substring of the location, case-insensitive.
+        :param since: Only postings first seen after this time.time().
+        :return: (kvk, title, location, url, first_seen, removed_at) rows, newest first.
+        """
+        where, params = [], []
+        if not include_removed:
+            where.append('removed_at IS NULL')
+        if text:
+            where.append('(title LIKE ? OR description LIKE ?)')
+            params += [f'%{text}%', f'%{text}%']
+        if location:
+            where.append('location LIKE ?')
+            params.append(f'%{location}%')
+        if kvk:
+            where.append('kvk = ?')
+            params.append(kvk)
+        if since is not None:
+            where.append('first_seen > ?')
+            params.append(since)
+        sql = 'SELECT kvk, title, location, url, first_seen, removed_at FROM postings'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        with self._lock:
+            return self.db.execute(sql + ' ORDER BY first_seen DESC LIMIT ?', (*params, limit)).fetchall()
+
+    def counts(self) -> dict:
+        with self._lock:
+            open_postings, removed = self.db.execute(
+                'SELECT COUNT(*) - COUNT(removed_at), COUNT(removed_at) FROM postings').fetchone()
+            companies, = self.db.execute('SELECT COUNT(DISTINCT kvk) FROM postings WHERE removed_at IS NULL').fetchone()
+            pages, = self.db.execute('SELECT COUNT(*) FROM pages').fetchone()
+        return {'open': open_postings, 'removed': removed, 'companies': companies, 'pages': pages}
+
+    def summary(self) -> str:
+        counts = self.counts()
+        return f"Postings: {counts['open']} open at {counts['companies']} companies, {counts['removed']} removed, " \
+               f"{counts['pages']} careers pages tracked"
+
+
+if __name__ == "__main__":
+    import argparse
+    from datetime import datetime, timedelta
+
+    argparser = argparse.ArgumentParser(description="Query the job postings store.")
+    argparser.add_argument("--store", default=DEFAULT_POSTINGS_PATH, help="Path of the postings store.")
+    argparser.add_argument("--text", help="Only postings with this in their title or description.")
+    argparser.add_argument("--location", help="Only postings with this in their location.")
+    argparser.add_argument("--kvk", help="Only postings of this company.")
+    argparser.add_argument("--days", type=float, help="Only postings first seen in the last this many days.")
+    argparser.add_argument("--removed", action='store_true', help="Include postings that were taken down.")
+    argparser.add_argument("--limit", type=int, default=100, help="Maximum number of postings listed.")
+    args = argparser.parse_args()
+
+    since = (datetime.now() - timedelta(days=args.days)).timestamp() if args.days is not None else None
+    with PostingStore(args.store) as store:
+        for kvk, title, location, url, first_seen, removed_at in store.search(
+                args.text, args.location, args.kvk, since, args.removed, args.limit):
+            seen = datetime.fromtimestamp(first_seen).strftime('%Y-%m-%d')
+            removed = f" (removed {datetime.fromtimestamp(removed_at):%Y-%m-%d})" if removed_at else ''
+            print(f"{seen}  {kvk}  {title}  [{location or '-'}]  {url}{removed}")
+        print(store.summary())
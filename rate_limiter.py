@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import multiprocessing
+import time
+from typing import Optional
+
+# Indexes into the shared state array
+_TOKENS, _UPDATED, _RATE, _PAUSED_UNTIL, _LAST_DECREASE = range(5)
+
+
+class TokenBucket:
+    """
+    Token bucket shared by all processes of a pool, with AIMD rate adjustment.
+
+    Every request takes a token; a worker without a token sleeps exactly until the next one is due
+    instead of polling. Each success raises the rate additively, a 429 halves it (at most once per
+    refill interval, so a burst of 429s from many workers counts once) and pauses the whole pool
+    for the Retry-After period if the server gave one.
+
+    The state lives in shared memory, so the bucket must be handed to workers when they are created,
+    e.g. through Pool(initializer=..., initargs=(bucket,)).
+    """
+
+    def __init__(self, rate: float = 0.5, capacity: float = 1.0, min_rate: float = 0.02, max_rate: float = 5.0,
+                 increase: float = 0.02, decrease: float = 0.5):
+        """
+        :param rate: Initial requests per second.
+        :param capacity: Maximum burst size in requests.
+        :param min_rate: Lower bound for the rate after decreases.
+        :param max_rate: Upper bound for the rate after increases.
+        :param increase: Requests per second added after each success.
+        :param decrease: Factor the rate is multiplied with after a 429.
+        """
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        now = time.time()
+        self._state = multiprocessing.Array('d', [capacity, now, rate, 0.0, 0.0])
+
+    @property
+    def rate(self) -> float:
+        with self._state.get_lock():
+            return self._state[_RATE]
+
+    def _refill(self, now: float):
+        state = self._state
+        elapsed = max(0.0, now - max(state[_UPDATED], state[_PAUSED_UNTIL]))
+        state[_TOKENS] = min(self.capacity, state[_TOKENS] + elapsed * state[_RATE])
+        state[_UPDATED] = max(now, state[_UPDATED])
+
+    def acquire(self):
+        """Block until a request may be made."""
+        while True:
+            with self._state.get_lock():
+                now = time.time()
+                state = self._state
+                if now >= state[_PAUSED_UNTIL]:
+                    self._refill(now)
+                    if state[_TOKENS] >= 1.0:
+                        state[_TOKENS] -= 1.0
+                        return
+                    wait = (1.0 - state[_TOKENS]) / state[_RATE]
+                else:
+                    wait = state[_PAUSED_UNTIL] - now
+            time.sleep(wait)
+
+    def on_success(self):
+        """Additive increase after a request that was not throttled."""
+        with self._state.get_lock():
+            self._state[_RATE] = min(self.max_rate, self._state[_RATE] + self.increase)
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        """
+        Multiplicative decrease after a 429.
+        :param retry_after: Seconds the server asked to wait, pauses all workers if given.
+        """
+        with self._state.get_lock():
+            now = time.time()
+            state = self._state
+            # Throttles reported within one refill interval of the last decrease belong to the same burst
+            if now - state[_LAST_DECREASE] >= 1.0 / state[_RATE]:
+                state[_RATE] = max(self.min_rate, state[_RATE] * self.decrease)
+                state[_LAST_DECREASE] = now
+                state[_TOKENS] = min(state[_TOKENS], 0.0)
+            if retry_after:
+                state[_PAUSED_UNTIL] = max(state[_PAUSED_UNTIL], now + retry_after)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds from a Retry-After header, None if missing or given as a date."""
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+from multiprocessing import Pool, cpu_count
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from bs4 import ParserRejectedMarkup
+
+from company import Company
+from link_classifier import PRIORITY_CAREER
+from page_archive import DEFAULT_ARCHIVE_PATH, PageArchive
+from scrape_website_links import JobCrawler
+from url_utils import VisitedSet, canonical_host, canonicalize_url
+
+
+class SiteResults(NamedTuple):
+    """What extraction found on the archived pages of a site."""
+    career_links: Set[str]
+    emails: Set[str]
+    external_links: Set[str]
+    visited: VisitedSet
+    pages: int
+
+
+archive: Optional[PageArchive] = None
+parser: Optional[str] = None
+
+
+def init_worker(archive_path: str, html_parser: Optional[str] = None):
+    global archive, parser
+    archive = PageArchive(archive_path)
+    parser = html_parser
+
+
+def extract_site(site: str) -> Tuple[str, Optional[SiteResults]]:
+    """
+    Extract everything from the archived pages of a site, as a crawl of it would have.
+    :return: (site, results), results is None if nothing of the site is archived.
+    """
+    crawler = JobCrawler(Company(name=site, kvk='', website=f'https://{site}/'), parser=parser,
+                         use_sitemaps=False)
+    urls = []
+    for page in archive.pages(site):
+        if page.status != 200:
+            continue
+        urls.append(page.url)
+        # Pages fetched because of a career keyword in their URL, e.g. sitemap candidates, are career links too
+        if crawler.classifier.priority(urlparse(page.url).path, '') == PRIORITY_CAREER:
+            crawler.career_links.add(canonicalize_url(page.url))
+        try:
+            crawler.extract(page.url, page.text, 0)
+        except ParserRejectedMarkup as e:
+            print(f"Assertion error: {e}")
+    if not urls:
+        return site, None
+    # Marked visited only now: during the crawl, links to a page were seen before the page itself was fetched
+    visited = VisitedSet()
+    for url in urls:
+        visited.add(url)
+    return site, SiteResults(crawler.career_links, crawler.emails, crawler.external_links, visited, len(urls))
+
+
+def apply_results(company: Company, results: SiteResults) -> bool:
+    """
+    Replace the crawl results of a company with those re-extracted from the archive and save it.
+    crawled_at is left alone, nothing was fetched.
+    :return: True if a careers page was found.
+    """
+    company.careers_page = sorted(results.career_links) or None
+    company.visited = results.visited
+    company.external_links = set(results.external_links)
+    company.emails = set(results.emails)
+    company.save()
+    return bool(results.career_links)
+
+
+def reextract(companies: List[Company], archive_path: str = DEFAULT_ARCHIVE_PATH,
+              processes: Optional[int] = None, html_parser: Optional[str] = None) -> Dict[str, int]:
+    """
+    Re-extract the crawl results of companies from the archive over a process pool. Companies sharing a
+    website are extracted once. Only the parent process saves companies.
+    :return: Counts of 'sites', 'companies', 'pages', 'careers' and 'missing' (sites without archived pages).
+    """
+    by_site: Dict[str, List[Company]] = dict()
+    for company in companies:
+        try:
+            site = canonical_host(company.website)
+        except ValueError:
+            continue
+        if site:
+            by_site.setdefault(site, []).append(company)
+
+    counts = dict(sites=0, companies=0, pages=0, careers=0, missing=0)
+    with Pool(processes or cpu_count(), initializer=init_worker, initargs=(archive_path, html_parser)) as pool:
+        for site, results in pool.imap_unordered(extract_site, by_site, chunksize=8):
+            if results is None:
+                counts['missing'] += 1
+                continue
+            counts['sites'] += 1
+            counts['pages'] += results.pages
+            for company in by_site[site]:
+                counts['companies'] += 1
+                counts['careers'] += apply_results(company, results)
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from html_extract import PARSERS
+    from metrics import get_metrics
+    from utils import iter_companies, with_website
+
+    argparser = argparse.ArgumentParser(
+        description="Re-run link classification, email extraction and careers detection over the page archive, "
+                    "without fetching anything, e.g. after the career keywords or skip rules changed.")
+    argparser.add_argument("--archive", default=DEFAULT_ARCHIVE_PATH, help="Directory of the page archive.")
+    argparser.add_argument("--processes", type=int, help="Number of worker processes, defaults to the CPU count.")
+    argparser.add_argument("--parser", choices=PARSERS, help="HTML parser, defaults to lxml if installed.")
+    argparser.add_argument("--metrics", help="Write metrics to this file (.prom/.txt for Prometheus text, else JSON).")
+    args = argparser.parse_args()
+
+    metrics = get_metrics()
+    started = time.time()
+    with metrics.stage('reextract'):
+        # Everything else is replaced, so the stored link lists are not loaded
+        companies = list(iter_companies(where=with_website, fields=('website',)))
+        counts = reextract(companies, args.archive, args.processes, args.parser)
+    print(f"Re-extracted {counts['pages']} pages of {counts['sites']} sites for {counts['companies']} companies "
+          f"in {time.time() - started:.1f}s: {counts['careers']} with a careers page, "
+          f"{counts['missing']} sites not archived")
+    if args.metrics:
+        metrics.write(args.metrics)
@@ -4,7 +4,14 @@ from __future__ import annotations
 import os
 import requests
 from bs4 import BeautifulSoup
-from typing import List, Optional
+from datetime import date
+from html.parser import HTMLParser
+from fetcher import get_fetcher
+from html_extract import parse_tables
+from metrics import get_metrics
+from company import Company
+from utils import DEFAULT_SOURCE, is_store_path, iter_companies
+from typing import Dict, Iterator, List, Optional, Tuple
 import time
 import logging
 import json
@@ -14,18 +21,21 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 
 # URL of the webpage
 url = "https://ind.nl/en/public-register-recognised-sponsors/public-register-regular-labour-and-highly-skilled-migrants"
+# A register read with fewer rows than this fraction of the listed companies is taken to be truncated
+# (a changed page layout, a cut-off response) and its delistings are not applied
+MIN_REGISTER_FRACTION = 0.9
 
 
 def fetch_webpage(url: str) -> Optional[BeautifulSoup]:
     """
     Fetch and parse the webpage.
     :param url: The URL of the webpage to fetch.
-    :return: Parsed BeautifulSoup object or None if fetch fails.
+    :return: BeautifulSoup object of the page's table bodies or None if fetch fails.
     """
     try:
-        response = requests.get(url, timeout=10)
+        response = get_fetcher().get(url, timeout=10)
         response.raise_for_status()  # Ensure we notice bad responses
-        return BeautifulSoup(response.text, 'html.parser')
+        return parse_tables(response.text)
     except requests.RequestException as e:
         logging.error(f"Error fetching the webpage: {e}")
         return None
@@ -78,6 +88,225 @@ def save_company_data(company: dict) -> int:
     return 1
 
 
+def save_companies_to_store(companies: List[dict], path: str) -> int:
+    """
+    Save new companies to a CompanyStore in one transaction, skipping kvk numbers already stored.
+    :param companies: List of dictionaries containing company 'name' and 'kvk'.
+    :param path: Path of the SQLite store.
+    :return: Number of companies saved.
+    """
+    from company_store import CompanyStore
+    with CompanyStore(path) as store:
+        existing = store.kvks()
+        new = [Company(name=company["name"], kvk=company["kvk"])
+               for company in companies if company["kvk"] not in existing]
+        return store.upsert_many(new)
+
+
+class RegisterRowParser(HTMLParser):
+    """
+    Incremental parser for the register table. Feed it chunks of HTML and collect the
+    completed rows as they come in, without building a tree of the whole page.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows: List[dict] = []
+        self._in_tbody = False
+        self._tbody_rows = 0
+        self._cells: Optional[List[str]] = None
+        self._cell: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tbody':
+            self._in_tbody = True
+        elif tag == 'tr' and self._in_tbody:
+            self._cells = []
+        elif tag == 'td' and self._cells is not None:
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag == 'td' and self._cell is not None:
+            self._cells.append(''.join(self._cell).strip())
+            self._cell = None
+        elif tag == 'tr' and self._cells is not None:
+            self._tbody_rows += 1
+            # Skip the first row (header), like parse_table
+            if self._tbody_rows > 1 and len(self._cells) == 2:
+                self.rows.append({"name": self._cells[0], "kvk": self._cells[1]})
+            self._cells = None
+        elif tag == 'tbody':
+            self._in_tbody = False
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+    def take_rows(self) -> List[dict]:
+        rows, self.rows = self.rows, []
+        return rows
+
+
+def stream_register(url: str, chunk_size: int = 64 * 1024) -> Iterator[dict]:
+    """
+    Download the register and yield its rows while the page is still coming in.
+    :param url: The URL of the register page.
+    :param chunk_size: Size of the chunks read from the response.
+    :return: Generator of dictionaries with organisation name and KvK number.
+    """
+    parser = RegisterRowParser()
+    with get_fetcher().session(url).get(url, timeout=10, stream=True) as response:
+        response.raise_for_status()
+        if response.encoding is None:
+            response.encoding = 'utf-8'
+        for chunk in response.iter_content(chunk_size=chunk_size, decode_unicode=True):
+            parser.feed(chunk)
+            yield from parser.take_rows()
+    parser.close()
+    yield from parser.take_rows()
+
+
+def load_register_entries(source: str) -> Dict[str, Tuple[str, Optional[str]]]:
+    """
+    Look up every known company in one pass.
+    :param source: JSON directory or SQLite store.
+    :return: Dictionary mapping kvk to (name, delisted).
+    """
+    if is_store_path(source):
+        from company_store import CompanyStore
+        with CompanyStore(source) as store:
+            return store.register_entries()
+    if not os.path.isdir(source):
+        return dict()
+    return {company.kvk: (company.name, company.delisted)
+            for company in iter_companies(source, fields=('delisted',))}
+
+
+def diff_register(rows: Iterator[dict], known: Dict[str, Tuple[str, Optional[str]]]) -> dict:
+    """
+    Compare the register rows against the known companies.
+    :return: Change report with 'added', 'renamed', 'relisted' and 'delisted' lists, and the number of
+             distinct 'rows' read.
+    """
+    report = {'added': [], 'renamed': [], 'relisted': [], 'delisted': []}
+    seen = set()
+    rows_total = get_metrics().counter('register_rows_total', 'Register rows read')
+    for row in rows:
+        rows_total.inc()
+        kvk, name = row["kvk"], row["name"]
+        if kvk in seen:
+            continue
+        seen.add(kvk)
+        if kvk not in known:
+            report['added'].append({"kvk": kvk, "name": name})
+            continue
+        known_name, delisted = known[kvk]
+        if delisted:
+            report['relisted'].append({"kvk": kvk, "name": name})
+        if known_name != name:
+            report['renamed'].append({"kvk": kvk, "old_name": known_name, "name": name})
+    for kvk, (name, delisted) in known.items():
+        if kvk not in seen and not delisted:
+            report['delisted'].append({"kvk": kvk, "name": name})
+    report['rows'] = len(seen)
+    return report
+
+
+def check_delistings(report: dict, known: Dict[str, Tuple[str, Optional[str]]]) -> bool:
+    """
+    Drop the delistings from the report if the register read looks truncated, see MIN_REGISTER_FRACTION.
+    :return: False if delistings were dropped.
+    """
+    listed = sum(1 for _, delisted in known.values() if not delisted)
+    if not report['delisted'] or report['rows'] >= MIN_REGISTER_FRACTION * listed:
+        return True
+    logging.error(f"Register has {report['rows']} rows for {listed} listed companies, "
+                  f"not delisting {len(report['delisted'])} companies")
+    get_metrics().counter('register_delistings_refused_total',
+                          'Delistings not applied because the register looked truncated').inc(len(report['delisted']))
+    report['delisted'] = []
+    return False
+
+
+def apply_register_changes(report: dict, source: str) -> int:
+    """
+    Write only the companies that changed, in one batch.
+    :return: Number of companies written.
+    """
+    today = date.today().isoformat()
+    updates: Dict[str, dict] = dict()
+    for entry in report['renamed']:
+        updates.setdefault(entry["kvk"], {})['name'] = entry["name"]
+    for entry in report['relisted']:
+        updates.setdefault(entry["kvk"], {})['delisted'] = None
+    for entry in report['delisted']:
+        updates.setdefault(entry["kvk"], {})['delisted'] = today
+
+    companies = [Company(name=entry["name"], kvk=entry["kvk"]) for entry in report['added']]
+    if is_store_path(source):
+        from company_store import CompanyStore
+        with CompanyStore(source) as store:
+            for kvk in updates:
+                company = store.get(kvk)
+                for field, value in updates[kvk].items():
+                    setattr(company, field, value)
+                companies.append(company)
+            return store.upsert_many(companies)
+
+    os.makedirs(source, exist_ok=True)
+    for company in companies:
+        company.file_path = os.path.join(source, f'{company.kvk}.json')
+    for kvk in updates:
+        company = Company.from_json(os.path.join(source, f'{kvk}.json'))
+        for field, value in updates[kvk].items():
+            setattr(company, field, value)
+        companies.append(company)
+    for company in companies:
+        company.save_to_json()
+    return len(companies)
+
+
+def incremental_ingest(source: str = DEFAULT_SOURCE, report_path: Optional[str] = None) -> Optional[dict]:
+    """
+    Stream the register, diff it against the known companies and write only the changes.
+    :param source: JSON directory or SQLite store to update.
+    :param report_path: Optional path to write the change report to as JSON.
+    :return: The change report, or None if the register could not be fetched.
+    """
+    logging.info(f"Working (incremental)...")
+    before = time.time()
+    known = load_register_entries(source)
+    afterLookup = time.time()
+    try:
+        report = diff_register(stream_register(url), known)
+    except requests.RequestException as e:
+        logging.error(f"Error fetching the webpage: {e}")
+        return None
+    afterDiff = time.time()
+    check_delistings(report, known)
+    written = apply_register_changes(report, source)
+    afterSave = time.time()
+
+    logging.info(f"Done! ({afterSave - before:.2f}s) {len(report['added'])} added, {len(report['renamed'])} renamed, "
+                 f"{len(report['relisted'])} relisted, {len(report['delisted'])} delisted. {written} records written")
+    for entry in report['renamed']:
+        logging.info(f'Renamed: {entry["old_name"]} -> {entry["name"]} (KvK: {entry["kvk"]})')
+    for entry in report['delisted']:
+        logging.info(f'Delisted: {entry["name"]} (KvK: {entry["kvk"]})')
+    logging.debug(f'Known lookup:   {afterLookup-before:.2f}s')
+    logging.debug(f'Stream + diff:  {afterDiff-afterLookup:.2f}s')
+    logging.debug(f'File I/O:       {afterSave-afterDiff:.2f}s')
+    stage_seconds = get_metrics().stage_seconds
+    stage_seconds.observe(afterLookup - before, stage='ingest_lookup')
+    stage_seconds.observe(afterDiff - afterLookup, stage='ingest_diff')
+    stage_seconds.observe(afterSave - afterDiff, stage='ingest_save')
+
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+    return report
+
+
 def main():
     """Main function to orchestrate the fetching, parsing, and saving of data."""
     logging.info(f"Working...")
@@ -88,11 +317,15 @@ def main():
     afterUrl = time.time()
 
     companies = parse_table(soup)
-    
+    get_metrics().counter('register_rows_total', 'Register rows read').inc(len(companies))
+
     afterTableParse = time.time()
     saved = 0
-    for company in companies:
-        saved += save_company_data(company)
+    if is_store_path(DEFAULT_SOURCE):
+        saved = save_companies_to_store(companies, DEFAULT_SOURCE)
+    else:
+        for company in companies:
+            saved += save_company_data(company)
 
     afterSave = time.time()
 
@@ -100,7 +333,25 @@ def main():
     logging.debug(f'Webpage fetch: {afterUrl-beforeUrl:.2f}s')
     logging.debug(f'Table parse:   {afterTableParse-afterUrl:.2f}s')
     logging.debug(f'File I/O:      {afterSave-afterTableParse:.2f}s')
+    stage_seconds = get_metrics().stage_seconds
+    stage_seconds.observe(afterUrl - beforeUrl, stage='ingest_fetch')
+    stage_seconds.observe(afterTableParse - afterUrl, stage='ingest_parse')
+    stage_seconds.observe(afterSave - afterTableParse, stage='ingest_save')
 
 
 if __name__ == "__main__":
-    main()
+    import argparse
+
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--incremental", action='store_true',
+                           help="Stream the register and only write added, renamed and delisted companies.")
+    argparser.add_argument("--report", help="Write the incremental change report to this JSON file.")
+    argparser.add_argument("--metrics", help="Write metrics to this file (.prom/.txt for Prometheus text, else JSON).")
+    args = argparser.parse_args()
+
+    if args.incremental:
+        incremental_ingest(report_path=args.report)
+    else:
+        main()
+    if args.metrics:
+        get_metrics().write(args.metrics)
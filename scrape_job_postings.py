@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import hashlib
+import html as html_lib
+import re
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from bs4 import ParserRejectedMarkup
+
+from company import Company
+from fetcher import HTML_CONTENT_TYPES, Fetcher, get_fetcher
+from html_extract import PARSERS, LinkExtractor, json_ld
+from link_classifier import SKIP_PREFIXES, LinkClassifier, ats_careers_vendor, get_classifier
+from metrics import get_metrics
+from posting_store import ADDED, Change, JobPosting, PostingStore
+from scrape_website_links import MAX_PAGE_BYTES
+from url_utils import canonical_host, canonicalize_url
+
+# Descriptions are kept for searching, not for display
+MAX_DESCRIPTION = 2000
+# Link texts outside this range are not job titles
+MIN_TITLE, MAX_TITLE = 3, 120
+_TAGS = re.compile(r'<[^>]+>')
+
+
+def page_hash(body: bytes) -> str:
+    """Content hash of a careers page; postings are only extracted again when it changes."""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def _text(value) -> Optional[str]:
+    """Plain text of a JSON-LD value, which may be a string, a list or an object with a name."""
+    if value is None:
+        return None
+    if isinstance(value, list):
+        parts = [_text(item) for item in value]
+        return ', '.join(dict.fromkeys(part for part in parts if part)) or None
+    if isinstance(value, dict):
+        return _text(value.get('name'))
+    text = ' '.join(html_lib.unescape(_TAGS.sub(' ', str(value))).split())
+    return text or None
+
+
+def _location(posting: dict) -> Optional[str]:
+    locations = posting.get('jobLocation') or []
+    if isinstance(locations, dict):
+        locations = [locations]
+    parts = []
+    for location in locations if isinstance(locations, list) else [locations]:
+        address = location.get('address', location) if isinstance(location, dict) else location
+        if isinstance(address, dict):
+            parts.append(_text(address.get('addressLocality')) or _text(address.get('addressRegion'))
+                         or _text(address.get('addressCountry')))
+        else:
+            parts.append(_text(address))
+    if posting.get('jobLocationType') == 'TELECOMMUTE':
+        parts.append('Remote')
+    return ', '.join(dict.fromkeys(part for part in parts if part)) or None
+
+
+def _walk_job_postings(node, depth: int = 0) -> Iterator[dict]:
+    # JobPostings appear on their own, in a list, in an @graph or inside an ItemList
+    if depth > 10:
+        return
+    if isinstance(node, list):
+        for item in node:
+            yield from _walk_job_postings(item, depth + 1)
+    elif isinstance(node, dict):
+        types = node.get('@type')
+        if 'JobPosting' in (types if isinstance(types, list) else [types]):
+            yield node
+            return
+        for value in node.values():
+            if isinstance(value, (list, dict)):
+                yield from _walk_job_postings(value, depth + 1)
+
+
+def jsonld_postings(blocks: List[object], page_url: str) -> List[JobPosting]:
+    """The schema.org JobPostings in the JSON-LD blocks of a page."""
+    postings = []
+    for node in _walk_job_postings(blocks):
+        title = _text(node.get('title')) or _text(node.get('name'))
+        if not title:
+            continue
+        url = node.get('url')
+        description = _text(node.get('description'))
+        postings.append(JobPosting(
+            title=title,
+            url=canonicalize_url(urljoin(page_url, url)) if isinstance(url, str) and url else page_url,
+            location=_location(node),
+            employment_type=_text(node.get('employmentType')),
+            date_posted=_text(node.get('datePosted')),
+            valid_through=_text(node.get('validThrough')),
+            organization=_text(node.get('hiringOrganization')),
+            description=description[:MAX_DESCRIPTION] if description else None,
+            source='jsonld',
+        ))
+    return postings
+
+
+def heuristic_postings(links: List[Tuple[str, str]], page_url: str, classifier: LinkClassifier) -> List[JobPosting]:
+    """
+    Guess the postings on a careers page without structured data: links below the careers page
+    (/vacatures/monteur below /vacatures), links deeper than it with a career keyword in their path,
+    and links into an applicant tracking system, titled by their link text.
+    """
+    page = canonicalize_url(page_url)
+    page_host = canonical_host(page)
+    base_path = urlsplit(page).path
+    postings: Dict[str, JobPosting] = dict()
+    for href, text in links:
+        title = ' '.join(text.split())
+        if not MIN_TITLE <= len(title) <= MAX_TITLE:
+            continue
+        if href.startswith(SKIP_PREFIXES) or href.startswith('mailto:') or classifier.has_skipped_extension(href):
+            continue
+        try:
+            url = canonicalize_url(urljoin(page_url, href))
+            host = canonical_host(url)
+        except ValueError:
+            continue
+        path = urlsplit(url).path
+        if url == page or not path:
+            continue
+        if host == page_host:
+            below_listing = bool(base_path) and path.startswith(base_path + '/')
+            deeper = path.count('/') > max(base_path.count('/'), 1)
+            if not below_listing and not (deeper and classifier.career_pattern.search(path.lower())):
+                continue
+        elif not (ats_careers_vendor(url) and path.count('/') >= 2):
+            continue
+        # Navigation links named after a career keyword, e.g. "Vacatures" or "Werken bij", are not postings
+        if classifier.career_pattern.fullmatch(title.lower()):
+            continue
+        postings.setdefault(url, JobPosting(title, url, source='heuristic'))
+    return list(postings.values())
+
+
+def extract_postings(html: str, page_url: str, extractor: Optional[LinkExtractor] = None,
+                     classifier: Optional[LinkClassifier] = None) -> List[JobPosting]:
+    """
+    The job postings on a careers page: its schema.org JobPosting JSON-LD if it has any,
+    else what heuristic_postings makes of its links.
+    :param page_url: URL the page was served from, to resolve relative links.
+    """
+    extractor = extractor or LinkExtractor()
+    postings = jsonld_postings(json_ld(html, extractor.parser), page_url)
+    if postings:
+        return postings
+    return heuristic_postings(extractor.links(html), page_url, classifier or get_classifier())
+
+
+class PostingScraper:
+    """
+    Extracts the postings of each careers page into a PostingStore. A page whose content hash did not
+    change since the previous run is not parsed again; a changed page yields the postings added to and
+    removed from it.
+    """
+
+    def __init__(self, store: PostingStore, fetcher: Optional[Fetcher] = None, force: bool = False,
+                 parser: Optional[str] = None, timeout: Tuple[float, float] = (5.0, 15.0)):
+        """
+        :param store: Where postings and page hashes are kept.
+        :param fetcher: Fetch layer to use, defaults to the shared pooled Fetcher.
+        :param force: Parse every page, also when its content hash did not change.
+        :param parser: BeautifulSoup parser, defaults to lxml if installed.
+        :param timeout: (connect, read) timeout in seconds.
+        """
+        self.store = store
+        self.fetcher = fetcher or get_fetcher()
+        self.force = force
+        self.parser = parser
+        self.timeout = timeout
+        self.classifier = get_classifier()
+
+    def scrape_page(self, kvk: str, url: str, extractor: LinkExtractor) -> Tuple[str, List[Change]]:
+        """
+        :return: ('unchanged', 'changed', 'gone' or 'failed', the changes to the page's postings)
+        """
+        try:
+            response = self.fetcher.get(url, timeout=self.timeout, max_bytes=MAX_PAGE_BYTES,
+                                        content_types=HTML_CONTENT_TYPES)
+        except requests.RequestException as e:
+            print(f"Request failed: {e}")
+            return 'failed', []
+        if response.status_code in (404, 410):
+            # The careers page is gone and its postings with it
+            return 'gone', self.store.update_page(kvk, url, None, [])
+        if response.status_code != 200:
+            print(f"Failed to access: {url}", response)
+            return 'failed', []
+        digest = page_hash(response.content)
+        if not self.force and self.store.content_hash(kvk, url) == digest:
+            self.store.mark_unchanged(kvk, url)
+            return 'unchanged', []
+        try:
+            postings = extract_postings(response.text, response.url or url, extractor, self.classifier)
+        except ParserRejectedMarkup as e:
+            print(f"Assertion error: {e}")
+            return 'failed', []
+        return 'changed', self.store.update_page(kvk, url, digest, postings)
+
+    def scrape_company(self, company: Company, max_pages: Optional[int] = None) -> Tuple[Counter, List[Change]]:
+        """
+        Scrape the careers pages of a company one after the other, shortest URL first.
+        :param max_pages: Maximum number of careers pages per company, None for all.
+        :return: (number of pages per result, the changes)
+        """
+        results: Counter = Counter()
+        changes: List[Change] = []
+        extractor = LinkExtractor(self.parser)
+        metrics = get_metrics()
+        pages = sorted(company.careers_page or [], key=lambda url: (len(url), url))
+        for url in pages[:max_pages]:
+            result, page_changes = self.scrape_page(company.kvk, url, extractor)
+            results[result] += 1
+            changes.extend(page_changes)
+            metrics.counter('postings_pages_total', 'Careers pages checked for postings').inc(result=result)
+        for change in changes:
+            metrics.counter('postings_changes_total', 'Postings added and removed').inc(kind=change.kind)
+        return results, changes
+
+
+def change_record(change: Change, company_name: str) -> dict:
+    """A change as one line of the delta file."""
+    return {'change': change.kind, 'kvk': change.kvk, 'company': company_name, 'page_url': change.page_url,
+            **change.posting._asdict()}
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from posting_store import DEFAULT_POSTINGS_PATH
+    from utils import iter_companies, with_careers_page
+
+    argparser = argparse.ArgumentParser(description="Extract job postings from the careers pages of all companies.")
+    argparser.add_argument("--store", default=DEFAULT_POSTINGS_PATH, help="Path of the postings store.")
+    argparser.add_argument("--delta", help="Write the postings added and removed in this run to this JSON lines file.")
+    argparser.add_argument("--force", action='store_true', help="Parse every careers page, also unchanged ones.")
+    argparser.add_argument("--concurrency", type=int, default=16, help="Number of companies scraped at once.")
+    argparser.add_argument("--max-pages", type=int, default=10, help="Maximum number of careers pages per company.")
+    argparser.add_argument("--parser", choices=PARSERS, help="HTML parser, defaults to lxml if installed.")
+    argparser.add_argument("--metrics", help="Write metrics to this file (.prom/.txt for Prometheus text, else JSON).")
+    args = argparser.parse_args()
+
+    metrics = get_metrics()
+    started = time.time()
+    totals: Counter = Counter()
+    delta = []
+    with PostingStore(args.store) as store, metrics.stage('postings'):
+        scraper = PostingScraper(store, force=args.force, parser=args.parser)
+        companies = list(iter_companies(where=with_careers_page, fields=('careers_page',)))
+        names = {company.kvk: company.name for company in companies}
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for results, changes in executor.map(lambda company: scraper.scrape_company(company, args.max_pages),
+                                                 companies):
+                totals.update(results)
+                for change in changes:
+                    sign = '+' if change.kind == ADDED else '-'
+                    print(f"{sign} {names[change.kvk]}: {change.posting.title}  {change.posting.url}")
+                    delta.append(change_record(change, names[change.kvk]))
+        print(store.summary())
+    added = sum(1 for record in delta if record['change'] == ADDED)
+    print(f"Checked {sum(totals.values())} careers pages of {len(companies)} companies in {time.time() - started:.1f}s: "
+          f"{totals['changed']} changed, {totals['unchanged']} unchanged, {totals['gone']} gone, "
+          f"{totals['failed']} failed; {added} postings added, {len(delta) - added} removed")
+    if args.delta:
+        with open(args.delta, 'w', encoding='utf-8') as f:
+            for record in delta:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    if args.metrics:
+        metrics.write(args.metrics)
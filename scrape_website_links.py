@@ -1,34 +1,216 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 import requests
-from bs4 import BeautifulSoup
-import json
-from urllib.parse import urljoin, urlparse
-from utils import load_companies
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+from utils import get_companies, iter_companies, with_website, without_careers_page
 from company import Company
 from bs4 import ParserRejectedMarkup
+from fetcher import HTML_CONTENT_TYPES, FetchAborted, Fetcher, get_fetcher
+from html_extract import PARSERS, LinkExtractor
+from metrics import ProgressLine, get_metrics
+from page_archive import DEFAULT_ARCHIVE_PATH, PageArchive
+from site_discovery import SiteHints, discover
+from url_utils import VisitedSet, canonical_host, canonicalize_url, url_fingerprint
+from link_classifier import (EMAIL, EXTERNAL, SKIP, PRIORITY_CAREER, PRIORITY_DEFAULT, LinkClassifier,
+                             ats_careers_vendor, get_classifier)
+import heapq
 import shutil
+import time
 size = shutil.get_terminal_size()
+
+# Days before a company whose crawl found no careers page is crawled again
+RECHECK_DAYS = 30
+# Pages larger than this are cut off before parsing, the links that matter are near the top
+MAX_PAGE_BYTES = 2 * 1024 * 1024
+
 class JobCrawler:
-    def __init__(self, company: Company):
+    def __init__(self, company: Company, max_pages: Optional[int] = 200, max_depth: Optional[int] = 5,
+                 time_budget: Optional[float] = 120.0, stop_on_career: bool = True,
+                 fetcher: Optional[Fetcher] = None, classifier: Optional[LinkClassifier] = None,
+                 parser: Optional[str] = None, checkpoint_interval: int = 25, use_sitemaps: bool = True,
+                 sitemap_seeds: int = 3, connect_timeout: float = 5.0, read_timeout: float = 15.0,
+                 max_bytes: Optional[int] = MAX_PAGE_BYTES, archive: Optional[PageArchive] = None):
+        """
+        :param company: The company whose website is crawled.
+        :param max_pages: Maximum number of pages fetched per crawl, None for no limit.
+        :param max_depth: Maximum link depth from the start page, None for no limit.
+        :param time_budget: Maximum wall-clock seconds per crawl, None for no limit. A fetch still reading
+                            when it runs out is aborted.
+        :param stop_on_career: Stop as soon as a careers page has been fetched.
+        :param fetcher: Fetch layer to use, defaults to the shared pooled Fetcher.
+        :param classifier: Link classifier to use, defaults to the shared LinkClassifier.
+        :param parser: BeautifulSoup parser for link extraction, defaults to lxml if installed.
+        :param checkpoint_interval: Pages between calls of on_checkpoint.
+        :param use_sitemaps: Read robots.txt and the sitemaps first, see site_discovery.discover.
+        :param sitemap_seeds: Number of careers page candidates from the sitemaps fetched before anything else.
+        :param connect_timeout: Seconds to wait for a connection.
+        :param read_timeout: Seconds to wait for the server between received bytes.
+        :param max_bytes: Maximum bytes of a page read and parsed, None for no limit.
+        :param archive: Archive to save the fetched pages to, for re-extraction without a re-crawl.
+        """
         self.company = company
         self.base_url = company.website
-        self.visited = set()
+        self.visited = VisitedSet()
         self.career_links = set()
         self.emails = set()
         self.external_links = set()
-    def normalize_url(self, url):
-            """Normalize the URL for comparison."""
-            parsed_url = urlparse(url)
-            # Remove www. from the domain
-            domain = parsed_url.netloc.replace('www.', '')
-            # Remove trailing slash
-            domain = domain.rstrip('/')
-            return f"{parsed_url.scheme}://{domain}"
+        self.pages_fetched = 0
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.time_budget = time_budget
+        self.stop_on_career = stop_on_career
+        self.fetcher = fetcher or get_fetcher()
+        self.classifier = classifier or get_classifier()
+        self.extractor = LinkExtractor(parser)
+        self.base_host = canonical_host(self.base_url) if self.base_url else ''
+        self.confirmed_career_page: Optional[str] = None
+        # Heap of (priority, depth, sequence, url)
+        self.frontier: List[Tuple[int, int, int, str]] = []
+        # Fingerprints of the URLs in the frontier
+        self._queued = set()
+        self._sequence = 0
+        # Called with the crawler and the crawl's start time every checkpoint_interval pages and when the
+        # crawl is stopped, see state()
+        self.on_checkpoint: Optional[Callable[[JobCrawler, float], None]] = None
+        self.checkpoint_interval = checkpoint_interval
+        self._checkpointed_pages = 0
+        # Set from another thread to make the crawl checkpoint and return after the current page
+        self.stop_requested = False
+        # Seconds spent and pages fetched before the crawl was resumed from a checkpoint; the pages are
+        # included in pages_fetched, which the page budget applies to
+        self.resumed_seconds = 0.0
+        self.resumed_pages = 0
+        self.use_sitemaps = use_sitemaps
+        self.sitemap_seeds = sitemap_seeds
+        # robots.txt and sitemap findings, set when the crawl starts
+        self.hints: Optional[SiteHints] = None
+        # Careers page candidates from the sitemaps, recorded as career links once they load
+        self.sitemap_candidates = set()
+        self._last_fetch = 0.0
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_bytes = max_bytes
+        # time.monotonic() at which the time budget runs out, set when the crawl starts
+        self.deadline: Optional[float] = None
+        # Fetches cut short, by reason: 'timeout', 'deadline', 'content_type' or 'max_bytes'
+        self.aborted: Dict[str, int] = dict()
+        self.archive = archive
 
-    def crawl(self, url: str):
-        if url in self.visited:
+    def enqueue(self, url: str, depth: int, priority: int = PRIORITY_DEFAULT):
+        """Add a URL to the frontier unless it was already visited, queued or is too deep."""
+        fingerprint = url_fingerprint(url)
+        if fingerprint in self.visited or fingerprint in self._queued:
+            return
+        if self.max_depth is not None and depth > self.max_depth:
+            return
+        if self.hints is not None and not self.hints.allowed(url):
             return
+        self._queued.add(fingerprint)
+        self._sequence += 1
+        heapq.heappush(self.frontier, (priority, depth, self._sequence, url))
+
+    def state(self, started: Optional[float] = None) -> dict:
+        """Snapshot of the crawl, enough to resume it with restore()."""
+        elapsed = self.resumed_seconds + (time.monotonic() - started if started is not None else 0.0)
+        return {
+            'base_url': self.base_url,
+            'frontier': [[priority, depth, url] for priority, depth, _, url in sorted(self.frontier)],
+            'visited': self.visited.to_string(),
+            'career_links': list(self.career_links),
+            'emails': list(self.emails),
+            'external_links': list(self.external_links),
+            'pages_fetched': self.pages_fetched,
+            'seconds': elapsed,
+        }
+
+    def restore(self, state: dict) -> bool:
+        """
+        Continue from a state() snapshot.
+        :return: False if the snapshot belongs to another website and was ignored.
+        """
+        if state.get('base_url') != self.base_url:
+            return False
+        self.visited = VisitedSet.from_string(state['visited'])
+        self.career_links = set(state['career_links'])
+        self.emails = set(state['emails'])
+        self.external_links = set(state['external_links'])
+        self.pages_fetched = self._checkpointed_pages = self.resumed_pages = state['pages_fetched']
+        self.resumed_seconds = state['seconds']
+        self.frontier, self._queued = [], set()
+        for priority, depth, url in state['frontier']:
+            self.enqueue(url, depth, priority)
+        return True
+
+    def stop(self):
+        self.stop_requested = True
+
+    def seed_from_sitemaps(self, url: str):
+        """Read robots.txt and the sitemaps, and queue the best careers page candidates ahead of url."""
+        self.hints = discover(url, self.fetcher, self.classifier)
+        # The Crawl-delay also applies between the last sitemap and the first page
+        self._last_fetch = time.monotonic()
+        for career_url in self.hints.career_urls[:self.sitemap_seeds]:
+            self.sitemap_candidates.add(career_url)
+            self.enqueue(career_url, 1, PRIORITY_CAREER)
+
+    def wait_for_crawl_delay(self):
+        """Sleep until the Crawl-delay from robots.txt has passed since the previous fetch."""
+        delay = self.hints.crawl_delay if self.hints else None
+        if delay:
+            remaining = self._last_fetch + delay - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+        self._last_fetch = time.monotonic()
+
+    def budget_exhausted(self, started: float) -> bool:
+        if self.max_pages is not None and self.pages_fetched >= self.max_pages:
+            print(f"Page budget of {self.max_pages} reached for {self.company.name}".ljust(size.columns))
+            return True
+        if self.time_budget is not None and self.resumed_seconds + time.monotonic() - started >= self.time_budget:
+            print(f"Time budget of {self.time_budget:.0f}s reached for {self.company.name}".ljust(size.columns))
+            return True
+        return False
+
+    def crawl(self, url: str):
+        """
+        Crawl the website best-first from url, fetching career-like links before anything else.
+        Stops when the frontier is empty, the page or time budget is spent, or a careers page is confirmed.
+        After stop() it saves a checkpoint and returns with the rest of the frontier intact.
+        """
+        started = time.monotonic()
+        if self.time_budget is not None:
+            self.deadline = started + self.time_budget - self.resumed_seconds
+        if self.use_sitemaps:
+            self.seed_from_sitemaps(url)
+        self.enqueue(url, 0, PRIORITY_DEFAULT)
+        while self.frontier:
+            if self.stop_requested or self.budget_exhausted(started):
+                break
+            priority, depth, _, url = heapq.heappop(self.frontier)
+            fingerprint = url_fingerprint(url)
+            self._queued.discard(fingerprint)
+            if fingerprint in self.visited:
+                continue
+            self.wait_for_crawl_delay()
+            fetched = self.crawl_page(url, depth)
+            if fetched and url in self.sitemap_candidates:
+                print(f"Found career link in sitemap: {url}".ljust(size.columns))
+                self.career_links.add(canonicalize_url(url))
+            if fetched and priority == PRIORITY_CAREER and not self.confirmed_career_page:
+                self.confirmed_career_page = url
+            if self.stop_on_career and self.confirmed_career_page:
+                break
+            if self.on_checkpoint and self.pages_fetched - self._checkpointed_pages >= self.checkpoint_interval:
+                self._checkpointed_pages = self.pages_fetched
+                self.on_checkpoint(self, started)
+        if self.stop_requested and self.on_checkpoint:
+            self.on_checkpoint(self, started)
+
+    def crawl_page(self, url: str, depth: int) -> bool:
+        """
+        Fetch a single page, record what it links to and add same-site links to the frontier.
+        :return: True if the page was fetched successfully.
+        """
         self.visited.add(url)
         # print(f"\033[AVisiting: {url}".ljust(size.columns))
         
@@ -36,95 +218,82 @@ class JobCrawler:
         # print(f"\033[A")
 
         try:
-            response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'})  # Use a common user agent
+            # Streamed, so a non-HTML response is dropped before its body is downloaded. A page loaded
+            # is archived by the fetcher, which then keeps no second copy for revalidation
+            response = self.fetcher.get(url, timeout=self.timeout, max_bytes=self.max_bytes,
+                                        content_types=HTML_CONTENT_TYPES, deadline=self.deadline,
+                                        archive=self.archive, site=self.base_host)
+            self.pages_fetched += 1
+            if response.truncated:
+                self.count_aborted('max_bytes')
+            get_metrics().counter('pages_fetched_total', 'Pages fetched by the crawler').inc()
             if response.status_code != 200:
                 print(f"Failed to access: {url}".ljust(size.columns), response)
-                return
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            # Search for links
-            links = soup.find_all('a', href=True)
-
-            # Normalize the base URL for comparison
-            normalized_base_url = self.normalize_url(self.base_url)
-            
-
-            for link in links:
-                href = link['href']
-                if href in self.visited:
-                    continue
-                # Skip files
-                if href.endswith('.pdf') or href.endswith('.jpg') or href.endswith('.png') or href.endswith('.jpeg') \
-                    or href.endswith('.gif') or href.endswith('.svg') or href.endswith('.webp') or href.endswith('.bmp') \
-                    or href.endswith('.tiff') or href.endswith('.ico') or href.endswith('.mp4') or href.endswith('.avi') \
-                    or href.endswith('.mov') or href.endswith('.mp3') or href.endswith('.wav') or href.endswith('.flac') \
-                    or href.endswith('.ogg') or href.endswith('.doc') or href.endswith('.docx') or href.endswith('.xls') \
-                    or href.endswith('.xlsx') or href.endswith('.ppt') or href.endswith('.pptx') or href.endswith('.odt') \
-                    or href.endswith('.ods') or href.endswith('.odp') or href.endswith('.zip') or href.endswith('.rar') \
-                    or href.endswith('.tar') or href.endswith('.gz') or href.endswith('.bz2') or href.endswith('.7z') \
-                    or href.endswith('.dmg') or href.endswith('.exe') or href.endswith('.msi') or href.endswith('.apk') \
-                    or href.endswith('.iso') or href.endswith('.img') or href.endswith('.csv') or href.endswith('.json') \
-                    or href.endswith('.xml') or href.endswith('.sql') or href.endswith('.db') or href.endswith('.dbf'):
-                    continue
-                if href.startswith('javascript:') or href.startswith('#'):
-                    continue
-                if href.startswith('mailto:'):
-                    # TODO: Handle email links, we can extract the email address for the company
-                    if href.replace('mailto:', '') not in self.emails:
-                        print(f"Found email: {href}".ljust(size.columns))
-                        self.emails.add(href.replace('mailto:', ''))
-                    continue
-                if 'news' in href or 'blog' in href:
-                    continue
-                
-                keywords = ['career', 'werken bij', 
-                            'vacature', 'contact', 
-                            'contact us', 'contact form', 
-                            'sollicitatie', 'solliciteren',
-                            'job',
-                            'jobs', 'baan']
-                # TODO: sometimes career links will be on a different website, see https://huhtamaki.wd3.myworkdayjobs.com/External (ID 01051894)
-                #       Check for career-related keywords in the URL earlier?
-                
-                full_url = urljoin(url, href)  # Create full URL from base and link
-                # Check for career-related keywords in link text or href
-                if any(keyword in link.text.lower() for keyword in keywords) or \
-                   any(keyword in href.lower() for keyword in keywords):
-                    if full_url not in self.career_links:
-                        print(f"Found career link: {full_url}".ljust(size.columns))
-                        self.career_links.add(full_url)
-                
-
-                # Normalize full URL for comparison
-                normalized_full_url = self.normalize_url(full_url)
-                
-                # Check if the full URL is part of the base URL
-                if normalized_base_url != normalized_full_url:
-                    self.external_links.add(href)
-                    continue
-                
-                # Recur for new links
-                self.crawl(full_url)
+                return False
+            self.extract(url, response.text, depth)
+            return True
         except ParserRejectedMarkup as e:
             print(f"Assertion error: {e}")
+        except FetchAborted as e:
+            self.count_aborted(e.reason)
+            if e.reason != 'content_type':
+                print(f"Request aborted: {e}")
+        except requests.exceptions.Timeout as e:
+            self.count_aborted('timeout')
+            print(f"Request timed out: {e}")
         except requests.exceptions.RequestException as e:
             print(f"Request failed: {e}")
+        return False
+
+    def extract(self, url: str, html: str, depth: int):
+        """
+        Record the career links, emails and external links on a page and add same-site links to the frontier.
+        Also used by reextract.py on archived pages.
+        """
+        # Search for links, parsing nothing but the anchors
+        for href, text in self.extractor.links(html):
+            verdict = self.classifier.classify(href, text, url, self.base_host)
+            if verdict.kind == SKIP:
+                continue
+            if verdict.kind == EMAIL:
+                if verdict.url not in self.emails:
+                    print(f"Found email: {href}".ljust(size.columns))
+                    self.emails.add(verdict.url)
+                continue
+            if verdict.url in self.visited:
+                continue
+
+            # Careers pages on another site are recognised by their ATS host, e.g.
+            # https://huhtamaki.wd3.myworkdayjobs.com/External (ID 01051894)
+            if verdict.priority != PRIORITY_DEFAULT:
+                career_url = canonicalize_url(verdict.url)
+                if career_url not in self.career_links:
+                    print(f"Found career link: {career_url}".ljust(size.columns))
+                    self.career_links.add(career_url)
+
+            # Links to other sites are recorded but not followed
+            if verdict.kind == EXTERNAL:
+                self.external_links.add(href)
+                # A link into an applicant tracking system confirms the careers page without fetching it
+                if verdict.priority == PRIORITY_CAREER and not self.confirmed_career_page and \
+                        ats_careers_vendor(verdict.url):
+                    self.confirmed_career_page = canonicalize_url(verdict.url)
+                continue
+            
+            # Queue new links, best candidates first
+            self.enqueue(verdict.url, depth + 1, verdict.priority)
         
 
-    def get_contact_form(self):
-        # Logic to find a contact form if no career page is found
-        print("No careers page found. Trying to find a contact form...")
+    def count_aborted(self, reason: str):
+        self.aborted[reason] = self.aborted.get(reason, 0) + 1
 
     def output(self):
         print(f"External Links for {self.company.name}:")
         for link in self.external_links:
             print(link)
         
-        # Print visited links
-        print(f"Visited Links for {self.company.name}:")
-        for link in self.visited:
-            print(link)
+        # Visited links are only kept as fingerprints
+        print(f"Visited {len(self.visited)} pages for {self.company.name}")
         
         print(f"Career Links for {self.company.name}:")
         for link in self.career_links:
@@ -135,55 +304,148 @@ class JobCrawler:
             print(email)
         
 
-import time
-import argparse
-argparser = argparse.ArgumentParser()
-argparser.add_argument("--force", action='store_true', help="Force re-crawling of all companies.")
-args = argparser.parse_args()
+
+def needs_crawl(company: Company, force: bool = False, recheck_days: float = RECHECK_DAYS) -> bool:
+    """
+    Whether a company should be (re-)crawled in this run.
+    :param recheck_days: Days before a crawl that found no careers page is repeated.
+    """
+    if not company.website:
+        return False
+    if force:
+        return True
+    if company.careers_page:
+        print(f"Skipping {company.name}, already found careers page.")
+        return False
+    if company.crawled_at and datetime.fromisoformat(company.crawled_at) > datetime.now() - timedelta(days=recheck_days):
+        print(f"Skipping {company.name}, no careers page found on {company.crawled_at[:10]}.")
+        return False
+    return True
+
+
+def prepare_crawler(company: Company, force: bool = False, **budget) -> JobCrawler:
+    """
+    Create a crawler for a company, seeded with previously stored results unless forced.
+    :param budget: Keyword arguments passed on to JobCrawler, e.g. max_pages, max_depth, time_budget.
+    """
+    crawler = JobCrawler(company, **budget)
+    # load external_links, emails from company if available; visited is not seeded, a re-check starts
+    # from the top and an interrupted crawl continues from its checkpoint instead
+    if not force:
+        if company.external_links:
+            crawler.external_links = company.external_links
+        if company.emails:
+            crawler.emails = company.emails
+    return crawler
+
+
+def store_crawl_results(company: Company, crawler: JobCrawler) -> bool:
+    """
+    Copy the crawl results onto the company and save it, also when no careers page was found:
+    crawled_at then keeps the company from being crawled again for RECHECK_DAYS.
+    :return: True if a careers page was found.
+    """
+    if crawler.career_links:
+        company.careers_page = list(crawler.career_links)
+    company.visited = crawler.visited
+    # Copies, the same crawl may be stored for several companies sharing a website
+    company.external_links = set(crawler.external_links)
+    company.emails = set(crawler.emails)
+    company.crawled_at = datetime.now().isoformat(timespec='seconds')
+    company.save()
+    return bool(crawler.career_links)
+
 
 if __name__ == "__main__":
+    import argparse
+    import contextlib
+    import sys
+    from crawl_engine import CrawlEngine
+    from crawl_journal import DEFAULT_JOURNAL_PATH, CrawlJournal
+    from work_queue import WorkQueue, leases
+
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--force", action='store_true', help="Force re-crawling of all companies.")
+    argparser.add_argument("--concurrency", type=int, default=16, help="Maximum number of companies crawled at once.")
+    argparser.add_argument("--per-host", type=int, default=1, help="Maximum number of concurrent crawls against one host.")
+    argparser.add_argument("--max-pages", type=int, default=200, help="Maximum number of pages fetched per site.")
+    argparser.add_argument("--max-depth", type=int, default=5, help="Maximum link depth followed from the start page.")
+    argparser.add_argument("--time-budget", type=float, default=120.0, help="Maximum seconds spent crawling one site.")
+    argparser.add_argument("--max-bytes", type=int, default=MAX_PAGE_BYTES,
+                           help="Maximum bytes of a page read, larger pages are cut off.")
+    argparser.add_argument("--connect-timeout", type=float, default=5.0, help="Seconds to wait for a connection.")
+    argparser.add_argument("--read-timeout", type=float, default=15.0,
+                           help="Seconds to wait for the server between received bytes.")
+    argparser.add_argument("--full", action='store_true', help="Keep crawling after a careers page is confirmed.")
+    argparser.add_argument("--no-dedup", action='store_true',
+                           help="Crawl a website again for every company that shares it.")
+    argparser.add_argument("--no-sitemaps", action='store_true',
+                           help="Do not read robots.txt and sitemaps for careers pages and the crawl delay.")
+    argparser.add_argument("--recheck-days", type=float, default=RECHECK_DAYS,
+                           help="Days before a site where no careers page was found is crawled again.")
+    argparser.add_argument("--journal", default=DEFAULT_JOURNAL_PATH,
+                           help="Run journal and checkpoints, used to resume an interrupted run.")
+    argparser.add_argument("--no-journal", action='store_true', help="Do not journal or checkpoint this run.")
+    argparser.add_argument("--archive", default=DEFAULT_ARCHIVE_PATH,
+                           help="Save fetched pages to this page archive, see reextract.py.")
+    argparser.add_argument("--no-archive", action='store_true', help="Do not archive the fetched pages.")
+    argparser.add_argument("--queue", help="Claim companies in batches from this shared work queue "
+                                           "(see work_queue.py) instead of crawling all of them.")
+    argparser.add_argument("--batch-size", type=int, default=50, help="Companies claimed from the queue at a time.")
+    argparser.add_argument("--metrics", help="Write metrics to this file (.prom/.txt for Prometheus text, else JSON).")
+    argparser.add_argument("--progress", action='store_true', help="Show a live progress line instead of periodic reports.")
+    argparser.add_argument("--parser", choices=PARSERS, help="HTML parser, defaults to lxml if installed.")
+    args = argparser.parse_args()
+
     force = args.force
     if force:
         print("\033[91mForcing re-crawling of all companies!!!\033[0m")
         time.sleep(3)
-    companies = load_companies()
-    career_links = dict()
-
-    for company in companies:
-        if not company.website:
-            continue
-        if company.careers_page and not force:
-            print(f"Skipping {company.name}, already found careers page.")
-            continue
-        print(f"Crawling for company: {company.name}")
-        crawler = JobCrawler(company)
-        
-        
-        
-        # load visited, external_links, emails from company if available
-        if not force:
-            if company.visited:
-                crawler.visited = company.visited
-            if company.external_links:
-                crawler.external_links = company.external_links
-            if company.emails:
-                crawler.emails = company.emails
-            if company.careers_page:
-                crawler.career_links = company.careers_page
-                continue
+    # Stream only the companies that still need crawling; the stored link lists are only needed to seed
+    # a non-forced crawl
+    where = [with_website] if force else [with_website, without_careers_page]
+    fields = ('website', 'careers_page') if force else None
 
-        crawler.crawl(company.website)
-        # result = crawler.output()
-        # print(result)
-        if len(crawler.career_links) > 0:
-            career_links[company.name] = crawler.career_links
-            company.careers_page = list(crawler.career_links)
-            company.visited = crawler.visited
-            company.external_links = crawler.external_links
-            company.emails = crawler.emails
-            
-            company.save_to_json()
+    budget = dict(max_pages=args.max_pages, max_depth=args.max_depth, time_budget=args.time_budget,
+                  stop_on_career=not args.full, parser=args.parser, use_sitemaps=not args.no_sitemaps,
+                  max_bytes=args.max_bytes, connect_timeout=args.connect_timeout, read_timeout=args.read_timeout)
+    journal = None if args.no_journal else CrawlJournal(args.journal)
+    archive = None if args.no_archive else PageArchive(args.archive)
+    budget['archive'] = archive
+
+    def make_engine() -> CrawlEngine:
+        return CrawlEngine(concurrency=args.concurrency, per_host=args.per_host, force=force, budget=budget,
+                           report_interval=0 if args.progress else 5.0, journal=journal, dedup=not args.no_dedup)
+
+    metrics = get_metrics()
+    try:
+        with metrics.stage('crawl'), (ProgressLine(metrics) if args.progress else contextlib.nullcontext()):
+            if args.queue:
+                # Other workers may share the queue; each batch is leased until it is done
+                queue = WorkQueue(args.queue, 'crawl')
+                career_links = dict()
+                for lease in leases(queue, args.batch_size):
+                    with lease:
+                        kvks = set(lease.pending)
+                        companies = [company for company in get_companies(sorted(kvks), fields=fields)
+                                     if needs_crawl(company, force, args.recheck_days)]
+                        engine = make_engine()
+                        career_links.update(engine.run(companies))
+                        # Crawls that failed go back to the queue when the lease is released
+                        lease.complete(kvks - {company.kvk for company in companies} | engine.completed)
+                print(queue.summary())
+            else:
+                companies = [company for company in iter_companies(where=where, fields=fields)
+                             if needs_crawl(company, force, args.recheck_days)]
+                career_links = make_engine().run(companies)
+    except KeyboardInterrupt:
+        print("Interrupted, run again to continue where this run stopped." if journal else "Interrupted.")
+        sys.exit(130)
     print(f"Found {len(career_links)} career links in total.")
     print(career_links)
-    
-# TODO: some issues with trailing / in URLs, e.g. https://www.ing.com/ vs https://www.ing.com
\ No newline at end of file
+    print(get_fetcher().summary())
+    if archive:
+        print(archive.summary())
+        archive.close()
+    if args.metrics:
+        metrics.write(args.metrics)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import time
+import zlib
+from typing import Iterable, List, NamedTuple, Optional, Set
+from urllib.parse import urljoin, urlparse
+from urllib.robotparser import RobotFileParser
+from xml.etree import ElementTree
+
+import requests
+
+from fetcher import CHUNK_SIZE, DEFAULT_HEADERS, Fetcher, get_fetcher
+from link_classifier import PRIORITY_CAREER, LinkClassifier, get_classifier
+from metrics import get_metrics
+from url_utils import canonical_host
+
+# Sitemaps may be 50 MB uncompressed, see sitemaps.org; anything larger is cut off
+MAX_SITEMAP_BYTES = 50 * 1024 * 1024
+# Crawl-delay values above this are capped, the per-site time budget still applies
+MAX_CRAWL_DELAY = 10.0
+FETCH_TIMEOUT = 10
+# Google reads at most 500 KiB of a robots.txt
+MAX_ROBOTS_BYTES = 500 * 1024
+
+
+class SiteHints(NamedTuple):
+    """What robots.txt and the sitemaps say about a site."""
+    # Candidate careers pages from the sitemaps, best first
+    career_urls: List[str]
+    # Seconds to wait between requests, None if robots.txt sets no Crawl-delay
+    crawl_delay: Optional[float]
+    robots: Optional[RobotFileParser]
+    # Number of page URLs read from the sitemaps
+    sitemap_urls: int
+    # Number of requests spent on robots.txt and sitemaps
+    requests: int
+
+    def allowed(self, url: str) -> bool:
+        """Whether robots.txt allows fetching url."""
+        return self.robots is None or self.robots.can_fetch(DEFAULT_HEADERS['User-Agent'], url)
+
+
+def _local_name(tag: str) -> str:
+    # Strip the XML namespace, sitemaps appear with and without one
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_sitemap_stream(chunks: Iterable[bytes], max_urls: Optional[int] = None) -> tuple:
+    """
+    Parse a sitemap or sitemap index chunk by chunk, so neither the body nor the document is held in memory.
+    Stops after MAX_SITEMAP_BYTES of (gunzipped) XML or max_urls URLs; the caller closes the stream.
+    :param chunks: The body, optionally gzipped.
+    :return: (page URLs, child sitemap URLs)
+    """
+    pages, sitemaps = [], []
+    target = pages
+    parser = ElementTree.XMLPullParser(events=('start', 'end'))
+    decompressor = None
+    size = 0
+    try:
+        for chunk in chunks:
+            if decompressor is None:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if chunk[:2] == b'\x1f\x8b' else False
+            if decompressor:
+                chunk = decompressor.decompress(chunk, MAX_SITEMAP_BYTES - size)
+            chunk = chunk[:MAX_SITEMAP_BYTES - size]
+            size += len(chunk)
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if event == 'start':
+                    if _local_name(element.tag) == 'sitemapindex':
+                        target = sitemaps
+                    continue
+                if _local_name(element.tag) == 'loc' and element.text:
+                    target.append(element.text.strip())
+                elif _local_name(element.tag) in ('url', 'sitemap'):
+                    element.clear()
+            if size >= MAX_SITEMAP_BYTES or (max_urls is not None and len(pages) >= max_urls):
+                break
+    except (ElementTree.ParseError, zlib.error):
+        # Truncated or not XML at all, keep what was read
+        pass
+    return pages, sitemaps
+
+
+def parse_sitemap(content: bytes) -> tuple:
+    """
+    :param content: A sitemap or sitemap index, optionally gzipped.
+    :return: (page URLs, child sitemap URLs)
+    """
+    return parse_sitemap_stream([content])
+
+
+def rank_career_urls(urls: List[str], base_host: str, classifier: LinkClassifier) -> List[str]:
+    """
+    Keep the URLs on the site whose path matches a career keyword, shortest path first:
+    the vacancies overview (/werken-bij) beats the individual postings below it.
+    """
+    candidates: Set[str] = set()
+    for url in urls:
+        parsed = urlparse(url)
+        try:
+            if canonical_host(url) != base_host:
+                continue
+        except ValueError:
+            # Unparseable port or IPv6 literal
+            continue
+        if classifier.priority(parsed.path, '') == PRIORITY_CAREER:
+            candidates.add(url)
+    return sorted(candidates, key=lambda url: (urlparse(url).path.rstrip('/').count('/'), len(url), url))
+
+
+def discover(base_url: str, fetcher: Optional[Fetcher] = None, classifier: Optional[LinkClassifier] = None,
+             max_sitemaps: int = 10, max_urls: int = 50000) -> SiteHints:
+    """
+    Read robots.txt and the sitemaps it lists (or /sitemap.xml) for careers pages and the crawl delay.
+    Sitemap indexes are followed breadth-first, child sitemaps with a career keyword in their URL first.
+    The sitemaps are fetched no faster than the Crawl-delay of robots.txt allows.
+    :param max_sitemaps: Maximum number of sitemap files fetched.
+    :param max_urls: Maximum number of page URLs read from the sitemaps.
+    """
+    fetcher = fetcher or get_fetcher()
+    classifier = classifier or get_classifier()
+    requests_made = 0
+    metrics = get_metrics()
+    discovery_requests = metrics.counter('discovery_requests_total', 'robots.txt and sitemap requests')
+    root = urljoin(base_url, '/')
+
+    robots = None
+    crawl_delay = None
+    sitemaps: List[str] = []
+    try:
+        requests_made += 1
+        discovery_requests.inc(kind='robots')
+        response = fetcher.get(urljoin(root, '/robots.txt'), timeout=FETCH_TIMEOUT, max_bytes=MAX_ROBOTS_BYTES)
+        if response.status_code == 200 and 'html' not in response.headers.get('Content-Type', ''):
+            robots = RobotFileParser()
+            robots.parse(response.text.splitlines())
+            delay = robots.crawl_delay(DEFAULT_HEADERS['User-Agent'])
+            crawl_delay = min(float(delay), MAX_CRAWL_DELAY) if delay is not None else None
+            sitemaps = list(robots.site_maps() or [])
+    except requests.RequestException:
+        pass
+    if not sitemaps:
+        sitemaps = [urljoin(root, '/sitemap.xml')]
+    last_fetch = time.monotonic()
+
+    pages: List[str] = []
+    seen = set()
+    fetched = 0
+    while sitemaps and fetched < max_sitemaps and len(pages) < max_urls:
+        sitemap_url = sitemaps.pop(0)
+        if sitemap_url in seen:
+            continue
+        seen.add(sitemap_url)
+        fetched += 1
+        if crawl_delay:
+            time.sleep(max(0.0, last_fetch + crawl_delay - time.monotonic()))
+        try:
+            requests_made += 1
+            discovery_requests.inc(kind='sitemap')
+            # Streamed and parsed as it arrives, reading stops once max_urls are in
+            with fetcher.session(sitemap_url).get(sitemap_url, timeout=FETCH_TIMEOUT, stream=True) as response:
+                if response.status_code != 200:
+                    continue
+                found_pages, children = parse_sitemap_stream(response.iter_content(CHUNK_SIZE),
+                                                             max_urls - len(pages))
+        except requests.RequestException:
+            continue
+        finally:
+            last_fetch = time.monotonic()
+        pages.extend(found_pages[:max_urls - len(pages)])
+        children.sort(key=lambda url: classifier.priority(urlparse(url).path, ''))
+        sitemaps.extend(children)
+
+    career_urls = rank_career_urls(pages, canonical_host(base_url), classifier)
+    if career_urls:
+        metrics.counter('sitemap_career_hits_total', 'Sites with a careers page in their sitemap').inc()
+    return SiteHints(career_urls, crawl_delay, robots, len(pages), requests_made)
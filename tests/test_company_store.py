@@ -0,0 +1,59 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from company import Company
+from company_store import CompanyStore
+
+
+def test_projected_record_saved_twice_keeps_list_fields(tmp_path):
+    store = CompanyStore(str(tmp_path / 'companies.sqlite'))
+    company = Company(name='Acme', kvk='12345678', website='https://acme.nl')
+    company.emails = {'info@acme.nl'}
+    company.external_links = {'https://linkedin.com/company/acme'}
+    company.visited = ['https://acme.nl', 'https://acme.nl/contact']
+    store.upsert(company)
+
+    projected = next(store.iter(fields=('website',)))
+    projected.website = 'https://www.acme.nl'
+    projected.save()
+    projected.save()
+
+    stored = store.get('12345678')
+    assert stored.website == 'https://www.acme.nl'
+    assert stored.emails == {'info@acme.nl'}
+    assert stored.external_links == {'https://linkedin.com/company/acme'}
+    assert len(stored.visited) == 2
+    store.close()
+
+
+def test_companies_from_a_closed_store_can_still_be_saved(tmp_path):
+    from utils import get_companies, iter_companies
+
+    path = str(tmp_path / 'companies.sqlite')
+    with CompanyStore(path) as store:
+        store.upsert(Company(name='Acme', kvk='12345678', address='Damrak 1'))
+    companies = list(iter_companies(path, fields=('website',)))
+    assert companies[0].store.closed
+    companies[0].website = 'https://acme.nl'
+    companies[0].save()
+
+    company, = get_companies(['12345678', '00000000'], path, fields=('address',))
+    assert company.store.closed
+    assert company.unloaded == {'website', 'careers_page', 'sector', 'delisted', 'crawled_at', 'external_links',
+                                'emails', 'visited'}
+    with CompanyStore(path) as store:
+        stored = store.get('12345678')
+    assert (stored.website, stored.address) == ('https://acme.nl', 'Damrak 1')
+
+
+def test_iter_changed_since(tmp_path):
+    with CompanyStore(str(tmp_path / 'companies.sqlite')) as store:
+        store.upsert_many([Company(name='Acme', kvk='12345678'), Company(name='Beta', kvk='87654321')])
+        time.sleep(0.01)
+        since = time.time()
+        assert list(store.iter(changed_since=since)) == []
+        store.set_websites([('87654321', 'https://beta.nl')])
+        assert [company.kvk for company in store.iter(changed_since=since)] == ['87654321']
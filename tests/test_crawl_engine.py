@@ -0,0 +1,41 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from company import Company
+from crawl_engine import CrawlEngine
+from scrape_website_links import JobCrawler
+
+
+def test_resumed_pages_are_not_counted_again():
+    company = Company(name='Acme', kvk='00000001', website='https://acme.example/')
+    previous = JobCrawler(company, use_sitemaps=False)
+    previous.pages_fetched = 40
+    crawler = JobCrawler(company, use_sitemaps=False)
+    assert crawler.restore(previous.state())
+    engine = CrawlEngine()
+    engine.active.add(crawler)
+    crawler.pages_fetched += 3
+    assert engine.pages == 3
+    assert crawler.pages_fetched == 43
+
+
+def test_shared_crawl_counts_only_the_fetches_of_this_run():
+    companies = [Company(name=name, kvk=kvk, website='https://acme.example/')
+                 for name, kvk in (('Acme', '00000001'), ('Acme Holding', '00000002'))]
+    previous = JobCrawler(companies[0], use_sitemaps=False)
+    previous.pages_fetched = 40
+    crawler = JobCrawler(companies[0], use_sitemaps=False)
+    assert crawler.restore(previous.state())
+    crawler.pages_fetched += 3
+
+    async def crawl_company(company, global_limit, executor, seed=True):
+        return crawler
+
+    engine = CrawlEngine()
+    engine._crawl_company = crawl_company
+    engine._finish = lambda company, crawler: None
+    asyncio.run(engine._crawl_site(companies, None, None))
+    assert engine.fetches_saved == 3
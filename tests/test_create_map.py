@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geopy.exc import GeocoderUnavailable
+
+import create_map
+from company import Company
+from geocoding import BatchGeocoder, GeocodeCache, OfflineGeocoder, normalize_address
+
+
+class FlakyGeocoder(OfflineGeocoder):
+    def __init__(self):
+        super().__init__()
+        self.down = True
+
+    def geocode(self, query, **kwargs):
+        if self.down:
+            raise GeocoderUnavailable('down')
+        return super().geocode(query, **kwargs)
+
+
+def test_failed_geocode_is_retried(tmp_path, monkeypatch):
+    company = Company(name='Acme', kvk='00000001', address='Damrak 1, 1012LG Amsterdam')
+    monkeypatch.setattr(create_map, 'iter_companies', lambda **kwargs: iter([company]))
+    provider = FlakyGeocoder()
+    geocoder = BatchGeocoder(provider, GeocodeCache(str(tmp_path / 'cache.sqlite')), min_delay_seconds=0)
+    layer = str(tmp_path / 'companies.geojson')
+
+    assert create_map.build_layer(geocoder, layer) == []
+    provider.down = False
+    features = create_map.build_layer(geocoder, layer)
+    assert features[0]['geometry'] is not None
+    assert features[0]['properties']['digest'] == create_map.feature_digest(company)
+
+
+def test_address_not_found_is_retried_when_its_cached_miss_expires(tmp_path, monkeypatch):
+    company = Company(name='Acme', kvk='00000001', address='Damrak 1, 1012LG Amsterdam')
+    monkeypatch.setattr(create_map, 'iter_companies', lambda **kwargs: iter([company]))
+    provider = OfflineGeocoder(fallback=False)
+    calls = []
+    geocode = provider.geocode
+    monkeypatch.setattr(provider, 'geocode', lambda query, **kwargs: calls.append(query) or geocode(query))
+    cache = GeocodeCache(str(tmp_path / 'cache.sqlite'), negative_ttl=3600)
+    geocoder = BatchGeocoder(provider, cache, min_delay_seconds=0)
+    layer = str(tmp_path / 'companies.geojson')
+
+    feature, = create_map.build_layer(geocoder, layer)
+    assert feature['geometry'] is None
+    assert abs(feature['properties']['retry_at'] - (time.time() + 3600)) < 60
+    create_map.build_layer(geocoder, layer)
+    assert len(calls) == 1
+
+    provider.locations[normalize_address(company.address)] = (52.37, 4.89)
+    later = time.time() + 3601
+    monkeypatch.setattr(time, 'time', lambda: later)
+    feature, = create_map.build_layer(geocoder, layer)
+    assert len(calls) == 2
+    assert feature['geometry']['coordinates'] == [4.89, 52.37]
+    assert 'retry_at' not in feature['properties']
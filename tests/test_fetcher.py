@@ -0,0 +1,146 @@
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fetcher as fetcher_module
+from fetcher import HTML_CONTENT_TYPES, FetchAborted, Fetcher
+
+
+def test_least_recently_used_session_is_closed():
+    fetcher = Fetcher(cache_path=None, max_sessions=2)
+    first = fetcher.session('https://a.example/')
+    fetcher.session('https://b.example/')
+    assert fetcher.session('https://a.example/x') is first
+    closed = []
+    evicted = fetcher.session('https://b.example/')
+    evicted.close = lambda: closed.append('b')
+    fetcher.session('https://a.example/')
+    fetcher.session('https://c.example/')
+    assert closed == ['b']
+    assert fetcher.session('https://a.example/') is first
+    fetcher.close()
+
+
+class TrickleHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', '40')
+        self.end_headers()
+        try:
+            if self.path == '/trickle':
+                for _ in range(40):
+                    self.wfile.write(b'x')
+                    self.wfile.flush()
+                    time.sleep(0.1)
+            else:
+                self.wfile.write(b'x' * 40)
+        except OSError:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def site():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), TrickleHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_deadline_cuts_off_a_trickling_body(site):
+    fetcher = Fetcher(cache_path=None)
+    started = time.monotonic()
+    with pytest.raises(FetchAborted) as aborted:
+        fetcher.get(site + '/trickle', timeout=(1, 1), deadline=started + 0.5, content_types=HTML_CONTENT_TYPES)
+    assert aborted.value.reason == 'deadline'
+    assert time.monotonic() - started < 1.5
+
+
+def test_deadline_passing_after_the_body_was_read_is_ignored(site, monkeypatch):
+    cancel = fetcher_module._watchdog.cancel
+
+    def late_cancel(entry):
+        time.sleep(0.3)
+        cancel(entry)
+
+    monkeypatch.setattr(fetcher_module._watchdog, 'cancel', late_cancel)
+    response = Fetcher(cache_path=None).get(site + '/page', timeout=(1, 1), deadline=time.monotonic() + 0.2,
+                                            content_types=HTML_CONTENT_TYPES)
+    assert response.content == b'x' * 40
+
+
+class ETagHandler(BaseHTTPRequestHandler):
+    body = b'<html><a href="/vacatures">Vacatures</a></html>'
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('ETag', '"v1"')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def etag_site():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ETagHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_archived_page_is_revalidated_without_a_second_copy(etag_site, tmp_path):
+    from page_archive import PageArchive
+
+    url = etag_site + '/'
+    with PageArchive(str(tmp_path / 'archive')) as archive:
+        fetcher = Fetcher(cache_path=str(tmp_path / 'http_cache.sqlite'))
+        first = fetcher.get(url, archive=archive, site='example.nl')
+        assert not first.from_cache
+        assert fetcher.validators.get(url)[3:] == (None, url)
+        second = fetcher.get(url, archive=archive, site='example.nl')
+        assert second.from_cache
+        assert second.content == ETagHandler.body
+        assert archive.pages_written == 1
+        fetcher.close()
+
+
+def test_unchanged_page_is_served_from_the_validator_store(etag_site, tmp_path):
+    url = etag_site + '/'
+    cache_path = str(tmp_path / 'http_cache.sqlite')
+    fetcher = Fetcher(cache_path=cache_path)
+    first = fetcher.get(url)
+    assert not first.from_cache
+    assert (fetcher.hits, fetcher.misses, fetcher.bytes_saved) == (0, 1, 0)
+
+    # Validators persist: a new fetcher on the same store revalidates as well
+    for current in (fetcher, Fetcher(cache_path=cache_path)):
+        response = current.get(url)
+        assert response.from_cache
+        assert (response.status_code, response.content, response.text) == \
+            (200, ETagHandler.body, ETagHandler.body.decode('utf-8'))
+    assert (fetcher.hits, fetcher.misses, fetcher.bytes_saved) == (1, 1, len(ETagHandler.body))
+    assert fetcher.stats()['hits'] == 1
+
+    # Without revalidation the page is downloaded in full
+    assert not fetcher.get(url, revalidate=False).from_cache
+    assert fetcher.misses == 2
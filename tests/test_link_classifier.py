@@ -0,0 +1,48 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from link_classifier import (EMAIL, EXTERNAL, INTERNAL, PRIORITY_CAREER, PRIORITY_CONTACT, PRIORITY_DEFAULT, SKIP,
+                             LinkClassifier, LinkVerdict, ats_careers_vendor)
+
+PAGE = 'https://acme.nl/over-ons'
+
+
+def test_vendor_homepage_is_not_a_careers_page():
+    verdict = LinkClassifier().classify('https://www.greenhouse.io/', 'Powered by Greenhouse', PAGE, 'acme.nl')
+    assert verdict.kind == EXTERNAL
+    assert verdict.priority == PRIORITY_DEFAULT
+    for url in ('https://greenhouse.io/pricing', 'https://boards.greenhouse.io/', 'https://help.lever.co/hc',
+                'https://wd3.myworkdayjobs.com/', 'https://join.com/'):
+        assert ats_careers_vendor(url) is None, url
+
+
+def test_customer_pages_on_an_ats_are_careers_pages():
+    assert ats_careers_vendor('https://boards.greenhouse.io/acme') == 'Greenhouse'
+    assert ats_careers_vendor('https://huhtamaki.wd3.myworkdayjobs.com/External') == 'Workday'
+    assert ats_careers_vendor('https://acme.recruitee.com/') == 'Recruitee'
+    assert ats_careers_vendor('https://join.com/companies/acme') == 'JOIN'
+    verdict = LinkClassifier().classify('https://jobs.lever.co/acme', 'Open roles', PAGE, 'acme.nl')
+    assert verdict.priority == PRIORITY_CAREER
+
+
+def test_index_marks_only_customer_pages():
+    from link_index import ats_links
+    assert ats_links(['https://www.greenhouse.io/', 'https://boards.greenhouse.io/acme']) == \
+        ['https://boards.greenhouse.io/acme']
+
+
+def test_verdicts():
+    classifier = LinkClassifier()
+    assert classifier.classify('mailto:jobs@acme.nl', 'Mail ons', PAGE, 'acme.nl') == LinkVerdict(EMAIL, 'jobs@acme.nl')
+    for href in ('javascript:void(0)', '#top', '/brochure.PDF', '/nieuws/news-item', 'https://[::1:80/'):
+        assert classifier.classify(href, '', PAGE, 'acme.nl').kind == SKIP, href
+    assert classifier.classify('/werken-bij/', 'Werken bij', PAGE, 'acme.nl') == \
+        LinkVerdict(INTERNAL, 'https://acme.nl/werken-bij/', PRIORITY_CAREER)
+    assert classifier.classify('https://www.acme.nl/contact', 'Contact', PAGE, 'acme.nl') == \
+        LinkVerdict(INTERNAL, 'https://www.acme.nl/contact', PRIORITY_CONTACT)
+    assert classifier.classify('over-ons/team', 'Team', PAGE, 'acme.nl') == \
+        LinkVerdict(INTERNAL, 'https://acme.nl/over-ons/team', PRIORITY_DEFAULT)
+    assert classifier.classify('https://linkedin.com/company/acme', 'LinkedIn', PAGE, 'acme.nl') == \
+        LinkVerdict(EXTERNAL, 'https://linkedin.com/company/acme', PRIORITY_DEFAULT)
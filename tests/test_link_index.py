@@ -0,0 +1,37 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from company import Company
+from link_index import ExternalLinkIndex, build_index
+
+
+def save(directory, kvk, links, mtime=None):
+    path = str(directory / f'{kvk}.json')
+    Company(name=f'Company {kvk}', kvk=kvk, external_links=links, file_path=path).save_to_json()
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_build_reads_only_companies_saved_since_the_last_build(tmp_path):
+    companies = tmp_path / 'companies'
+    companies.mkdir()
+    save(companies, '11111111', ['https://acme.wd3.myworkdayjobs.com/External'])
+    save(companies, '22222222', ['https://jobs.lever.co/beta'])
+
+    with ExternalLinkIndex(str(tmp_path / 'index.sqlite')) as index:
+        assert build_index(index, str(companies), mark_careers=False) == (2, 0)
+        assert [kvk for kvk, _, _ in index.companies_for_vendor('WORKDAY')] == ['11111111']
+        assert index.vendors() == {'Workday': 1, 'Lever': 1}
+
+        # Changed, but with a modification time from before the build: not read again
+        save(companies, '22222222', ['https://acme.wd3.myworkdayjobs.com/External'], mtime=1)
+        assert build_index(index, str(companies), mark_careers=False) == (0, 0)
+        save(companies, '33333333', ['https://jobs.lever.co/gamma'])
+        assert build_index(index, str(companies), mark_careers=False) == (1, 0)
+        assert build_index(index, str(companies), mark_careers=False, full=True) == (1, 0)
+        assert [kvk for kvk, _, _ in index.companies_for_vendor('workday')] == ['11111111', '22222222']
+
+        plan = index.db.execute('EXPLAIN QUERY PLAN SELECT kvk FROM links WHERE vendor = ?', ('workday',)).fetchall()
+        assert 'idx_links_vendor' in str(plan)
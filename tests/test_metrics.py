@@ -0,0 +1,44 @@
+import os
+import sys
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Metrics, get_metrics
+
+
+def init_worker():
+    # As find_company_website.init_worker: forget what the parent recorded before the fork
+    get_metrics().drain()
+
+
+def fetch(status: int) -> dict:
+    metrics = get_metrics()
+    metrics.counter('fetch_requests_total').inc(status=status)
+    metrics.histogram('fetch_seconds').observe(0.2, host='acme.nl')
+    with metrics.gauge('fetch_in_flight').track():
+        pass
+    return metrics.drain()
+
+
+def test_metrics_recorded_in_pool_workers_reach_the_parent():
+    get_metrics().counter('fetch_requests_total').inc(status=200)
+    parent = Metrics()
+    with Pool(2, initializer=init_worker) as pool:
+        for worker_metrics in pool.imap_unordered(fetch, [200, 200, 404]):
+            parent.merge(worker_metrics)
+    requests = parent.counter('fetch_requests_total')
+    assert (requests.value(status=200), requests.value(status=404)) == (2, 1)
+    fetch_seconds = parent.histogram('fetch_seconds')
+    assert fetch_seconds.count(host='acme.nl') == 3
+    assert abs(fetch_seconds.sum(host='acme.nl') - 0.6) < 1e-9
+    assert fetch_seconds.quantile(0.5, host='acme.nl') == 0.25
+    assert 'fetch_in_flight' not in parent.to_dict()
+
+
+def test_drain_leaves_nothing_to_count_twice():
+    metrics = Metrics()
+    metrics.counter('pages_fetched_total').inc(3)
+    assert metrics.drain()['pages_fetched_total'][-1] == {(): 3}
+    assert metrics.counter('pages_fetched_total').total() == 0
+    assert 'pages_fetched_total' not in metrics.drain()
@@ -0,0 +1,21 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from posting_store import ADDED, JobPosting, PostingStore
+
+PAGE = 'https://acme.nl/vacatures'
+
+
+def test_companies_sharing_a_careers_page_keep_their_own_postings(tmp_path):
+    store = PostingStore(str(tmp_path / 'postings.sqlite'))
+    postings = [JobPosting('Monteur', 'https://acme.nl/vacatures/monteur')]
+    assert [change.kind for change in store.update_page('1', PAGE, 'hash', postings)] == [ADDED]
+    assert store.content_hash('2', PAGE) is None
+    assert [change.kind for change in store.update_page('2', PAGE, 'hash', postings)] == [ADDED]
+    # Running both again changes nothing
+    assert store.update_page('1', PAGE, 'hash', postings) == []
+    assert store.update_page('2', PAGE, 'hash', postings) == []
+    assert store.counts()['open'] == 2
+    store.close()
@@ -0,0 +1,28 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scrape_companies
+from company import Company
+
+
+def _known(tmp_path, count):
+    for i in range(count):
+        Company(name=f'Company {i}', kvk=f'{i:08d}', file_path=str(tmp_path / f'{i:08d}.json')).save_to_json()
+
+
+def test_truncated_register_delists_nobody(tmp_path, monkeypatch):
+    _known(tmp_path, 20)
+    monkeypatch.setattr(scrape_companies, 'stream_register', lambda url: iter([]))
+    report = scrape_companies.incremental_ingest(str(tmp_path))
+    assert report['delisted'] == []
+    assert all(not company.delisted for company in scrape_companies.iter_companies(str(tmp_path)))
+
+
+def test_missing_rows_are_delisted(tmp_path, monkeypatch):
+    _known(tmp_path, 20)
+    rows = [{'kvk': f'{i:08d}', 'name': f'Company {i}'} for i in range(19)]
+    monkeypatch.setattr(scrape_companies, 'stream_register', lambda url: iter(rows))
+    report = scrape_companies.incremental_ingest(str(tmp_path))
+    assert [entry['kvk'] for entry in report['delisted']] == ['00000019']
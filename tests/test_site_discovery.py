@@ -0,0 +1,81 @@
+import gzip
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fetcher import Fetcher
+from link_classifier import LinkClassifier
+from site_discovery import discover, parse_sitemap_stream, rank_career_urls
+
+
+def sitemap(urls):
+    return ('<?xml version="1.0"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">' +
+            ''.join(f'<url><loc>{url}</loc></url>' for url in urls) + '</urlset>').encode('utf-8')
+
+
+def test_rank_career_urls_skips_bad_ports():
+    urls = ['https://example.nl:99999/werken-bij', 'https://example.nl/werken-bij/monteur',
+            'https://www.example.nl/werken-bij', 'https://example.nl/over-ons', 'https://other.nl/vacatures']
+    assert rank_career_urls(urls, 'example.nl', LinkClassifier()) == \
+        ['https://www.example.nl/werken-bij', 'https://example.nl/werken-bij/monteur']
+
+
+def test_rank_career_urls_puts_the_overview_first():
+    urls = ['https://example.nl/vacatures/2024/monteur', 'https://example.nl/careers/', 'https://example.nl/jobs',
+            'https://example.nl/jobs', 'http://example.nl/vacatures/', 'https://example.nl/contact']
+    assert rank_career_urls(urls, 'example.nl', LinkClassifier()) == \
+        ['https://example.nl/jobs', 'https://example.nl/careers/', 'http://example.nl/vacatures/',
+         'https://example.nl/vacatures/2024/monteur']
+    assert rank_career_urls([], 'example.nl', LinkClassifier()) == []
+
+
+def test_gzipped_sitemap_is_parsed_in_chunks_up_to_max_urls():
+    body = gzip.compress(sitemap([f'https://example.nl/page-{i}' for i in range(1000)]))
+    chunks = [body[i:i + 100] for i in range(0, len(body), 100)]
+    read = []
+    pages, children = parse_sitemap_stream((read.append(chunk) or chunk for chunk in chunks), max_urls=10)
+    assert pages[:10] == [f'https://example.nl/page-{i}' for i in range(10)]
+    assert children == []
+    assert len(read) < len(chunks)
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    fetched = []
+
+    def do_GET(self):
+        self.fetched.append((self.path, time.monotonic()))
+        if self.path == '/robots.txt':
+            body = b'User-agent: *\nCrawl-delay: 1\n'
+        elif self.path == '/sitemap.xml':
+            body = sitemap([f'http://127.0.0.1:{self.server.server_address[1]}/vacatures'])
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain' if self.path == '/robots.txt' else 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_crawl_delay_applies_between_robots_and_sitemap():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SiteHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}/'
+    try:
+        hints = discover(base, Fetcher(cache_path=None), LinkClassifier())
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert hints.crawl_delay == 1.0
+    assert hints.career_urls == [base + 'vacatures']
+    (robots, robots_at), (_, sitemap_at) = SiteHandler.fetched
+    assert robots == '/robots.txt'
+    assert sitemap_at - robots_at >= 1.0
@@ -0,0 +1,33 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from url_utils import VisitedSet, canonical_host, canonicalize_url
+
+
+def test_canonicalize_url():
+    assert canonicalize_url('https://www.ING.com/') == 'https://ing.com'
+    assert canonicalize_url('https://ing.com#top') == 'https://ing.com'
+    assert canonicalize_url('HTTP://ing.com:80/vacatures/') == 'http://ing.com/vacatures'
+    assert canonicalize_url('https://ing.com:8443/') == 'https://ing.com:8443'
+    assert canonicalize_url('https://ing.com/jobs?utm_source=x&page=2&fbclid=y&b=1') == \
+        'https://ing.com/jobs?b=1&page=2'
+    assert canonical_host('https://www.Werken-bij.ING.com:443/x') == 'werken-bij.ing.com'
+
+
+def test_visited_set_dedups_scheme_and_www_variants():
+    visited = VisitedSet(bloom_bits=1024)
+    visited.add('https://www.acme.nl/vacatures/')
+    for variant in ('http://acme.nl/vacatures', 'https://acme.nl/vacatures#open', 'https://WWW.acme.nl/vacatures'):
+        assert variant in visited
+        visited.add(variant)
+    assert len(visited) == 1
+    assert 'https://acme.nl/contact' not in visited
+
+    # More URLs than the unsorted buffer holds, then a round trip through the stored form
+    visited.update(f'https://acme.nl/vacatures/{i}' for i in range(VisitedSet.BUFFER_SIZE * 2))
+    restored = VisitedSet.from_string(visited.to_string())
+    assert len(restored) == len(visited) == VisitedSet.BUFFER_SIZE * 2 + 1
+    assert 'http://www.acme.nl/vacatures/300/' in restored
+    assert 'https://acme.nl/vacatures/9999' not in restored
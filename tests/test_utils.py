@@ -0,0 +1,33 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from company import FIELDS, LIST_FIELDS, Company
+from utils import get_companies, iter_companies, parse_projected
+
+
+def test_save_to_json_writes_the_list_fields_last(tmp_path):
+    # parse_projected cuts records before the first list field
+    path = str(tmp_path / '12345678.json')
+    Company(name='Acme', kvk='12345678', emails=['info@acme.nl'], file_path=path).save_to_json()
+    with open(path, 'r', encoding='utf-8') as f:
+        keys = list(json.load(f))
+    assert keys == list(FIELDS)
+    assert keys[-len(LIST_FIELDS):] == list(LIST_FIELDS)
+
+
+def test_scalar_after_a_list_field_is_not_dropped(tmp_path):
+    record = {'name': 'Acme', 'kvk': '12345678', 'emails': ['info@acme.nl'], 'website': 'https://acme.nl',
+              'address': 'Damrak 1'}
+    text = json.dumps(record, indent=4)
+    assert parse_projected(text, ('name', 'kvk', 'website'))['website'] == 'https://acme.nl'
+
+    path = tmp_path / '12345678.json'
+    path.write_text(text, encoding='utf-8')
+    company = next(iter_companies(str(tmp_path), fields=('website',)))
+    assert company.website == 'https://acme.nl'
+    company.save()
+    company, = get_companies(['12345678'], str(tmp_path))
+    assert (company.website, company.address, company.emails) == ('https://acme.nl', 'Damrak 1', {'info@acme.nl'})
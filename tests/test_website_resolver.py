@@ -0,0 +1,51 @@
+import itertools
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import website_resolver
+from website_resolver import GoogleBackend, LocalHTTPBackend, StandinSearchHandler
+
+RESULT = '<html><body><a href="https://acme.example/">Acme</a></body></html>'
+
+
+class ScriptedFetcher:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+
+    def get(self, url, **kwargs):
+        return self.responses.pop(0)
+
+
+def response(status, text='', retry_after=None):
+    return SimpleNamespace(status_code=status, text=text,
+                           headers={'Retry-After': retry_after} if retry_after else {})
+
+
+def test_throttled_search_without_bucket_backs_off(monkeypatch):
+    fetcher = ScriptedFetcher(response(429), response(429), response(429, retry_after='7'), response(200, RESULT))
+    monkeypatch.setattr(website_resolver, 'get_fetcher', lambda: fetcher)
+    waits = []
+    monkeypatch.setattr(website_resolver.time, 'sleep', waits.append)
+    assert GoogleBackend(delay=1.0).resolve('Acme') == 'https://acme.example/'
+    assert waits == [1.0, 2.0, 7.0]
+
+
+def test_local_backend_backs_off_on_the_standin_server(monkeypatch):
+    handler = type('Handler', (StandinSearchHandler,), {'throttle_every': 1, 'requests': itertools.count(1)})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    waits = []
+    monkeypatch.setattr(website_resolver.time, 'sleep', waits.append)
+    try:
+        backend = LocalHTTPBackend(f'http://127.0.0.1:{server.server_address[1]}', retries=3)
+        assert backend.resolve('Acme B.V.') is None
+    finally:
+        server.shutdown()
+        server.server_close()
+    # Retry-After: 0 from the server, no wait after the last attempt
+    assert waits == [0.0, 0.0]
@@ -0,0 +1,20 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from work_queue import WorkQueue, leases
+
+
+def test_released_item_fails_after_max_attempts(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), 'crawl', max_attempts=3)
+    queue.enqueue(['00000001'])
+    claims = 0
+    for lease in leases(queue, batch_size=1):
+        with lease:
+            claims += 1
+            assert claims <= 3
+        # Left the block without completing, as a failed crawl does
+    assert claims == 3
+    assert queue.counts() == {'failed': 1}
+    queue.close()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import base64
+import hashlib
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator, Optional, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+# Query parameters that never change the page
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'mc_cid', 'mc_eid', '_ga')
+
+
+def canonical_host(url: str) -> str:
+    """Lowercase host of a URL without www. and without the default port."""
+    parts = urlsplit(url)
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    if parts.port and str(parts.port) != DEFAULT_PORTS.get(parts.scheme.lower()):
+        host = f"{host}:{parts.port}"
+    return host
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Canonical form of a URL, so that variants of the same page compare equal:
+    lowercase scheme and host, no www., no default port, no fragment, no trailing slash,
+    no tracking parameters and sorted query parameters.
+    e.g. https://www.ING.com/ and https://ing.com#top both become https://ing.com
+    """
+    parts = urlsplit(url.strip())
+    path = parts.path.rstrip('/')
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if not key.lower().startswith(TRACKING_PARAMS)]
+    return urlunsplit((parts.scheme.lower(), canonical_host(url), path, urlencode(sorted(query)), ''))
+
+
+def url_fingerprint(url: str) -> int:
+    """64-bit fingerprint of the canonical URL. http and https variants share a fingerprint."""
+    canonical = canonicalize_url(url).split('://', 1)[-1]
+    return int.from_bytes(hashlib.blake2b(canonical.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over 64-bit fingerprints."""
+
+    def __init__(self, bits: int = 1 << 16, hashes: int = 4):
+        self.size = bits
+        self.hashes = hashes
+        self.bits = bytearray((bits + 7) // 8)
+
+    def _positions(self, fingerprint: int) -> Iterator[int]:
+        # Double hashing on the two halves of the fingerprint
+        low, high = fingerprint & 0xFFFFFFFF, fingerprint >> 32
+        for i in range(self.hashes):
+            yield (low + i * high) % self.size
+
+    def add(self, fingerprint: int):
+        for position in self._positions(fingerprint):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, fingerprint: int) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(fingerprint))
+
+
+class VisitedSet:
+    """
+    Compact set of visited URLs, stored as 64-bit fingerprints of their canonical form.
+
+    Fingerprints live in a sorted array('Q') plus a small unsorted buffer that is merged in when it
+    grows, so a URL costs 8 bytes instead of a full string. An optional Bloom filter answers most
+    negative lookups without searching the array. Serialized as base64 of the packed array.
+    """
+
+    BUFFER_SIZE = 256
+
+    def __init__(self, fingerprints: Iterable[int] = (), bloom_bits: Optional[int] = None):
+        """
+        :param fingerprints: Initial fingerprints.
+        :param bloom_bits: Size of the Bloom pre-filter in bits, None for no pre-filter.
+        """
+        self._sorted = array('Q', sorted(set(fingerprints)))
+        self._buffer = set()
+        self.bloom = BloomFilter(bloom_bits) if bloom_bits else None
+        if self.bloom:
+            for fingerprint in self._sorted:
+                self.bloom.add(fingerprint)
+
+    @classmethod
+    def from_value(cls, value: Union[None, str, Iterable[str], 'VisitedSet']) -> 'VisitedSet':
+        """Build from a serialized string, a list of URLs (older records) or another VisitedSet."""
+        if isinstance(value, VisitedSet):
+            return value
+        if not value:
+            return cls()
+        if isinstance(value, str):
+            return cls.from_string(value)
+        return cls(url_fingerprint(url) for url in value)
+
+    @classmethod
+    def from_string(cls, value: str) -> 'VisitedSet':
+        fingerprints = array('Q')
+        fingerprints.frombytes(base64.b64decode(value))
+        return cls(fingerprints)
+
+    def to_string(self) -> str:
+        self._merge()
+        return base64.b64encode(self._sorted.tobytes()).decode('ascii')
+
+    @staticmethod
+    def _key(item: Union[str, int]) -> int:
+        return item if isinstance(item, int) else url_fingerprint(item)
+
+    def _merge(self):
+        if self._buffer:
+            self._sorted = array('Q', sorted(set(self._sorted).union(self._buffer)))
+            self._buffer = set()
+
+    def _in_sorted(self, fingerprint: int) -> bool:
+        i = bisect_left(self._sorted, fingerprint)
+        return i < len(self._sorted) and self._sorted[i] == fingerprint
+
+    def __contains__(self, item: Union[str, int]) -> bool:
+        fingerprint = self._key(item)
+        if self.bloom is not None and fingerprint not in self.bloom:
+            return False
+        return fingerprint in self._buffer or self._in_sorted(fingerprint)
+
+    def add(self, item: Union[str, int]):
+        fingerprint = self._key(item)
+        if fingerprint in self._buffer or self._in_sorted(fingerprint):
+            return
+        self._buffer.add(fingerprint)
+        if self.bloom is not None:
+            self.bloom.add(fingerprint)
+        if len(self._buffer) >= self.BUFFER_SIZE:
+            self._merge()
+
+    def update(self, items: Iterable[Union[str, int]]):
+        for item in items:
+            self.add(item)
+
+    def __len__(self) -> int:
+        return len(self._sorted) + len(self._buffer)
+
+    def __iter__(self) -> Iterator[int]:
+        self._merge()
+        return iter(self._sorted)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __repr__(self) -> str:
+        return f"VisitedSet({len(self)} urls)"
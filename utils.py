@@ -1,15 +1,176 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
+import json
 import os
-from typing import List, Optional
-from company import Company
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+from company import Company, FIELDS, LIST_FIELDS
 
+# Where company records live: a directory of <kvk>.json files or a SQLite store (*.sqlite / *.db).
+# Override with the COMPANIES environment variable.
+DEFAULT_SOURCE = os.environ.get('COMPANIES', './companies')
 
-def load_companies(directory: Optional[str] = './companies') -> List[Company]:
-    companies = []
-    for filename in os.listdir(directory):
-        if filename.endswith('.json'):
-            filepath = os.path.join(directory, filename)
-            companies.append(Company.from_json(filepath))        
-    return companies
+Predicate = Callable[[Company], bool]
+
+
+def is_store_path(path: str) -> bool:
+    """Whether a companies source is a SQLite store rather than a JSON directory."""
+    return path.endswith(('.sqlite', '.db'))
+
+
+# Common predicates for iter_companies. The SQLite store evaluates these with its indexes.
+def with_website(company: Company) -> bool:
+    return bool(company.website)
+
+
+def without_website(company: Company) -> bool:
+    return not company.website
+
+
+def with_careers_page(company: Company) -> bool:
+    return bool(company.careers_page)
+
+
+def without_careers_page(company: Company) -> bool:
+    return not company.careers_page
+
+
+# Predicate -> (CompanyStore.iter keyword, value)
+STORE_FILTERS = {
+    with_website: ('has_website', True),
+    without_website: ('has_website', False),
+    with_careers_page: ('has_careers_page', True),
+    without_careers_page: ('has_careers_page', False),
+}
+
+
+
+def parse_projected(text: str, fields: Sequence[str]) -> dict:
+    """
+    Parse a company record, leaving out the large list fields unless they are in fields.
+    Company.save_to_json writes the list fields last, one top-level key per line, so when none of them
+    are wanted the record is cut before the first one and only the scalar prefix is decoded. A record
+    with a wanted field after the cut, e.g. one edited by hand, is decoded in full.
+    """
+    if any(field in fields for field in LIST_FIELDS):
+        return json.loads(text)
+    cut = -1
+    for field in LIST_FIELDS:
+        idx = text.find(f'\n    "{field}":')
+        if idx != -1 and (cut == -1 or idx < cut):
+            cut = idx
+    if cut == -1:
+        return json.loads(text)
+    try:
+        data = json.loads(text[:cut].rstrip().rstrip(',') + '}')
+    except ValueError:
+        # Not written by save_to_json after all
+        return json.loads(text)
+    tail = text[cut:]
+    if any(field not in data and f'\n    "{field}":' in tail for field in fields):
+        return json.loads(text)
+    return data
+
+
+def iter_companies(source: Optional[str] = None, where: Union[Predicate, Iterable[Predicate], None] = None,
+                   fields: Optional[Iterable[str]] = None, changed_since: Optional[float] = None) -> Iterator[Company]:
+    """
+    Stream companies one at a time, keeping only those matching every predicate.
+    :param source: JSON directory or SQLite store, defaults to DEFAULT_SOURCE.
+    :param where: Predicate or predicates a company must satisfy. They only see the projected fields.
+    :param fields: Fields to load besides name and kvk, None for all. Fields left out keep their stored
+                   values when the company is saved.
+    :param changed_since: Only companies saved at or after this time.time(), None for all. JSON files
+                          are filtered on their modification time without being read.
+    :return: Generator of matching companies.
+    """
+    source = source or DEFAULT_SOURCE
+    if where is None:
+        predicates = []
+    elif callable(where):
+        predicates = [where]
+    else:
+        predicates = list(where)
+
+    if is_store_path(source):
+        from company_store import CompanyStore
+        filters = dict(STORE_FILTERS[p] for p in predicates if p in STORE_FILTERS)
+        predicates = [p for p in predicates if p not in STORE_FILTERS]
+        # Companies saved after the store is closed write through a connection of their own
+        with CompanyStore(source) as store:
+            for company in store.iter(fields=fields, changed_since=changed_since, **filters):
+                if all(predicate(company) for predicate in predicates):
+                    yield company
+        return
+
+    wanted = FIELDS if fields is None else ('name', 'kvk') + tuple(f for f in FIELDS[2:] if f in set(fields))
+    with os.scandir(source) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.json'):
+                continue
+            if changed_since is not None and entry.stat().st_mtime < changed_since:
+                continue
+            with open(entry.path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            data = json.loads(text) if fields is None else parse_projected(text, wanted)
+            company = Company.from_json(data)
+            company.file_path = entry.path
+            company.unloaded = set(FIELDS) - set(wanted)
+            if all(predicate(company) for predicate in predicates):
+                yield company
+
+
+def load_companies(directory: Optional[str] = None) -> List[Company]:
+    return list(iter_companies(directory))
+
+
+def get_companies(kvks: Iterable[str], source: Optional[str] = None,
+                  fields: Optional[Iterable[str]] = None) -> Iterator[Company]:
+    """
+    Load companies by kvk number, skipping unknown ones.
+    :param source: JSON directory or SQLite store, defaults to DEFAULT_SOURCE.
+    :param fields: Fields to load besides name and kvk, None for all. Fields left out keep their stored
+                   values when the company is saved.
+    """
+    source = source or DEFAULT_SOURCE
+    if is_store_path(source):
+        from company_store import CompanyStore
+        with CompanyStore(source) as store:
+            for kvk in kvks:
+                company = store.get(kvk, fields)
+                if company is not None:
+                    yield company
+        return
+
+    wanted = FIELDS if fields is None else ('name', 'kvk') + tuple(f for f in FIELDS[2:] if f in set(fields))
+    for kvk in kvks:
+        path = os.path.join(source, f'{kvk}.json')
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except FileNotFoundError:
+            continue
+        company = Company.from_json(json.loads(text) if fields is None else parse_projected(text, wanted))
+        company.file_path = path
+        company.unloaded = set(FIELDS) - set(wanted)
+        yield company
+
+
+def save_websites(websites: Dict[str, str], source: Optional[str] = None) -> int:
+    """
+    Set the website of companies by kvk number, in one transaction for a SQLite store.
+    :param websites: kvk number -> website.
+    :param source: JSON directory or SQLite store, defaults to DEFAULT_SOURCE.
+    :return: Number of companies updated.
+    """
+    source = source or DEFAULT_SOURCE
+    if is_store_path(source):
+        from company_store import CompanyStore
+        with CompanyStore(source) as store:
+            return store.set_websites(websites.items())
+    saved = 0
+    for company in get_companies(websites, source, fields=()):
+        company.website = websites[company.kvk]
+        company.save()
+        saved += 1
+    return saved
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import itertools
+import re
+import sqlite3
+import time
+import unicodedata
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, quote_plus, urlparse
+
+import requests
+from bs4 import BeautifulSoup
+
+from fetcher import get_fetcher
+from metrics import get_metrics
+from rate_limiter import TokenBucket, parse_retry_after
+
+DEFAULT_CACHE_PATH = 'website_cache.sqlite'
+# Longest wait between retries after a 429 without a rate limiter
+MAX_BACKOFF = 600.0
+
+# Legal forms that do not help to tell companies apart
+LEGAL_FORMS = re.compile(r'\b(b\.?v\.?|n\.?v\.?|v\.?o\.?f\.?|c\.?v\.?|holding|ltd\.?|limited|gmbh|inc\.?)(?=\s|$)')
+
+
+def normalize_company_name(name: str) -> str:
+    """Cache key for a company name: lowercase ASCII, no legal form, no punctuation."""
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii').lower()
+    name = LEGAL_FORMS.sub(' ', name)
+    name = re.sub(r'[^a-z0-9]+', ' ', name)
+    return name.strip()
+
+
+class SearchBackend:
+    """
+    Name -> website resolution through a search results page; the first <a href> is taken as the website.
+    """
+
+    name = 'search'
+    search_url = ''
+    headers: Dict[str, str] = {}
+
+    def __init__(self, retries: int = 50, bucket: Optional[TokenBucket] = None, delay: float = 1.0):
+        """
+        :param retries: Attempts before giving up on a throttled search.
+        :param bucket: Rate limiter shared by the pool workers. Without one, a 429 is followed by the
+                       Retry-After period or an exponential backoff starting at delay.
+        :param delay: Seconds to wait after the first 429 when there is no bucket.
+        """
+        self.retries = retries
+        self.bucket = bucket
+        self.delay = delay
+
+    def resolve(self, query: str) -> Optional[str]:
+        """
+        :return: The first result, or None if the search failed.
+        """
+        attempt = 0
+        while attempt < self.retries:
+            # Wait for a token; after a 429 every worker slows down together
+            if self.bucket:
+                self.bucket.acquire()
+
+            try:
+                response = get_fetcher().get(self.search_url.format(query=quote_plus(query)), headers=self.headers,
+                                             revalidate=False, timeout=30)
+            except requests.exceptions.RequestException as e:
+                print(f"Request error: {e}")
+                return None
+
+            # Check if 429 status code is returned
+            if response.status_code == 429:
+                attempt += 1
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if self.bucket:
+                    self.bucket.on_throttle(retry_after)
+                    print(f"429 Too Many Requests encountered. Rate lowered to {self.bucket.rate:.2f} requests/s")
+                elif attempt < self.retries:
+                    wait = retry_after if retry_after is not None else min(self.delay * 2 ** (attempt - 1), MAX_BACKOFF)
+                    print(f"429 Too Many Requests encountered. Retrying in {wait:.0f} seconds...")
+                    time.sleep(wait)
+                continue
+            if self.bucket:
+                self.bucket.on_success()
+            # Parse the first result from the search page (using BeautifulSoup)
+            soup = BeautifulSoup(response.text, 'html.parser')
+            first_link = soup.find('a', href=True)
+            return first_link.get('href') if first_link else None
+
+        print("Failed to get result after several attempts.")
+        return None
+
+
+class GoogleBackend(SearchBackend):
+    name = 'google'
+    search_url = 'https://www.google.com/search?q={query}'
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5)\
+            AppleWebKit/537.36 (KHTML, like Gecko) Cafari/537.36'
+    }
+
+
+class LocalHTTPBackend(SearchBackend):
+    """Backend for the local stand-in search server, to load-test the pipeline offline."""
+
+    name = 'local'
+
+    def __init__(self, base_url: str = 'http://127.0.0.1:8808', **kwargs):
+        super().__init__(**kwargs)
+        self.search_url = base_url.rstrip('/') + '/search?q={query}'
+
+
+class WebsiteCache:
+    """Persistent name -> website results, keyed by normalized company name."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # Opened lazily so every pool worker gets its own connection
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=30)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS websites ('
+                             'name TEXT PRIMARY KEY, website TEXT, backend TEXT, resolved_at REAL)')
+            self._db.commit()
+        return self._db
+
+    def get(self, key: str) -> Optional[str]:
+        row = self.db.execute('SELECT website FROM websites WHERE name = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, website: str, backend: str):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO websites VALUES (?, ?, ?, ?)', (key, website, backend, time.time()))
+
+    def __getstate__(self) -> dict:
+        return {'path': self.path}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state['path'])
+
+
+class ResolverStats:
+    """Cache hit rate and per-backend latency of website lookups."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        # backend -> [count, total seconds, max seconds]
+        self.latency: Dict[str, list] = dict()
+
+    def record(self, hit: bool, backend: Optional[str], seconds: float, found: bool = True):
+        result = 'cached' if hit else 'found' if found else 'not_found'
+        metrics = get_metrics()
+        metrics.counter('websites_resolved_total', 'Website lookups by backend and result').inc(
+            backend=backend or 'cache', result=result)
+        if not hit and backend:
+            metrics.histogram('lookup_seconds', 'Website lookup latency per backend').observe(seconds, backend=backend)
+        if hit:
+            self.hits += 1
+            return
+        self.misses += 1
+        if not found:
+            self.failures += 1
+        if backend:
+            entry = self.latency.setdefault(backend, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def summary(self) -> str:
+        lookups = self.hits + self.misses
+        lines = [f"Website cache: {self.hits}/{lookups} hits ({self.hits / lookups if lookups else 0:.1%}), "
+                 f"{self.failures} failed lookups"]
+        for backend, (count, total, slowest) in self.latency.items():
+            lines.append(f"  {backend}: {count} lookups, {total / count:.2f}s mean, {slowest:.2f}s max")
+        return '\n'.join(lines)
+
+
+class WebsiteResolver:
+    """Resolve company names to websites through a backend, caching results by normalized name."""
+
+    def __init__(self, backend: SearchBackend, cache: Optional[WebsiteCache] = None):
+        self.backend = backend
+        self.cache = cache
+
+    def resolve(self, name: str) -> tuple:
+        """
+        :return: (website or None, cache hit, backend latency in seconds)
+        """
+        key = normalize_company_name(name) or name
+        if self.cache:
+            website = self.cache.get(key)
+            if website:
+                return website, True, 0.0
+        started = time.monotonic()
+        website = self.backend.resolve(name)
+        elapsed = time.monotonic() - started
+        if website and self.cache:
+            self.cache.put(key, website, self.backend.name)
+        return website, False, elapsed
+
+
+class StandinSearchHandler(BaseHTTPRequestHandler):
+    """Answers /search?q=<name> with a single deterministic result link."""
+
+    # Extra seconds to wait before answering, to mimic a real search engine
+    delay = 0.0
+    # Answer every this many requests with a 429, 0 to never throttle
+    throttle_every = 0
+    requests = itertools.count(1)
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query).get('q', [''])[0]
+        if parsed.path != '/search' or not query:
+            self.send_error(404)
+            return
+        if self.delay:
+            time.sleep(self.delay)
+        if self.throttle_every and next(self.requests) % self.throttle_every == 0:
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        slug = normalize_company_name(query).replace(' ', '-') or 'unknown'
+        body = f'<html><body><a href="https://www.{slug}.example/">{query}</a></body></html>'.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_standin(port: int = 8808, delay: float = 0.0, throttle_every: int = 0):
+    """Run the local stand-in search server until interrupted."""
+    handler = type('Handler', (StandinSearchHandler,), {'delay': delay, 'throttle_every': throttle_every,
+                                                        'requests': itertools.count(1)})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    print(f"Stand-in search backend on http://127.0.0.1:{port}/search?q=...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    argparser = argparse.ArgumentParser(description="Run the local stand-in search backend.")
+    argparser.add_argument("--port", type=int, default=8808)
+    argparser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before each answer.")
+    argparser.add_argument("--throttle-every", type=int, default=0,
+                           help="Answer every this many requests with a 429, to exercise the backoff.")
+    args = argparser.parse_args()
+    serve_standin(args.port, args.delay, args.throttle_every)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional
+
+DEFAULT_QUEUE_PATH = 'work_queue.sqlite'
+
+# Item states
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def worker_id() -> str:
+    """Identifier of this worker process, unique across machines."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class WorkQueue:
+    """
+    Lease-based queue of kvk numbers per pipeline stage, on a SQLite file shared by all workers.
+
+    Workers claim batches under a lease that expires unless renewed with heartbeat(). Items whose lease
+    expired, because their worker died or hung, are handed out again; after max_attempts claims they are
+    marked failed. complete() and release() only affect items still leased by the calling worker, so a
+    worker that lost its lease cannot overwrite the outcome of the worker that took over.
+
+    The database uses a rollback journal rather than WAL: WAL needs shared memory on a single host,
+    while a rollback journal works for workers on several machines sharing the file over a network
+    file system with working locks.
+    """
+
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH, stage: str = 'crawl', max_attempts: int = 3):
+        """
+        :param path: Path of the shared queue database.
+        :param stage: Pipeline stage the items belong to, e.g. 'website' or 'crawl'.
+        :param max_attempts: Number of claims before an item is marked failed.
+        """
+        self.path = path
+        self.stage = stage
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=60, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=DELETE')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS items (
+                stage TEXT NOT NULL,
+                kvk TEXT NOT NULL,
+                status TEXT NOT NULL,
+                owner TEXT,
+                expires_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (stage, kvk)
+            );
+            CREATE INDEX IF NOT EXISTS idx_items_claim ON items (stage, status, expires_at);
+        ''')
+
+    def __getstate__(self) -> dict:
+        return {'path': self.path, 'stage': self.stage, 'max_attempts': self.max_attempts}
+
+    def __setstate__(self, state: dict):
+        self.__init__(**state)
+
+    def __enter__(self) -> 'WorkQueue':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    def _transaction(self, sql: str, params: Iterable = (), many: bool = False) -> int:
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers never claim the same rows
+        with self._lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                cursor = self.db.executemany(sql, params) if many else self.db.execute(sql, params)
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            return cursor.rowcount
+
+    def enqueue(self, kvks: Iterable[str]) -> int:
+        """
+        Add items to the stage; items already queued, leased or done are left alone.
+        :return: Number of items added.
+        """
+        now = time.time()
+        return self._transaction('INSERT OR IGNORE INTO items (stage, kvk, status, updated_at) VALUES (?, ?, ?, ?)',
+                                 ((self.stage, kvk, PENDING, now) for kvk in kvks), many=True)
+
+    def claim(self, owner: str, batch_size: int = 50, lease_seconds: float = 300.0) -> List[str]:
+        """
+        Lease up to batch_size pending items, or items whose lease expired.
+        :return: The claimed kvk numbers, empty when the stage has no work left.
+        """
+        now = time.time()
+        with self._lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                # Items that used up their attempts, pending again or with an expired lease, are given up on
+                self.db.execute('UPDATE items SET status = ?, owner = NULL, expires_at = NULL, updated_at = ? '
+                                'WHERE stage = ? AND attempts >= ? AND (status = ? OR (status = ? AND expires_at < ?))',
+                                (FAILED, now, self.stage, self.max_attempts, PENDING, LEASED, now))
+                kvks = [row[0] for row in self.db.execute(
+                    'SELECT kvk FROM items WHERE stage = ? AND (status = ? OR (status = ? AND expires_at < ?)) '
+                    'ORDER BY attempts, kvk LIMIT ?', (self.stage, PENDING, LEASED, now, batch_size))]
+                self.db.executemany('UPDATE items SET status = ?, owner = ?, expires_at = ?, attempts = attempts + 1, '
+                                    'updated_at = ? WHERE stage = ? AND kvk = ?',
+                                    [(LEASED, owner, now + lease_seconds, now, self.stage, kvk) for kvk in kvks])
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+        return kvks
+
+    def heartbeat(self, owner: str, kvks: Iterable[str], lease_seconds: float = 300.0) -> int:
+        """
+        Extend the lease on items still held by owner.
+        :return: Number of leases extended.
+        """
+        now = time.time()
+        return self._transaction('UPDATE items SET expires_at = ?, updated_at = ? '
+                                 'WHERE stage = ? AND kvk = ? AND owner = ? AND status = ?',
+                                 [(now + lease_seconds, now, self.stage, kvk, owner, LEASED) for kvk in kvks],
+                                 many=True)
+
+    def complete(self, owner: str, kvks: Iterable[str]) -> int:
+        """
+        Mark items done.
+        :return: Number of items completed; items whose lease was lost are not counted.
+        """
+        now = time.time()
+        return self._transaction('UPDATE items SET status = ?, owner = NULL, expires_at = NULL, updated_at = ? '
+                                 'WHERE stage = ? AND kvk = ? AND owner = ? AND status = ?',
+                                 [(DONE, now, self.stage, kvk, owner, LEASED) for kvk in kvks], many=True)
+
+    def release(self, owner: str, kvks: Iterable[str]) -> int:
+        """
+        Hand leased items back to the queue without completing them, e.g. on shutdown or after a failure.
+        Items that used up their max_attempts are marked failed instead.
+        :return: Number of items released.
+        """
+        now = time.time()
+        return self._transaction('UPDATE items SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, owner = NULL, '
+                                 'expires_at = NULL, updated_at = ? '
+                                 'WHERE stage = ? AND kvk = ? AND owner = ? AND status = ?',
+                                 [(self.max_attempts, FAILED, PENDING, now, self.stage, kvk, owner, LEASED)
+                                  for kvk in kvks], many=True)
+
+    def reset(self, statuses: Iterable[str] = (DONE, FAILED)) -> int:
+        """
+        Make finished items of the stage pending again, e.g. before the next run.
+        :return: Number of items reset.
+        """
+        statuses = tuple(statuses)
+        return self._transaction(f'UPDATE items SET status = ?, owner = NULL, expires_at = NULL, attempts = 0, '
+                                 f'updated_at = ? WHERE stage = ? AND status IN ({", ".join("?" * len(statuses))})',
+                                 (PENDING, time.time(), self.stage) + statuses)
+
+    def counts(self) -> Dict[str, int]:
+        """Number of items of the stage per status."""
+        with self._lock:
+            return dict(self.db.execute('SELECT status, COUNT(*) FROM items WHERE stage = ? GROUP BY status',
+                                        (self.stage,)).fetchall())
+
+    def summary(self) -> str:
+        counts = self.counts()
+        return f"Queue '{self.stage}': " + ', '.join(f"{counts.get(status, 0)} {status}"
+                                                     for status in (PENDING, LEASED, DONE, FAILED))
+
+
+class Lease:
+    """
+    Items claimed from a WorkQueue, kept alive by a heartbeat thread until completed or released.
+
+    Use as a context manager; items not completed when the block exits are released back to the queue.
+    """
+
+    def __init__(self, queue: WorkQueue, owner: str, kvks: List[str], lease_seconds: float = 300.0):
+        self.queue = queue
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.pending = set(kvks)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+
+    def _heartbeat(self):
+        # Renew well before expiry so a slow database round trip does not lose the lease
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._lock:
+                kvks = list(self.pending)
+            if kvks:
+                self.queue.heartbeat(self.owner, kvks, self.lease_seconds)
+
+    def complete(self, kvks: Iterable[str]) -> int:
+        kvks = list(kvks)
+        with self._lock:
+            self.pending.difference_update(kvks)
+        return self.queue.complete(self.owner, kvks)
+
+    def __enter__(self) -> 'Lease':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        with self._lock:
+            kvks, self.pending = list(self.pending), set()
+        if kvks:
+            self.queue.release(self.owner, kvks)
+
+
+def leases(queue: WorkQueue, batch_size: int = 50, lease_seconds: float = 300.0,
+           owner: Optional[str] = None):
+    """
+    Claim batches from the queue until it runs dry.
+    e.g. for lease in leases(queue): with lease: ... lease.complete(kvks)
+    """
+    owner = owner or worker_id()
+    while True:
+        kvks = queue.claim(owner, batch_size, lease_seconds)
+        if not kvks:
+            return
+        yield Lease(queue, owner, kvks, lease_seconds)
+
+
+if __name__ == "__main__":
+    import argparse
+    from utils import iter_companies, with_website, without_careers_page, without_website
+
+    # Companies each stage works on
+    STAGES = {
+        'website': [without_website],
+        'crawl': [with_website, without_careers_page],
+    }
+
+    argparser = argparse.ArgumentParser(description="Manage the shared work queue.")
+    argparser.add_argument("action", choices=['seed', 'status', 'reset'],
+                           help="seed: queue the companies a stage still has to do, status: show counts, "
+                                "reset: make done and failed items pending again.")
+    argparser.add_argument("--stage", choices=sorted(STAGES), default='crawl')
+    argparser.add_argument("--queue", default=DEFAULT_QUEUE_PATH, help="Path of the shared queue database.")
+    args = argparser.parse_args()
+
+    with WorkQueue(args.queue, args.stage) as queue:
+        if args.action == 'seed':
+            companies = iter_companies(where=STAGES[args.stage], fields=('website', 'careers_page'))
+            added = queue.enqueue(company.kvk for company in companies)
+            print(f"Queued {added} companies")
+        elif args.action == 'reset':
+            print(f"Reset {queue.reset()} items")
+        print(queue.summary())